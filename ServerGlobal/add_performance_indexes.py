@@ -15,6 +15,13 @@ def add_indexes():
         ON user_books (user_id, last_accessed_at DESC);
         """,
 
+        # Paged listen history: only started books, stable order for LIMIT/OFFSET
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_books_history_recent
+        ON user_books (user_id, last_accessed_at DESC, book_id DESC)
+        WHERE last_played_position_seconds > 0;
+        """,
+
         # Optimize sub-queries for avg rating (Covering index)
         """
         CREATE INDEX IF NOT EXISTS idx_book_ratings_stats
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Add waveform/loudness columns and backfill them for existing tracks.
+
+Columns:
+    playlist_items.waveform_peaks  BYTEA  - WAVEFORM_BUCKETS int8 peaks (0..127)
+    playlist_items.loudness_lufs   REAL   - integrated loudness (BS.1770)
+    books.waveform_peaks / books.loudness_lufs - same, for single-file books
+
+Usage:
+    python add_waveform_columns.py            # add columns only
+    python add_waveform_columns.py --backfill # add columns and analyze tracks missing peaks
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import urllib.request
+
+from database import Database
+from audio_utils import analyze_audio
+from r2_storage import is_r2_ref, get_r2_key, get_r2_client, R2_BUCKET_NAME
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def add_columns(db):
+    for table in ("playlist_items", "books"):
+        print(f"Adding waveform columns to {table}...")
+        db.execute_query(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS waveform_peaks BYTEA DEFAULT NULL")
+        db.execute_query(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS loudness_lufs REAL DEFAULT NULL")
+
+
+def fetch_to_temp(stored_path, temp_dir):
+    """Get a local copy of a stored audio file. Returns a path or None."""
+    if not stored_path:
+        return None
+
+    name = os.path.basename(stored_path.split('?')[0]) or "audio"
+    target = os.path.join(temp_dir, name)
+
+    if is_r2_ref(stored_path):
+        get_r2_client().download_file(R2_BUCKET_NAME, get_r2_key(stored_path), target)
+        return target
+
+    # Local static file (relative path or our own static URL)
+    marker = 'static/'
+    if marker in stored_path:
+        local = os.path.join(SERVER_DIR, 'static', stored_path.split(marker, 1)[1].split('?')[0])
+        if os.path.exists(local):
+            return local
+
+    if stored_path.startswith('http'):
+        urllib.request.urlretrieve(stored_path, target)
+        return target
+
+    local = os.path.join(SERVER_DIR, 'static', 'AudioBooks', stored_path.lstrip('/'))
+    return local if os.path.exists(local) else None
+
+
+def backfill(db):
+    tracks = db.execute_query(
+        "SELECT id, file_path AS path FROM playlist_items WHERE waveform_peaks IS NULL ORDER BY id"
+    ) or []
+    books = db.execute_query("""
+        SELECT b.id, b.audio_path AS path FROM books b
+        WHERE b.waveform_peaks IS NULL
+          AND NOT EXISTS (SELECT 1 FROM playlist_items pi WHERE pi.book_id = b.id)
+        ORDER BY b.id
+    """) or []
+
+    print(f"Backfilling {len(tracks)} tracks and {len(books)} single-file books...")
+
+    for table, rows in (("playlist_items", tracks), ("books", books)):
+        done = 0
+        for row in rows:
+            temp_dir = tempfile.mkdtemp()
+            try:
+                local_path = fetch_to_temp(row['path'], temp_dir)
+                if not local_path:
+                    print(f"  Skipping {table} {row['id']}: file not found ({row['path']})")
+                    continue
+                analysis = analyze_audio(local_path)
+                if not analysis:
+                    continue
+                db.execute_query(
+                    f"UPDATE {table} SET waveform_peaks = %s, loudness_lufs = %s WHERE id = %s",
+                    (analysis['waveform_peaks'], analysis['loudness_lufs'], row['id'])
+                )
+                done += 1
+            except Exception as e:
+                print(f"  Error on {table} {row['id']}: {e}")
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        print(f"  {table}: analyzed {done}/{len(rows)}")
+
+
+def migrate(run_backfill=False):
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database.")
+        return
+
+    try:
+        add_columns(db)
+        if run_backfill:
+            backfill(db)
+        print("Migration successful.")
+    except Exception as e:
+        print(f"Error during migration: {e}")
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    migrate(run_backfill="--backfill" in sys.argv)
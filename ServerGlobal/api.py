@@ -1,14 +1,16 @@
 from gevent import monkey
 monkey.patch_all()
 
-from flask import Flask, jsonify, request, send_from_directory, Response
+from flask import Flask, jsonify, request, send_from_directory, Response, g, make_response
+from flask.json.provider import DefaultJSONProvider
+import metrics
 try:
     import orjson
-    from flask.json.provider import DefaultJSONProvider
     from decimal import Decimal
     class OrjsonProvider(DefaultJSONProvider):
         def dumps(self, obj, **kwargs):
-            return orjson.dumps(obj, default=self._default).decode()
+            with metrics.span("serialize"):
+                return orjson.dumps(obj, default=self._default).decode()
         def loads(self, s, **kwargs):
             return orjson.loads(s)
         @staticmethod
@@ -19,6 +21,18 @@ try:
     _has_orjson = True
 except ImportError:
     _has_orjson = False
+try:
+    import brotli
+    _has_brotli = True
+except ImportError:
+    _has_brotli = False
+import gzip
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Stock provider, timed like OrjsonProvider for Server-Timing."""
+    def dumps(self, obj, **kwargs):
+        with metrics.span("serialize"):
+            return super().dumps(obj, **kwargs)
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -28,14 +42,17 @@ from werkzeug.utils import secure_filename
 import os
 import secrets
 import base64
+import time
+from functools import wraps
 # from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 # from cryptography.hazmat.backends import default_backend
 from werkzeug.security import generate_password_hash, check_password_hash
-from database import Database
+from database import Database, mark_user_write
 from badge_service import BadgeService
 from mutagen import File as MutagenFile
 from image_utils import ensure_thumbnail_exists, create_thumbnail
-from r2_storage import upload_fileobj_to_r2, upload_local_file_to_r2, is_r2_enabled, is_r2_ref, get_r2_key, resolve_url, generate_presigned_url, R2_PUBLIC_DOMAIN
+from audio_utils import analyze_audio, encode_waveform
+from r2_storage import upload_fileobj_to_r2, upload_local_file_to_r2, is_r2_enabled, is_r2_ref, get_r2_key, resolve_url, generate_presigned_url, R2_PUBLIC_DOMAIN, R2_URL_EXPIRY
 import tempfile
 import shutil
 import wave
@@ -49,7 +66,15 @@ from jwt_config import generate_access_token, generate_refresh_token
 from jwt_middleware import jwt_required, blacklist_token
 import update_server_ip # Auto-update DB IP on startup
 from session_manager import SessionManager
-from cache_utils import cache, invalidate_user_cache
+from cache_utils import cache, invalidate_user_cache, invalidate_subscription_cache, etag, catalog_version, user_version, bump_catalog_version
+from listening_rollup import record_playback, build_listening_charts, get_total_listening_seconds
+from composite import Section, run_sections
+import category_closure
+import reels_feed
+import reels_state
+import library_changes
+import structured_log
+import sql_profiler
 
 def generate_aes_key():
     """Generate a random 256-bit AES key and return as base64 string."""
@@ -90,12 +115,17 @@ app = Flask(__name__)
 if _has_orjson:
     app.json_provider_class = OrjsonProvider
     app.json = OrjsonProvider(app)
+else:
+    app.json_provider_class = TimedJSONProvider
+    app.json = TimedJSONProvider(app)
 # Enable CORS for all routes (for web clients if any, but we are restricting now)
 # We can keep CORS for development or specific origins, but the header check is stronger.
 CORS(app)
 
 # RATE LIMITING: 150 requests per minute per IP
 # 150/min is a balanced limit for active users vs shared networks
+# (RATELIMIT_ENABLED=false turns it off for local benchmarks, where all traffic is one IP)
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
 limiter = Limiter(
     get_remote_address,
     app=app,
@@ -108,6 +138,18 @@ limiter = Limiter(
 APP_SOURCE_HEADER = "X-App-Source"
 APP_SOURCE_VALUE = "Echo_Secured_9xQ2zP5mL8kR4wN1vJ7"
 
+# Prometheus scrape endpoint: bearer METRICS_TOKEN if set, otherwise loopback only
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Include (redacted) JSON request bodies in request logs; for debugging only
+LOG_REQUEST_BODIES = os.getenv('LOG_REQUEST_BODIES', 'false').lower() in ('1', 'true', 'yes')
+# Send Server-Timing on every response (browsers/devtools show it; off by default)
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+@app.before_request
+def begin_request_metrics():
+    # Registered first so the context exists even when a later hook rejects the request
+    metrics.begin_request(request.url_rule.rule if request.url_rule else None)
+
 @app.before_request
 def check_app_source():
     # Allow OPTIONS requests (CORS preflight) to pass without header
@@ -122,6 +164,10 @@ def check_app_source():
     if request.path.startswith('/shared/'):
         return
 
+    # Metrics scraper authenticates separately
+    if request.path == '/metrics':
+        return
+
     # Enforce Secret Header
     client_secret = request.headers.get(APP_SOURCE_HEADER)
     if client_secret != APP_SOURCE_VALUE:
@@ -267,27 +313,174 @@ def has_book_access(user_id, book_id, db):
     result = db.execute_query(query, (user_id, book_id))
     return len(result) > 0 if result else False
 
-@app.before_request
-def log_request_info():
-    print("="*50, flush=True)
-    print(f"[DEBUG] Request: {request.method} {request.url}", flush=True)
-    # print(f"[DEBUG] Headers: {request.headers}", flush=True) 
-    if request.content_type == 'application/json':
-        print(f"[DEBUG] JSON Body: {request.get_json(silent=True)}", flush=True)
-    elif request.content_type and 'multipart/form-data' in request.content_type:
-         print(f"[DEBUG] Form Data: {request.form}", flush=True)
-         print(f"[DEBUG] Files: {request.files}", flush=True)
+# ===================== CONDITIONAL GET (ETags) =====================
+# A tag never outlives ETAG_MAX_AGE: bounds any write path that doesn't bump a
+# version, and keeps pre-signed URLs in a revalidated body within their expiry.
+ETAG_MAX_AGE = int(os.getenv('ETAG_MAX_AGE', '3600'))
+if not R2_PUBLIC_DOMAIN:
+    ETAG_MAX_AGE = min(ETAG_MAX_AGE, R2_URL_EXPIRY // 2)
+
+
+def conditional(version_parts, cache_control=None):
+    """
+    Answer 304 Not Modified while the client's If-None-Match is still current.
+
+    version_parts(*view_args) returns the versions the response is built from
+    (cache_utils.catalog_version / user_version); the path and query string
+    are always part of the tag. No DB query or serialization happens on a 304.
+    The view can read the tag from g.etag and must key any server-side cache
+    by it, so a cached body is never served under a newer tag.
+
+    Goes below @jwt_required: a 304 still needs a valid token.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            g.etag = etag(request.full_path, int(time.time() // ETAG_MAX_AGE), *version_parts(*args, **kwargs))
+            if request.if_none_match.contains_weak(g.etag):
+                response = Response(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(g.etag, weak=True)
+            if cache_control:
+                response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
+
+
+def user_catalog_versions(*args, **kwargs):
+    """Versions for per-user catalog screens (?user_id=...)."""
+    user_id = request.args.get('user_id', type=int)
+    return catalog_version(), user_version(user_id) if user_id else None
+
+
+def user_subscription_versions(*args, **kwargs):
+    """
+    user_catalog_versions plus the subscription state, for bodies carrying
+    isSubscribed: a subscription lapsing at end_date bumps no version. Uses
+    is_subscriber()'s 60s cache, so at most one primary-key read per minute.
+    """
+    user_id = request.args.get('user_id', type=int)
+    subscribed = None
+    if user_id:
+        subscribed = cache.get(f"sub:{user_id}")
+        if subscribed is None:
+            db = Database(replica=True, user_id=user_id)
+            if db.connect():
+                try:
+                    subscribed = is_subscriber(user_id, db)
+                finally:
+                    db.disconnect()
+    return user_catalog_versions() + (subscribed,)
+
+
+def category_versions(*args, **kwargs):
+    return (catalog_version("categories"),)
+
+
+# ===================== PRE-ENCODED RESPONSES =====================
+# Hot cached endpoints store the final response bytes, not the dict: the JSON
+# body plus gzip/brotli variants, all built once when the cache is filled.
+# A hit picks a variant by Accept-Encoding and does no serialization or
+# compression work.
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # per fill, not per request, but fills still sit on the request path
+
+
+def encode_json(data):
+    """{content-encoding: body bytes} for data, serialized with the app's JSON provider."""
+    body = app.json.dumps(data).encode()
+    variants = {"identity": body}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        with metrics.span("compress"):
+            variants["gzip"] = gzip.compress(body, GZIP_LEVEL)
+            if _has_brotli:
+                variants["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return variants
+
+
+def encoded_response(variants, status=200):
+    """JSON response from encode_json() output, in the best encoding the client accepts."""
+    offered = [name for name in ("br", "gzip") if name in variants]
+    encoding = request.accept_encodings.best_match(offered) if offered else None
+    response = Response(variants[encoding or "identity"], status=status, mimetype="application/json")
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if offered:
+        response.vary.add('Accept-Encoding')
+    return response
+
+@app.after_request
+def mark_read_your_writes(response):
+    # Reads routed to a replica stay on the primary for a while after this user writes
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+        user_id = getattr(request, 'user_id', None)
+        if user_id is None:
+            body = request.get_json(silent=True) if request.is_json else None
+            user_id = (body or {}).get('user_id') if isinstance(body, dict) else None
+        if user_id is None:
+            user_id = request.args.get('user_id')
+        mark_user_write(user_id)
+    return response
+
+@app.after_request
+def finish_request_metrics(response):
+    ctx = metrics.end_request()
+    if ctx is None:
+        return response
+    total = metrics.finish_request(ctx, request.method, response.status_code)
+    if SERVER_TIMING_ENABLED:
+        response.headers['Server-Timing'] = metrics.server_timing(ctx, total)
+    # Per-request pool usage for clients that ask for it with X-Debug-Pool: 1
+    if request.headers.get('X-Debug-Pool') == '1':
+        stats = ctx.stats
+        response.headers['X-DB-Pool'] = (
+            f"acquires={stats.get('acquires', 0)};"
+            f"failed={stats.get('failed', 0)};"
+            f"wait_ms={stats.get('wait_ms', 0):.1f};"
+            f"hold_ms={stats.get('hold_ms', 0):.1f}"
+        )
+    return response
 
 @app.after_request
-def log_response_info(response):
-    print(f"[DEBUG] Response Status: {response.status}", flush=True)
-    print("="*50, flush=True)
+def log_request(response):
+    # Registered after finish_request_metrics, so it runs first and the context is still set
+    ctx = metrics.current_context()
+    status = response.status_code
+    fields = {
+        "method": request.method,
+        "path": request.path,
+        "status": status,
+        "remote": request.headers.get('X-Forwarded-For', request.remote_addr),
+    }
+    if request.args:
+        fields["args"] = request.args.to_dict()
+    if ctx is not None:
+        fields["duration_ms"] = round(ctx.elapsed() * 1000, 1)
+        fields["db_queries"] = ctx.stats.get("db_queries", 0)
+    if LOG_REQUEST_BODIES and request.is_json:
+        # Never form/multipart data: uploads would end up in the log
+        fields["body"] = request.get_json(silent=True)
+    level = "error" if status >= 500 else "warning" if status >= 400 else "info"
+    structured_log.log(level, "request", route=ctx.route if ctx else None, **fields)
     return response
 
-print("--------------------------------------------------")
-print("   DEBUG LOGGING MIDDLEWARE IS ACTIVE")
-print("   Requests will be printed here...")
-print("--------------------------------------------------")
+@app.after_request
+def report_sql_profile(response):
+    # Only does anything with SQL_PROFILER_ENABLED; runs before the context is ended
+    if not sql_profiler.ENABLED:
+        return response
+    ctx = metrics.current_context()
+    if ctx is None or ctx.profile is None:
+        return response
+    sql_profiler.report(ctx, request.method, request.path)
+    if request.headers.get('X-Debug-SQL') == '1':
+        response.headers['X-SQL-Profile'] = sql_profiler.summary_header(ctx.profile)
+    return response
 
 # ... existing build_category_tree ...
 
@@ -901,7 +1094,7 @@ def delete_account():
             blacklist_token(access_token, access_exp)
 
             # Invalidate cache
-            invalidate_user_cache(user_id)
+            invalidate_subscription_cache(user_id)
 
             return jsonify({"message": "Account deleted successfully"}), 200
         finally:
@@ -1193,43 +1386,19 @@ def get_user_profile():
 
 def build_category_tree(categories, parent_id=None):
     """
-    Recursively builds a tree of categories.
-    categories is a list of dicts (rows) from the DB.
+    Builds the nested category tree served by /categories.
+    categories is a list of dicts (rows) from the DB; each node uses the slug as 'id'.
     """
-    branch = []
-    for cat in categories:
-        # Check if this category is a child of the current parent_id
-        # In the DB, parent_id might be None for root, or an int.
-        # Python's None == None is True.
-        
-        # We need to handle the fact that execute_query returns dicts
-        # assuming 'id', 'name', 'parent_id' are keys.
-        
-        row_parent_id = cat.get('parent_id')
-        
-        if row_parent_id == parent_id:
-            children = build_category_tree(categories, cat['id'])
-            
-            # Construct dictionary matching the Flutter model expectations if possible
-            # Flutter model uses 'id' (string) and 'title'. 
-            # We use the 'slug' from DB as the 'id' for the app.
-            
-            node = {
-                'id': cat['slug'], # Use slug (e.g. 'python') as ID
-                'title': cat['name'],
-                'children': children,
-                # 'hasBooks': ... we could check this if we had books
-            }
-            branch.append(node)
-            
-    return branch
+    return category_closure.build_tree(categories, parent_id)
 
 @app.route('/categories', methods=['GET'])
+@conditional(category_versions)
 def get_categories():
     # Check cache
-    cached_data = cache.get("categories")
+    cache_key = f"categories:{g.etag}"
+    cached_data = cache.get(cache_key)
     if cached_data:
-        response = jsonify(cached_data)
+        response = encoded_response(cached_data)
         response.headers['Cache-Control'] = 'public, max-age=300'  # 5 min CDN cache
         return response
 
@@ -1247,8 +1416,9 @@ def get_categories():
         # Build tree
         tree = build_category_tree(result)
         
-        cache.set("categories", tree, 300)
-        response = jsonify(tree)
+        encoded = encode_json(tree)
+        cache.set(cache_key, encoded, 300)
+        response = encoded_response(encoded)
         response.headers['Cache-Control'] = 'public, max-age=300'  # 5 min CDN cache
         return response
         
@@ -1259,11 +1429,12 @@ def get_categories():
 
 @app.route('/playlist/<int:book_id>', methods=['GET'])
 @jwt_required
+@conditional(user_catalog_versions, cache_control='private, no-cache')
 def get_playlist(book_id):
     user_id = request.args.get('user_id')
     
     # Check cache (30s)
-    cache_key = f"playlist:{user_id}:{book_id}" if user_id else f"playlist:anon:{book_id}"
+    cache_key = f"playlist:{user_id}:{book_id}:{g.etag}" if user_id else f"playlist:anon:{book_id}:{g.etag}"
     cached_pl = cache.get(cache_key)
     if cached_pl:
         return jsonify(cached_pl)
@@ -1295,67 +1466,42 @@ def get_playlist(book_id):
                 item['is_completed'] = bool(item.get('is_completed', 0))
                 if item.get('file_path'):
                     item['file_path'] = resolve_stored_url(item['file_path'], "AudioBooks")
-
-            # Check for quiz containing questions
-            quiz_exists = False
-            q_query = """
-                SELECT q.id 
-                FROM quizzes q
-                INNER JOIN quiz_questions qq ON q.id = qq.quiz_id
-                WHERE q.book_id = %s AND q.playlist_item_id IS NULL
-                LIMIT 1
-            """
-            # Reuse DB connection? Yes.
-            q_res = db.execute_query(q_query, (book_id,))
-            if q_res:
-                quiz_exists = True
-                
-            # Check if quiz is passed by THIS user
-            quiz_passed = False
-            if quiz_exists and user_id:
-               # We need quiz_id. The previous query just checked existence.
-               # Let's get quiz_id
-               qid_query = "SELECT id FROM quizzes WHERE book_id = %s AND playlist_item_id IS NULL"
-               qid_res = db.execute_query(qid_query, (book_id,))
-               if qid_res:
-                   quiz_id = qid_res[0]['id']
-                   pass_query = "SELECT is_passed FROM user_quiz_results WHERE user_id = %s AND quiz_id = %s ORDER BY completed_at DESC LIMIT 1"
-                   pass_res = db.execute_query(pass_query, (user_id, quiz_id))
-                   if pass_res and pass_res[0]['is_passed']:
-                       quiz_passed = True
-
-            # Check for Track Quizzes
-            track_quizzes = {}
-            if user_id:
-                # Get all quizzes for this book's tracks
-                # Map playlist_item_id -> {has_quiz, passed}
-                tq_query = """
+                item['waveform'] = encode_waveform(item.pop('waveform_peaks', None))
+
+            # Quiz state, track quizzes and pdf_path are independent reads:
+            # one round-trip via execute_batch
+            quiz_res, tq_res, pdf_res = db.execute_batch([
+                # Book-level quiz with questions, plus THIS user's latest result
+                ("""
+                    SELECT q.id,
+                           (SELECT uqr.is_passed FROM user_quiz_results uqr
+                            WHERE uqr.quiz_id = q.id AND uqr.user_id = %s
+                            ORDER BY uqr.completed_at DESC LIMIT 1) as is_passed
+                    FROM quizzes q
+                    WHERE q.book_id = %s AND q.playlist_item_id IS NULL
+                      AND EXISTS (SELECT 1 FROM quiz_questions qq WHERE qq.quiz_id = q.id)
+                    LIMIT 1
+                """, (user_id, book_id)),
+                # Track quizzes: playlist_item_id -> {has_quiz, passed}
+                ("""
                     SELECT q.playlist_item_id, q.id as quiz_id,
                            (SELECT is_passed FROM user_quiz_results uqr WHERE uqr.quiz_id = q.id AND uqr.user_id = %s ORDER BY completed_at DESC LIMIT 1) as is_passed
                     FROM quizzes q
                     WHERE q.book_id = %s AND q.playlist_item_id IS NOT NULL
-                """
-                tq_res = db.execute_query(tq_query, (user_id, book_id))
-                if tq_res:
-                    for row in tq_res:
-                        track_quizzes[str(row['playlist_item_id'])] = {
-                            "has_quiz": True,
-                            "is_passed": bool(row['is_passed'])
-                        }
-            else:
-                # Just check existence
-                tq_query = "SELECT playlist_item_id FROM quizzes WHERE book_id = %s AND playlist_item_id IS NOT NULL"
-                tq_res = db.execute_query(tq_query, (book_id,))
-                if tq_res:
-                    for row in tq_res:
-                        track_quizzes[str(row['playlist_item_id'])] = {
-                           "has_quiz": True,
-                           "is_passed": False
-                        }
-                
-            # Fetch pdf_path for the book
-            pdf_query = "SELECT pdf_path FROM books WHERE id = %s"
-            pdf_res = db.execute_query(pdf_query, (book_id,))
+                """, (user_id, book_id)),
+                ("SELECT pdf_path FROM books WHERE id = %s", (book_id,)),
+            ]) or ([], [], [])
+
+            quiz_exists = bool(quiz_res)
+            quiz_passed = bool(quiz_exists and user_id and quiz_res[0]['is_passed'])
+
+            track_quizzes = {}
+            for row in tq_res:
+                track_quizzes[str(row['playlist_item_id'])] = {
+                    "has_quiz": True,
+                    "is_passed": bool(user_id and row['is_passed'])
+                }
+
             pdf_path = resolve_stored_url(pdf_res[0]['pdf_path'], "AudioBooks") if pdf_res and pdf_res[0]['pdf_path'] else None
 
             resp = {
@@ -1370,20 +1516,18 @@ def get_playlist(book_id):
             return jsonify(resp)
         
         # Fallback for "Single Book" treated as Playlist
-        book_query = "SELECT title, audio_path, duration_seconds, pdf_path FROM books WHERE id = %s"
-        book_res = db.execute_query(book_query, (book_id,))
+        # (completion via user_books.is_read and quiz existence ride along in the same query)
+        book_query = """
+            SELECT b.title, b.audio_path, b.duration_seconds, b.pdf_path, b.waveform_peaks, b.loudness_lufs,
+                   (SELECT ub.is_read FROM user_books ub WHERE ub.user_id = %s AND ub.book_id = b.id) as is_read,
+                   EXISTS (SELECT 1 FROM quizzes q WHERE q.book_id = b.id) as has_quiz
+            FROM books b WHERE b.id = %s
+        """
+        book_res = db.execute_query(book_query, (user_id, book_id))
         if book_res:
             book = book_res[0]
             audio_path = resolve_stored_url(book['audio_path'], "AudioBooks")
-
-            # Check if book is "read" if it's a single file?
-            # We can check user_books.is_read
-            is_completed = False
-            if user_id:
-                ub_query = "SELECT is_read FROM user_books WHERE user_id = %s AND book_id = %s"
-                ub_res = db.execute_query(ub_query, (user_id, book_id))
-                if ub_res:
-                    is_completed = bool(ub_res[0]['is_read'])
+            is_completed = bool(user_id and book['is_read'])
 
             synthetic_item = {
                 "id": -1, # Virtual ID
@@ -1392,15 +1536,11 @@ def get_playlist(book_id):
                 "title": book['title'],
                 "duration_seconds": book['duration_seconds'],
                 "track_order": 0,
-                "is_completed": is_completed
+                "is_completed": is_completed,
+                "waveform": encode_waveform(book.get('waveform_peaks')),
+                "loudness_lufs": book.get('loudness_lufs')
             }
-            
-            # Check if quiz exists
-            quiz_exists = False
-            q_query = "SELECT id FROM quizzes WHERE book_id = %s"
-            q_res = db.execute_query(q_query, (book_id,))
-            if q_res:
-                quiz_exists = True
+            quiz_exists = bool(book['has_quiz'])
 
             pdf_path = resolve_stored_url(book['pdf_path'], "AudioBooks") if book.get('pdf_path') else None
             resp = {"tracks": [synthetic_item], "has_quiz": quiz_exists, "pdf_path": pdf_path}
@@ -1617,27 +1757,49 @@ def calculate_listen_percentage(db, user_id, book_id, is_playlist, total_duratio
     percentage = (total_listened_seconds / total_duration * 100) if total_duration > 0 else 0
     return round(percentage, 2)
 
+def listened_percentage(total_duration, is_playlist, progress):
+    """
+    Listen percentage from batched progress data (see get_books).
+
+    Args:
+        total_duration (int): Book duration in seconds
+        is_playlist (bool): Whether progress comes from tracks or a single position
+        progress (dict): {'tracks': [{'duration', 'last_position', 'is_completed'}]}
+            for playlists, {'single_progress': seconds} otherwise
+    """
+    if total_duration <= 0:
+        return 0
+    if is_playlist:
+        total_listened = 0
+        for track in progress.get('tracks', []):
+            duration = track['duration']
+            if duration > 0:
+                total_listened += duration if track['is_completed'] else min(track['last_position'], duration)
+            else:
+                total_listened += track['last_position']
+    else:
+        total_listened = progress.get('single_progress', 0)
+    return round(total_listened / total_duration * 100, 2)
+
 @app.route('/books', methods=['GET'])
 def get_books():
-    import time
-    timings = {}
-    start_total = time.time()
-    
-    start = time.time()
     db = Database()
     if not db.connect():
         return jsonify({"error": "Database connection failed"}), 500
-    timings['db_connect'] = round((time.time() - start) * 1000)
     
     try:
         page = request.args.get('page', 1, type=int)
         limit = request.args.get('limit', 5, type=int)
         search_query = request.args.get('q', '', type=str)
         user_id = request.args.get('user_id', None, type=int)  # Optional user_id for progress
+        category_slug = request.args.get('category', '', type=str)
+        include_subtree = request.args.get('subtree', '0') in ('1', 'true')
         
         offset = (page - 1) * limit
+        sort_by = request.args.get('sort', 'newest', type=str)
 
         params = []
+        trending_join = "LEFT JOIN book_trending bt ON bt.book_id = b.id" if sort_by == 'popular' else ""
 
         is_fav_join = ""
         is_fav_col = "0 as is_favorite"
@@ -1646,6 +1808,31 @@ def get_books():
              is_fav_col = "CASE WHEN fav.book_id IS NOT NULL THEN 1 ELSE 0 END as is_favorite"
              params.append(user_id)
 
+        # Category filter: the category itself, or with subtree=1 everything under it
+        # (one join through category_closure, see category_closure.py). A book
+        # matches through book_categories or its primary category: uploads only
+        # set primary_category_id, and seeded books keep only subcategories in
+        # book_categories.
+        category_join = ""
+        if category_slug:
+            index = category_closure.get_index(db)
+            category_id = index.id_for_slug(category_slug) if index else None
+            if category_id is None:
+                return jsonify([])
+            category_join = """
+            JOIN (
+                SELECT bc.book_id
+                FROM category_closure cc
+                JOIN book_categories bc ON bc.category_id = cc.descendant_id
+                WHERE cc.ancestor_id = %s AND (%s OR cc.depth = 0)
+                UNION
+                SELECT pb.id
+                FROM category_closure cc
+                JOIN books pb ON pb.primary_category_id = cc.descendant_id
+                WHERE cc.ancestor_id = %s AND (%s OR cc.depth = 0)
+            ) cat_filter ON cat_filter.book_id = b.id"""
+            params.extend([category_id, include_subtree, category_id, include_subtree])
+
         base_select = f"""
             SELECT b.id, b.title, b.author, b.audio_path, b.cover_image_path, c.slug as category_slug,
                    u.name as posted_by_name, b.description, b.price, b.posted_by_user_id, b.duration_seconds, b.pdf_path,
@@ -1663,11 +1850,11 @@ def get_books():
             LEFT JOIN (
                 SELECT book_id, AVG(stars) as avg_rating, COUNT(*) as rating_cnt FROM book_ratings GROUP BY book_id
             ) br_stats ON br_stats.book_id = b.id
+            {trending_join}
             {is_fav_join}
+            {category_join}
         """
 
-        sort_by = request.args.get('sort', 'newest', type=str)
-
         if search_query:
              query = base_select + " WHERE b.title ILIKE %s"
              params.append(f"%{search_query}%")
@@ -1675,22 +1862,18 @@ def get_books():
             query = base_select
 
         if sort_by == 'popular':
-            query += """ ORDER BY (
-                COALESCE(br_stats.avg_rating, 0) * COALESCE(br_stats.rating_cnt, 0)
-            ) DESC NULLS LAST, b.id DESC"""
+            # Ranked by the trending job (trending.py); books newer than the last run go last
+            query += " ORDER BY bt.rank ASC NULLS LAST, b.id DESC"
         else:
             query += " ORDER BY b.id DESC" 
         
         query += " LIMIT %s OFFSET %s"
         params.extend([limit, offset])
         
-        start = time.time()
-        books_result = db.execute_query(query, tuple(params))
-        timings['main_query'] = round((time.time() - start) * 1000)
+        with metrics.span("main_query"):
+            books_result = db.execute_query(query, tuple(params))
         
         if not books_result:
-            timings['total'] = round((time.time() - start_total) * 1000)
-            print(f"[TIMING] get_books (empty): {timings}")
             return jsonify([])
         
         # Collect all book IDs for batch queries
@@ -1774,7 +1957,6 @@ def get_books():
                     })
         
         # ============ Build response ============
-        start = time.time()
         books = []
         for row in books_result:
             book_id = row['id']
@@ -1793,26 +1975,8 @@ def get_books():
                 if read_status_by_book.get(book_id):
                     percentage = 100.0
                 else:
-                    total_duration = row['duration_seconds'] or 0
-                    is_playlist = row['playlist_count'] > 0
-                    
-                    if total_duration > 0:
-                        if is_playlist:
-                            # Calculate from track data
-                            tracks = progress_by_book.get(book_id, {}).get('tracks', [])
-                            total_listened = 0
-                            for track in tracks:
-                                if track['is_completed'] and track['duration'] > 0:
-                                    total_listened += track['duration']
-                                else:
-                                    total_listened += min(track['last_position'], track['duration']) if track['duration'] > 0 else track['last_position']
-                            percentage = round((total_listened / total_duration * 100), 2) if total_duration > 0 else 0
-                        else:
-                            # Single book progress
-                            single_progress = progress_by_book.get(book_id, {}).get('single_progress', 0)
-                            percentage = round((single_progress / total_duration * 100), 2) if total_duration > 0 else 0
-                    else:
-                        percentage = 0
+                    percentage = listened_percentage(row['duration_seconds'] or 0, row['playlist_count'] > 0,
+                                                     progress_by_book.get(book_id, {}))
             
             # Determine Background Music
             # Prioritize User Preference -> then Book Default
@@ -1848,10 +2012,6 @@ def get_books():
             
             books.append(book_data)
         
-        timings['build_response'] = round((time.time() - start) * 1000)
-        timings['total'] = round((time.time() - start_total) * 1000)
-        print(f"[TIMING] get_books: {timings}")
-        
         return jsonify(books)
         
     except Exception as e:
@@ -1863,11 +2023,12 @@ def get_books():
 
 # ===================== COMBINED DISCOVER ENDPOINT =====================
 @app.route('/discover', methods=['GET'])
+@conditional(user_subscription_versions, cache_control='private, no-cache')
 def get_discover():
     """
     Combined endpoint that returns all data needed for the discover screen in one call:
     - newReleases: 5 newest books
-    - topPicks: 5 most popular books
+    - topPicks: top 5 of book_trending (trending.py)
     - allBooks: paginated list of all books
     - favorites: list of favorite book IDs for the user
     - isSubscribed: subscription status
@@ -1876,7 +2037,8 @@ def get_discover():
     import time
     start_total = time.time()
 
-    db = Database()
+    # Catalog read: served from the read replica when one is configured
+    db = Database(replica=True, user_id=request.args.get('user_id'))
     if not db.connect():
         return jsonify({"error": "Database connection failed"}), 500
 
@@ -1886,10 +2048,10 @@ def get_discover():
         limit = request.args.get('limit', 10, type=int)
         offset = max(0, (page - 1) * limit)
 
-        cache_key = f"discover:{user_id or 'anon'}:{page}:{limit}"
+        cache_key = f"discover:{user_id or 'anon'}:{page}:{limit}:{g.etag}"
         cached_data = cache.get(cache_key)
         if cached_data:
-            return jsonify(cached_data)
+            return encoded_response(cached_data)
 
         query = """
             WITH params AS (
@@ -1959,9 +2121,10 @@ def get_discover():
                 LIMIT 5
             ),
             top_rows AS (
-                SELECT *
-                FROM book_base
-                ORDER BY (average_rating * rating_count) DESC NULLS LAST, id DESC
+                SELECT bb.*, bt.rank AS trending_rank
+                FROM book_trending bt
+                JOIN book_base bb ON bb.id = bt.book_id
+                ORDER BY bt.rank
                 LIMIT 5
             ),
             all_rows AS (
@@ -2012,7 +2175,7 @@ def get_discover():
                 (SELECT is_subscribed FROM subscription_cte) AS is_subscribed,
                 COALESCE((SELECT favorites FROM favorites_cte), '[]'::jsonb) AS favorites,
                 COALESCE((SELECT jsonb_agg(to_jsonb(nr) ORDER BY nr.id DESC) FROM new_rows nr), '[]'::jsonb) AS new_releases,
-                COALESCE((SELECT jsonb_agg(to_jsonb(tp) ORDER BY (tp.average_rating * tp.rating_count) DESC, tp.id DESC) FROM top_rows tp), '[]'::jsonb) AS top_picks,
+                COALESCE((SELECT jsonb_agg(to_jsonb(tp) ORDER BY tp.trending_rank) FROM top_rows tp), '[]'::jsonb) AS top_picks,
                 COALESCE((SELECT jsonb_agg(to_jsonb(ar) ORDER BY ar.id DESC) FROM all_rows ar), '[]'::jsonb) AS all_books,
                 COALESCE((SELECT jsonb_agg(to_jsonb(hr) ORDER BY hr.last_accessed_at DESC) FROM history_rows hr), '[]'::jsonb) AS listen_history,
                 COALESCE((SELECT categories FROM categories_cte), '[]'::jsonb) AS categories
@@ -2100,9 +2263,10 @@ def get_discover():
             "categories": categories_tree,
         }
 
+        encoded = encode_json(response)
         print(f"[TIMING] get_discover: total={round((time.time() - start_total) * 1000)}ms")
-        cache.set(cache_key, response, 30)
-        return jsonify(response)
+        cache.set(cache_key, encoded, 30)
+        return encoded_response(encoded)
 
     except Exception as e:
         print(f"Error in get_discover: {e}")
@@ -2115,13 +2279,111 @@ def get_discover():
 
 
 # ===================== REELS ENDPOINT =====================
+def reels_book_json(book, tracks_raw):
+    """Prebuilt /reels entry for a book (see reels_feed.py). None if nothing is playable."""
+    book_id = book['id']
+    cover_path, cover_thumb = resolve_cover_urls(book.get('cover_image_path'))
+    audio_path = resolve_stored_url(book.get('audio_path'), "AudioBooks")
+
+    tracks = []
+    for track in tracks_raw:
+        tracks.append({
+            "id": str(track['id']),
+            "title": track.get('title') or "Unknown Track",
+            "audioUrl": resolve_stored_url(track.get('file_path'), "AudioBooks") or "",
+            "duration": int(track.get('duration_seconds') or 0),
+            "order": int(track.get('track_order') or 0),
+            "waveform": track.get('waveform'),
+            "loudnessLufs": track.get('loudness_lufs'),
+        })
+
+    if not tracks and book.get('audio_path'):
+        tracks = [{
+            "id": f"book_{book_id}",
+            "title": book.get('title') or "Untitled",
+            "audioUrl": audio_path or "",
+            "duration": int(book.get('duration_seconds') or 0),
+            "order": 0,
+            "waveform": book.get('waveform'),
+            "loudnessLufs": book.get('loudness_lufs'),
+        }]
+
+    if not tracks:
+        return None
+
+    return {
+        "id": str(book_id),
+        "title": book.get('title') or "Untitled",
+        "author": book.get('author') or "Unknown",
+        "coverUrl": cover_path,
+        "coverUrlThumbnail": cover_thumb,
+        "description": book.get('description') or "",
+        "postedByUserId": str(book.get('posted_by_user_id') or ""),
+        "categoryId": "",
+        "subcategoryIds": [],
+        "audioUrl": audio_path or "",
+        "isPlaylist": True,
+        "isPremium": True,
+        "price": 0.0,
+        "averageRating": 0.0,
+        "ratingCount": 0,
+        "tracks": tracks,
+    }
+
+reels = reels_feed.ReelsFeed(reels_book_json)
+
+def reels_bg_overrides(user_id, db):
+    """{book_id: background_music_id} for the user's per-book choices (cached, invalidated on change)."""
+    cache_key = f"reels_bg:{user_id}"
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+    rows = db.execute_query(
+        "SELECT book_id, background_music_id FROM user_books WHERE user_id = %s AND background_music_id IS NOT NULL",
+        (user_id,),
+    )
+    if rows is None:
+        return {}
+    overrides = {row['book_id']: row['background_music_id'] for row in rows}
+    cache.set(cache_key, overrides, 300)
+    return overrides
+
+def advance_reels_offset(writer, user_id, client_offset, limit, total_books):
+    """
+    Offset walk of the feed ring, used when personalized reels are off or unavailable.
+    A missing or zero client offset means "continue from the saved one"; either way the
+    saved offset moves on by one page in the same statement. Returns the offset to serve.
+    """
+    advanced = writer.execute_query("""
+        UPDATE users u
+        SET reels_offset = (cur.raw_offset + %(limit)s) %% %(total)s
+        FROM (
+            SELECT CASE WHEN COALESCE(%(requested)s::int, 0) = 0
+                        THEN COALESCE(reels_offset, 0)
+                        ELSE %(requested)s::int END AS raw_offset
+            FROM users
+            WHERE id = %(user_id)s
+        ) cur
+        WHERE u.id = %(user_id)s
+        RETURNING cur.raw_offset
+    """, {"limit": limit, "total": total_books, "requested": client_offset, "user_id": user_id})
+    if advanced is None:
+        print(f"[REELS] Failed to update reels_offset for user {user_id}")
+        return client_offset or 0
+    return int(advanced[0]['raw_offset']) if advanced else (client_offset or 0)
+
 @app.route('/reels', methods=['GET'])
 @jwt_required
 def get_reels():
     """
-    Returns all books with their playlist items for the Reels feature.
-    Restricted to subscribers.
+    Returns a window of the reels feed (books with their playlist items), restricted to subscribers.
     Also returns the user's saved offset so client doesn't need separate call.
+
+    The ordered feed and every book's payload come from the in-memory snapshot
+    in reels_feed.py. Which books a user gets next comes from their seen/completed
+    bitmaps and candidate pools (reels_state.py): one locked read and one write of
+    user_reels_state per swipe. With REELS_PERSONALIZED off, or if that state is
+    unavailable, the feed is walked in order from users.reels_offset instead.
     """
     user_id = request.args.get('user_id')
     
@@ -2132,7 +2394,8 @@ def get_reels():
     except (TypeError, ValueError):
         return jsonify({"error": "Invalid user_id"}), 400
         
-    db = Database()
+    # Reads go to the replica; the reels_offset update below goes to the primary
+    db = Database(replica=True, user_id=user_id_int)
     if not db.connect():
         return jsonify({"error": "Database connection failed"}), 500
 
@@ -2146,217 +2409,46 @@ def get_reels():
             client_offset = None
 
     try:
-        query = """
-            WITH params AS (
-                SELECT %s::int AS user_id, %s::int AS limit_val, %s::int AS requested_offset
-            ),
-            subscription_cte AS (
-                SELECT EXISTS(
-                    SELECT 1
-                    FROM subscriptions s
-                    WHERE s.user_id = (SELECT user_id FROM params)
-                      AND s.status = 'active'
-                      AND (s.end_date IS NULL OR s.end_date > NOW() AT TIME ZONE 'UTC')
-                ) AS is_subscribed
-            ),
-            total_cte AS (
-                SELECT COUNT(*)::int AS total_books
-                FROM books
-            ),
-            user_state AS (
-                SELECT COALESCE(u.reels_offset, 0)::int AS saved_offset
-                FROM users u
-                WHERE u.id = (SELECT user_id FROM params)
-            ),
-            offset_cte AS (
-                SELECT
-                    t.total_books,
-                    CASE
-                        WHEN p.requested_offset IS NULL THEN COALESCE(us.saved_offset, 0)
-                        WHEN p.requested_offset = 0 THEN COALESCE(us.saved_offset, 0)
-                        ELSE p.requested_offset
-                    END AS raw_offset
-                FROM params p
-                CROSS JOIN total_cte t
-                LEFT JOIN user_state us ON TRUE
-            ),
-            effective_offset_cte AS (
-                SELECT
-                    oc.total_books,
-                    oc.raw_offset,
-                    CASE
-                        WHEN oc.total_books > 0 THEN (oc.raw_offset %% oc.total_books)
-                        ELSE 0
-                    END AS effective_offset
-                FROM offset_cte oc
-            ),
-            default_bg AS (
-                SELECT id AS default_bg_id
-                FROM background_music
-                ORDER BY is_default DESC, id ASC
-                LIMIT 1
-            ),
-            ranked_books AS (
-                SELECT
-                    b.id,
-                    b.title,
-                    b.author,
-                    b.audio_path,
-                    b.cover_image_path,
-                    b.duration_seconds,
-                    b.description,
-                    b.posted_by_user_id,
-                    b.background_music_id,
-                    ROW_NUMBER() OVER (ORDER BY b.id DESC) - 1 AS rn
-                FROM books b
-            ),
-            selected_books AS (
-                SELECT
-                    rb.*,
-                    ((rb.rn - eo.effective_offset + eo.total_books) %% eo.total_books) AS seq
-                FROM ranked_books rb
-                CROSS JOIN effective_offset_cte eo
-                WHERE eo.total_books > 0
-                ORDER BY seq
-                LIMIT (SELECT limit_val + 5 FROM params)
-            )
-            SELECT
-                sc.is_subscribed,
-                eo.total_books,
-                eo.raw_offset AS saved_offset,
-                eo.effective_offset,
-                COALESCE(
-                    jsonb_agg(
-                        jsonb_build_object(
-                            'id', sb.id,
-                            'title', sb.title,
-                            'author', sb.author,
-                            'audio_path', sb.audio_path,
-                            'cover_image_path', sb.cover_image_path,
-                            'duration_seconds', sb.duration_seconds,
-                            'description', sb.description,
-                            'posted_by_user_id', sb.posted_by_user_id,
-                            'default_bg_id', sb.background_music_id,
-                            'user_bg_id', ub.background_music_id,
-                            'active_bg_id', COALESCE(
-                                ub.background_music_id,
-                                sb.background_music_id,
-                                (SELECT default_bg_id FROM default_bg)
-                            ),
-                            'tracks', COALESCE(tr.tracks, '[]'::jsonb)
-                        )
-                        ORDER BY sb.seq
-                    ) FILTER (WHERE sb.id IS NOT NULL),
-                    '[]'::jsonb
-                ) AS books
-            FROM subscription_cte sc
-            CROSS JOIN effective_offset_cte eo
-            LEFT JOIN selected_books sb ON TRUE
-            LEFT JOIN user_books ub
-                   ON ub.book_id = sb.id
-                  AND ub.user_id = (SELECT user_id FROM params)
-            LEFT JOIN LATERAL (
-                SELECT jsonb_agg(
-                    jsonb_build_object(
-                        'id', pi.id::text,
-                        'title', COALESCE(pi.title, 'Unknown Track'),
-                        'audioUrl', pi.file_path,
-                        'duration', COALESCE(pi.duration_seconds, 0),
-                        'order', COALESCE(pi.track_order, 0)
-                    )
-                    ORDER BY pi.track_order
-                ) AS tracks
-                FROM playlist_items pi
-                WHERE pi.book_id = sb.id
-            ) tr ON TRUE
-            GROUP BY sc.is_subscribed, eo.total_books, eo.raw_offset, eo.effective_offset
-        """
-        reels_result = db.execute_query(query, (user_id_int, limit, client_offset))
-        if not reels_result:
-            return jsonify({"error": "Failed to load reels"}), 500
-
-        row = reels_result[0]
-        is_subscribed = bool(row.get('is_subscribed'))
-        total_books = int(row.get('total_books') or 0)
-        saved_offset = int(row.get('saved_offset') or 0)
-
-        if not is_subscribed:
+        if not is_subscriber(user_id_int, db):
+            saved = db.execute_query("SELECT reels_offset FROM users WHERE id = %s", (user_id_int,))
             return jsonify({
                 "isSubscribed": False,
                 "books": [],
                 "hasMore": False,
-                "savedOffset": saved_offset,
+                "savedOffset": int((saved[0]['reels_offset'] or 0) if saved else 0),
             }), 200
 
-        books_data = []
-        books_raw = row.get('books') or []
-        for book in books_raw:
-            try:
-                book_id = book.get('id')
-                if book_id is None:
-                    continue
-
-                cover_path, cover_thumb = resolve_cover_urls(book.get('cover_image_path'))
-                audio_path = resolve_stored_url(book.get('audio_path'), "AudioBooks")
-                tracks_raw = book.get('tracks') or []
-                tracks = []
-
-                for track in tracks_raw:
-                    track_audio = resolve_stored_url(track.get('audioUrl'), "AudioBooks")
-                    tracks.append({
-                        "id": str(track.get('id') or ""),
-                        "title": track.get('title') or "Unknown Track",
-                        "audioUrl": track_audio or "",
-                        "duration": int(track.get('duration') or 0),
-                        "order": int(track.get('order') or 0),
-                    })
-
-                if not tracks and book.get('audio_path'):
-                    tracks = [{
-                        "id": f"book_{book_id}",
-                        "title": book.get('title') or "Untitled",
-                        "audioUrl": audio_path or "",
-                        "duration": int(book.get('duration_seconds') or 0),
-                        "order": 0,
-                    }]
-
-                if not tracks:
-                    continue
-
-                books_data.append({
-                    "id": str(book_id),
-                    "title": book.get('title') or "Untitled",
-                    "author": book.get('author') or "Unknown",
-                    "coverUrl": cover_path,
-                    "coverUrlThumbnail": cover_thumb,
-                    "description": book.get('description') or "",
-                    "postedByUserId": str(book.get('posted_by_user_id') or ""),
-                    "categoryId": "",
-                    "subcategoryIds": [],
-                    "audioUrl": audio_path or "",
-                    "isPlaylist": len(tracks) > 0,
-                    "isPremium": True,
-                    "price": 0.0,
-                    "averageRating": 0.0,
-                    "ratingCount": 0,
-                    "tracks": tracks,
-                    "backgroundMusicId": book.get('active_bg_id'),
-                })
-            except Exception as e:
-                print(f"Skipping bad book row in reels: {e}")
-                continue
-
-        if len(books_data) > limit:
-            books_data = books_data[:limit]
+        feed = reels.snapshot(db)
+        if feed is None:
+            return jsonify({"error": "Failed to load reels"}), 500
+        total_books = feed.total
 
+        book_ids = None
+        saved_offset = client_offset or 0
         if total_books > 0:
-            new_offset = (saved_offset + limit) % total_books
-            update_result = db.execute_query(
-                "UPDATE users SET reels_offset = %s WHERE id = %s",
-                (new_offset, user_id_int),
-            )
-            if update_result is None:
-                print(f"[REELS] Failed to update reels_offset for user {user_id}")
+            # Reels state is read and advanced through the primary writer, so swiping
+            # doesn't mark_user_write() (that would pin the user's other reads too)
+            writer = db
+            if db.is_replica:
+                writer = Database()
+            try:
+                if reels_state.ENABLED:
+                    # Personalized: next unseen books from the user's pools (reels_state.py)
+                    personal = reels_state.personal_pool(db, user_id_int)
+                    served = reels_state.serve(writer, user_id_int, feed, limit, personal)
+                    if served is not None:
+                        book_ids, saved_offset = served
+                if book_ids is None:
+                    saved_offset = advance_reels_offset(writer, user_id_int, client_offset, limit, total_books)
+            finally:
+                if writer is not db:
+                    writer.disconnect()
+
+        user_bg = reels_bg_overrides(user_id_int, db)
+        if book_ids is not None:
+            books_data = feed.books(book_ids, user_bg)
+        else:
+            books_data = feed.window(saved_offset, limit, user_bg)
 
         return jsonify({
             "isSubscribed": True,
@@ -2413,10 +2505,9 @@ def update_reels_offset():
         return jsonify({"error": "Database connection failed"}), 500
 
     try:
-        # Validate offset against total books count
-        count_query = "SELECT COUNT(*) as count FROM books"
-        count_result = db.execute_query(count_query)
-        total_books = count_result[0]['count'] if count_result else 0
+        # Validate offset against the reels feed length (books with something to play)
+        feed = reels.snapshot(db)
+        total_books = feed.total if feed else 0
         
         # If offset is beyond total books, reset to 0 (loop)
         # Also, if offset is exactly equal to total, it means we are at the end, so next fetch would be empty -> reset to 0.
@@ -2436,8 +2527,29 @@ def update_reels_offset():
 
 
 # ===================== COMBINED LIBRARY ENDPOINT =====================
+def library_book_json(book, fav_ids):
+    """Book entry shared by the /library lists. fav_ids should be a set."""
+    cover_path, cover_thumb = resolve_cover_urls(book['cover_image_path'])
+    return {
+        "id": str(book['id']),
+        "title": book['title'],
+        "author": book['author'],
+        "audioUrl": resolve_stored_url(book['audio_path'], "AudioBooks"),
+        "coverUrl": cover_path,
+        "coverThumbnailUrl": cover_thumb,
+        "categoryId": book['category_slug'] or "others",
+        "durationSeconds": book['duration_seconds'],
+        "premium": bool(book.get('premium', False)),
+        "averageRating": float(book['average_rating']) if book['average_rating'] else 0.0,
+        "ratingCount": book['rating_count'] or 0,
+        "isFavorite": book['id'] in fav_ids,
+        "isPlaylist": book['playlist_count'] > 0,
+        "backgroundMusicId": book.get('background_music_id'),
+    }
+
 @app.route('/library', methods=['GET'])
 @jwt_required
+@conditional(user_subscription_versions, cache_control='private, no-cache')
 def get_library():
     """
     Combined endpoint that returns all data needed for the library screen in one call:
@@ -2446,26 +2558,24 @@ def get_library():
     - listenHistory: books with progress data
     - uploadedBooks: books uploaded by this user (if admin)
     - isSubscribed: subscription status
+    - syncToken: pass back as ?since= to get only what changed (library_delta)
     """
-    import time
-    start_total = time.time()
-    
-    db = Database()
-    if not db.connect():
-        return jsonify({"error": "Database connection failed"}), 500
-    
     try:
         user_id = request.args.get('user_id', type=int)
-        
+
+        since = request.args.get('since')
+        if since and user_id:
+            delta = library_delta(user_id, since)
+            if delta is not None:
+                return jsonify(delta)
+            # Token too old, entitlement flipped or too much changed: full response
+
         # Check cache
-        cache_key = f"library:{user_id}" if user_id else "library:anon"
+        cache_key = f"library:{user_id}:{g.etag}" if user_id else f"library:anon:{g.etag}"
         cached_data = cache.get(cache_key)
         if cached_data:
-            return jsonify(cached_data)
+            return encoded_response(cached_data)
 
-        # Get subscription status
-        is_subscribed = is_subscriber(user_id, db) if user_id else False
-        
         # Get all books (with user preference for BG music)
         # Uses JOINs instead of correlated subqueries for better performance
         books_query = """
@@ -2487,145 +2597,107 @@ def get_library():
             ) br_stats ON br_stats.book_id = b.id
             ORDER BY b.id DESC
         """
-        all_books_result = db.execute_query(books_query, (user_id,))
-        
-        # Get favorites
-        favIds = []
+
+        history_query = """
+            SELECT b.id, b.title, b.author, b.audio_path, b.cover_image_path, b.duration_seconds,
+                   b.premium, b.pdf_path,
+                   COALESCE(ub.background_music_id, b.background_music_id) as background_music_id,
+                   c.slug as category_slug,
+                   ub.last_played_position_seconds as last_position,
+                   ub.last_accessed_at,
+                   ub.current_playlist_item_id,
+                   COALESCE(pi_count.cnt, 0) as playlist_count,
+                   br_stats.avg_rating as average_rating,
+                   COALESCE(br_stats.rating_cnt, 0) as rating_count
+            FROM user_books ub
+            JOIN books b ON ub.book_id = b.id
+            LEFT JOIN categories c ON b.primary_category_id = c.id
+            LEFT JOIN (
+                SELECT book_id, COUNT(*) as cnt FROM playlist_items GROUP BY book_id
+            ) pi_count ON pi_count.book_id = b.id
+            LEFT JOIN (
+                SELECT book_id, AVG(stars) as avg_rating, COUNT(*) as rating_cnt FROM book_ratings GROUP BY book_id
+            ) br_stats ON br_stats.book_id = b.id
+            WHERE ub.user_id = %s AND ub.last_played_position_seconds > 0 AND (ub.is_read = 0 OR ub.is_read IS NULL)
+            ORDER BY ub.last_accessed_at DESC
+        """
+
+        upload_query = """
+            SELECT b.id, b.title, b.author, b.audio_path, b.cover_image_path, b.duration_seconds,
+                   b.premium, b.pdf_path, b.background_music_id, c.slug as category_slug,
+                   COALESCE(pi_count.cnt, 0) as playlist_count,
+                   br_stats.avg_rating as average_rating,
+                   COALESCE(br_stats.rating_cnt, 0) as rating_count
+            FROM books b
+            LEFT JOIN categories c ON b.primary_category_id = c.id
+            LEFT JOIN (
+                SELECT book_id, COUNT(*) as cnt FROM playlist_items GROUP BY book_id
+            ) pi_count ON pi_count.book_id = b.id
+            LEFT JOIN (
+                SELECT book_id, AVG(stars) as avg_rating, COUNT(*) as rating_cnt FROM book_ratings GROUP BY book_id
+            ) br_stats ON br_stats.book_id = b.id
+            WHERE b.posted_by_user_id = %s
+            ORDER BY b.id DESC
+        """
+
+        # The token's snapshot must predate every section's reads, so take it first
+        token_xmin = None
         if user_id:
-            fav_result = db.execute_query("SELECT book_id FROM favorites WHERE user_id = %s", (user_id,))
-            if fav_result:
-                favIds = [row['book_id'] for row in fav_result]
-        
+            token_db = Database()
+            if token_db.connect():
+                try:
+                    token_xmin = library_changes.snapshot_xmin(token_db)
+                finally:
+                    token_db.disconnect()
+
+        # Independent reads run concurrently on separate connections (composite.py)
+        sections = [Section("books", lambda db: db.execute_query(books_query, (user_id,)) or [], default=[], readonly=True)]
+        if user_id:
+            sections += [
+                Section("subscribed", lambda db: is_subscriber(user_id, db), default=False, readonly=True),
+                Section("favorites", lambda db: db.execute_query(
+                    "SELECT book_id FROM favorites WHERE user_id = %s", (user_id,)) or [], default=[], readonly=True),
+                Section("purchased", lambda db: db.execute_query(
+                    "SELECT book_id FROM user_books WHERE user_id = %s", (user_id,)) or [], default=[], readonly=True),
+                Section("history", lambda db: db.execute_query(history_query, (user_id,)) or [], default=[], readonly=True),
+                Section("uploaded", lambda db: db.execute_query(upload_query, (user_id,)) or [], default=[], readonly=True),
+            ]
+        results, failed, timings = run_sections(sections)
+        if "books" in failed:
+            return jsonify({"error": "Failed to load books"}), 500
+
+        all_books_result = results["books"]
+        is_subscribed = results.get("subscribed", False)
+        favIds = [row['book_id'] for row in results.get("favorites", [])]
+
         # Get purchased/accessible book IDs
         purchased_ids = []
         if user_id:
             if is_subscribed:
                 # Subscriber gets all books
-                purchased_ids = [str(row['id']) for row in all_books_result] if all_books_result else []
+                purchased_ids = [str(row['id']) for row in all_books_result]
             else:
                 # Non-subscriber: only their purchased books
-                purchased_result = db.execute_query(
-                    "SELECT book_id FROM user_books WHERE user_id = %s", (user_id,)
-                )
-                if purchased_result:
-                    purchased_ids = [str(row['book_id']) for row in purchased_result]
+                purchased_ids = [str(row['book_id']) for row in results["purchased"]]
         
         # Get listen history with progress
+        fav_set = set(favIds)
         listen_history = []
-        if user_id:
-            history_query = """
-                SELECT b.id, b.title, b.author, b.audio_path, b.cover_image_path, b.duration_seconds,
-                       b.premium, b.pdf_path,
-                       COALESCE(ub.background_music_id, b.background_music_id) as background_music_id,
-                       c.slug as category_slug,
-                       ub.last_played_position_seconds as last_position,
-                       ub.last_accessed_at,
-                       ub.current_playlist_item_id,
-                       COALESCE(pi_count.cnt, 0) as playlist_count,
-                       br_stats.avg_rating as average_rating,
-                       COALESCE(br_stats.rating_cnt, 0) as rating_count
-                FROM user_books ub
-                JOIN books b ON ub.book_id = b.id
-                LEFT JOIN categories c ON b.primary_category_id = c.id
-                LEFT JOIN (
-                    SELECT book_id, COUNT(*) as cnt FROM playlist_items GROUP BY book_id
-                ) pi_count ON pi_count.book_id = b.id
-                LEFT JOIN (
-                    SELECT book_id, AVG(stars) as avg_rating, COUNT(*) as rating_cnt FROM book_ratings GROUP BY book_id
-                ) br_stats ON br_stats.book_id = b.id
-                WHERE ub.user_id = %s AND ub.last_played_position_seconds > 0 AND (ub.is_read = 0 OR ub.is_read IS NULL)
-                ORDER BY ub.last_accessed_at DESC
-            """
-            history_result = db.execute_query(history_query, (user_id,))
-            if history_result:
-                for book in history_result:
-                    cover_path, cover_thumb = resolve_cover_urls(book['cover_image_path'])
-                    audio_path = resolve_stored_url(book['audio_path'], "AudioBooks")
-                    listen_history.append({
-                        "id": str(book['id']),
-                        "title": book['title'],
-                        "author": book['author'],
-                        "audioUrl": audio_path,
-                        "coverUrl": cover_path,
-                        "coverThumbnailUrl": cover_thumb,
-                        "categoryId": book['category_slug'] or "others",
-                        "durationSeconds": book['duration_seconds'],
-                        "lastPosition": book['last_position'],
-                        "premium": bool(book.get('premium', False)),
-                        "averageRating": float(book['average_rating']) if book['average_rating'] else 0.0,
-                        "ratingCount": book['rating_count'] or 0,
-                        "isFavorite": book['id'] in favIds,
-                        "isFavorite": book['id'] in favIds,
-                        "isPlaylist": book['playlist_count'] > 0,
-                        "backgroundMusicId": book.get('background_music_id'),
-                        "currentPlaylistItemId": book.get('current_playlist_item_id'),
-                    })
-        
+        for book in results.get("history") or []:
+            item = library_book_json(book, fav_set)
+            item["lastPosition"] = book['last_position']
+            item["currentPlaylistItemId"] = book.get('current_playlist_item_id')
+            listen_history.append(item)
+    
         # Get uploaded books (for admin users)
         uploaded_books = []
-        if user_id:
-            upload_query = """
-                SELECT b.id, b.title, b.author, b.audio_path, b.cover_image_path, b.duration_seconds,
-                       b.premium, b.pdf_path, b.background_music_id, c.slug as category_slug,
-                       COALESCE(pi_count.cnt, 0) as playlist_count,
-                       br_stats.avg_rating as average_rating,
-                       COALESCE(br_stats.rating_cnt, 0) as rating_count
-                FROM books b
-                LEFT JOIN categories c ON b.primary_category_id = c.id
-                LEFT JOIN (
-                    SELECT book_id, COUNT(*) as cnt FROM playlist_items GROUP BY book_id
-                ) pi_count ON pi_count.book_id = b.id
-                LEFT JOIN (
-                    SELECT book_id, AVG(stars) as avg_rating, COUNT(*) as rating_cnt FROM book_ratings GROUP BY book_id
-                ) br_stats ON br_stats.book_id = b.id
-                WHERE b.posted_by_user_id = %s
-                ORDER BY b.id DESC
-            """
-            upload_result = db.execute_query(upload_query, (user_id,))
-            if upload_result:
-                for book in upload_result:
-                    cover_path, cover_thumb = resolve_cover_urls(book['cover_image_path'])
-                    audio_path = resolve_stored_url(book['audio_path'], "AudioBooks")
-                    uploaded_books.append({
-                        "id": str(book['id']),
-                        "title": book['title'],
-                        "author": book['author'],
-                        "audioUrl": audio_path,
-                        "coverUrl": cover_path,
-                        "coverThumbnailUrl": cover_thumb,
-                        "categoryId": book['category_slug'] or "others",
-                        "durationSeconds": book['duration_seconds'],
-                        "premium": bool(book.get('premium', False)),
-                        "averageRating": float(book['average_rating']) if book['average_rating'] else 0.0,
-                        "ratingCount": book['rating_count'] or 0,
-                        "isFavorite": book['id'] in favIds,
-                        "isPlaylist": book['playlist_count'] > 0,
-                        "postedByUserId": str(user_id),
-                        "backgroundMusicId": book.get('background_music_id'),
-                    })
-        
+        for book in results.get("uploaded") or []:
+            item = library_book_json(book, fav_set)
+            item["postedByUserId"] = str(user_id)
+            uploaded_books.append(item)
+    
         # Build all books response
-        all_books = []
-        if all_books_result:
-            for book in all_books_result:
-                cover_path, cover_thumb = resolve_cover_urls(book['cover_image_path'])
-                audio_path = resolve_stored_url(book['audio_path'], "AudioBooks")
-                all_books.append({
-                    "id": str(book['id']),
-                    "title": book['title'],
-                    "author": book['author'],
-                    "audioUrl": audio_path,
-                    "coverUrl": cover_path,
-                    "coverThumbnailUrl": cover_thumb,
-                    "categoryId": book['category_slug'] or "others",
-                    "durationSeconds": book['duration_seconds'],
-                    "premium": bool(book.get('premium', False)),
-                    "averageRating": float(book['average_rating']) if book['average_rating'] else 0.0,
-                    "ratingCount": book['rating_count'] or 0,
-                    "isFavorite": book['id'] in favIds,
-                    "isPlaylist": book['playlist_count'] > 0,
-                    "backgroundMusicId": book.get('background_music_id'),
-                })
+        all_books = [library_book_json(book, fav_set) for book in all_books_result or []]
         
         response = {
             "allBooks": all_books,
@@ -2634,27 +2706,269 @@ def get_library():
             "listenHistory": listen_history,
             "uploadedBooks": uploaded_books,
             "isSubscribed": is_subscribed,
+            "full": True,
         }
+        if token_xmin is not None and not failed:
+            response["syncToken"] = library_changes.make_token(token_xmin, is_subscribed)
         
-        print(f"[TIMING] get_library: total={round((time.time() - start_total) * 1000)}ms")
-        
-        cache.set(cache_key, response, 30)
-        
-        return jsonify(response)
+        # Total duration is in the per-request log; this adds the per-section split
+        structured_log.log("debug", "library_sections", route=request.url_rule.rule, sections=timings)
+
+        if failed:
+            response["partialSections"] = failed
+            return jsonify(response)
+
+        encoded = encode_json(response)
+        cache.set(cache_key, encoded, 30)
+        return encoded_response(encoded)
         
     except Exception as e:
         print(f"Error in get_library: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
-    finally:
-        db.disconnect()
 
-@app.route('/user-books/<int:user_id>', methods=['GET'])
-@jwt_required
-def get_user_books(user_id):
-    db = Database()
-    if not db.connect():
+# Book columns for the precomputed recommendation shelves. Stats are per-book
+# LATERAL lookups so a 10-row shelf never aggregates the whole ratings table.
+RECOMMENDED_BOOK_SQL = """
+    b.id, b.title, b.author, b.audio_path, b.cover_image_path, b.duration_seconds,
+    b.premium, b.pdf_path, b.background_music_id, c.slug as category_slug,
+    COALESCE(pi_count.cnt, 0) as playlist_count,
+    br_stats.avg_rating as average_rating,
+    COALESCE(br_stats.rating_cnt, 0) as rating_count
+"""
+RECOMMENDED_BOOK_JOINS = """
+    LEFT JOIN categories c ON b.primary_category_id = c.id
+    LEFT JOIN LATERAL (
+        SELECT COUNT(*) as cnt FROM playlist_items WHERE book_id = b.id
+    ) pi_count ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT AVG(stars) as avg_rating, COUNT(*) as rating_cnt FROM book_ratings WHERE book_id = b.id
+    ) br_stats ON TRUE
+"""
+RECOMMENDATION_SHELF_SIZE = 10
+BECAUSE_YOU_LISTENED_SHELVES = 2
+
+# Current state of a handful of changed books for one user (library delta)
+LIBRARY_DELTA_SQL = f"""
+    SELECT {RECOMMENDED_BOOK_SQL}, b.posted_by_user_id,
+           COALESCE(ub.background_music_id, b.background_music_id) as user_background_music_id,
+           ub.book_id IS NOT NULL as owned,
+           ub.last_played_position_seconds as last_position,
+           ub.current_playlist_item_id,
+           COALESCE(ub.last_played_position_seconds > 0 AND (ub.is_read = 0 OR ub.is_read IS NULL), FALSE) as in_history,
+           EXISTS (SELECT 1 FROM favorites f WHERE f.user_id = %(user_id)s AND f.book_id = b.id) as is_favorite
+    FROM books b
+    LEFT JOIN user_books ub ON ub.book_id = b.id AND ub.user_id = %(user_id)s
+    {RECOMMENDED_BOOK_JOINS}
+    WHERE b.id = ANY(%(ids)s)
+    ORDER BY ub.last_accessed_at DESC NULLS LAST, b.id DESC
+"""
+LIBRARY_DELTA_MAX_IDS = 2000
+LIBRARY_TOKEN_MAX_AGE = library_changes.TOKEN_MAX_AGE
+if not R2_PUBLIC_DOMAIN:
+    # Clients keep the URLs from earlier syncs: force a full refresh before they expire
+    LIBRARY_TOKEN_MAX_AGE = min(LIBRARY_TOKEN_MAX_AGE, R2_URL_EXPIRY // 2)
+
+
+def library_delta(user_id, since):
+    """
+    /library?since=<syncToken>: only the books, favorites, progress and
+    entitlements that changed since the token (library_changes.py).
+
+    Every book id touched since the token comes back with its current state;
+    ids that no longer apply are listed in the removed* lists. Returns None
+    when the client must take a full response instead.
+    """
+    parsed = library_changes.parse_token(since)
+    if parsed is None:
+        return None
+    since_xmin, issued_at, was_subscribed = parsed
+    if time.time() - issued_at > LIBRARY_TOKEN_MAX_AGE:
+        return None
+
+    db = Database()
+    if not db.connect():
+        return None
+    try:
+        xmin, changed = library_changes.changes_since(db, user_id, since_xmin)
+        if xmin is None:
+            return None
+        is_subscribed = is_subscriber(user_id, db)
+        if is_subscribed != was_subscribed:
+            # purchasedIds switches between "everything" and user_books: rebuild it
+            return None
+        ids = set().union(*changed.values())
+        if len(ids) > LIBRARY_DELTA_MAX_IDS:
+            return None
+
+        rows = db.execute_query(LIBRARY_DELTA_SQL, {"user_id": user_id, "ids": sorted(ids)}) if ids else []
+        if rows is None:
+            return None
+    finally:
+        db.disconnect()
+
+    found = {row['id'] for row in rows}
+    fav_set = {row['id'] for row in rows if row['is_favorite']}
+    all_books, listen_history, uploaded_books = [], [], []
+    for row in rows:
+        book = dict(row, background_music_id=row['user_background_music_id'])
+        all_books.append(library_book_json(book, fav_set))
+        if row['in_history']:
+            item = library_book_json(book, fav_set)
+            item["lastPosition"] = row['last_position']
+            item["currentPlaylistItemId"] = row.get('current_playlist_item_id')
+            listen_history.append(item)
+        if row['posted_by_user_id'] == user_id:
+            item = library_book_json(row, fav_set)
+            item["postedByUserId"] = str(user_id)
+            uploaded_books.append(item)
+
+    purchased = {row['id'] for row in rows if is_subscribed or row['owned']}
+    in_history = {row['id'] for row in rows if row['in_history']}
+    return {
+        "full": False,
+        "syncToken": library_changes.make_token(xmin, is_subscribed),
+        "isSubscribed": is_subscribed,
+        "allBooks": all_books,
+        "removedBookIds": [str(book_id) for book_id in sorted(ids - found)],
+        "purchasedIds": [str(book_id) for book_id in sorted(purchased)],
+        "removedPurchasedIds": [str(book_id) for book_id in sorted(ids - purchased)],
+        "favoriteIds": sorted(fav_set),
+        "removedFavoriteIds": sorted(ids - fav_set),
+        "listenHistory": listen_history,
+        "removedHistoryIds": [str(book_id) for book_id in sorted(ids - in_history)],
+        "uploadedBooks": uploaded_books,
+    }
+
+@app.route('/books/<int:book_id>/similar', methods=['GET'])
+def get_similar_books(book_id):
+    """Books most often listened to by the same people (book_neighbors, built by recommendations.py)."""
+    limit = min(max(request.args.get('limit', RECOMMENDATION_SHELF_SIZE, type=int), 1), 50)
+    cache_key = f"similar:{book_id}:{limit}"
+    cached_data = cache.get(cache_key)
+    if cached_data is not None:
+        return jsonify(cached_data)
+
+    db = Database(replica=True)
+    if not db.connect():
+        return jsonify({"error": "Database connection failed"}), 500
+
+    try:
+        rows = db.execute_query(f"""
+            SELECT {RECOMMENDED_BOOK_SQL}
+            FROM book_neighbors bn
+            JOIN books b ON b.id = bn.neighbor_id
+            {RECOMMENDED_BOOK_JOINS}
+            WHERE bn.book_id = %s
+            ORDER BY bn.rank
+            LIMIT %s
+        """, (book_id, limit))
+        books = [library_book_json(row, set()) for row in rows or []]
+        cache.set(cache_key, books, 300)
+        return jsonify(books)
+    except Exception as e:
+        print(f"Error in get_similar_books: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.disconnect()
+
+@app.route('/recommendations', methods=['GET'])
+@jwt_required
+def get_recommendations():
+    """
+    Personalized shelves, read from tables precomputed by recommendations.py:
+    - forYou: the user's top recommendations (user_recommendations)
+    - becauseYouListened: [{"book": {...}, "books": [...]}] neighbours of the
+      most recently played books, minus books the user already has
+    Both are empty until the job has run (or for users with no history); the
+    client falls back to the discover shelves.
+    """
+    user_id = request.user_id
+    cache_key = f"recommendations:{user_id}"
+    cached_data = cache.get(cache_key)
+    if cached_data is not None:
+        return jsonify(cached_data)
+
+    for_you_query = f"""
+        SELECT {RECOMMENDED_BOOK_SQL}
+        FROM user_recommendations ur
+        JOIN books b ON b.id = ur.book_id
+        {RECOMMENDED_BOOK_JOINS}
+        WHERE ur.user_id = %s
+        ORDER BY ur.rank
+        LIMIT %s
+    """
+    because_query = f"""
+        WITH recent AS (
+            SELECT ub.book_id, ub.last_accessed_at
+            FROM user_books ub
+            WHERE ub.user_id = %s
+              AND (ub.last_played_position_seconds > 0 OR COALESCE(ub.is_read::int, 0) = 1)
+            ORDER BY ub.last_accessed_at DESC NULLS LAST
+            LIMIT %s
+        )
+        SELECT r.book_id as source_id, src.title as source_title, {RECOMMENDED_BOOK_SQL}
+        FROM recent r
+        JOIN books src ON src.id = r.book_id
+        CROSS JOIN LATERAL (
+            SELECT bn.neighbor_id, bn.rank
+            FROM book_neighbors bn
+            WHERE bn.book_id = r.book_id
+              AND NOT EXISTS (
+                  SELECT 1 FROM user_books own WHERE own.user_id = %s AND own.book_id = bn.neighbor_id
+              )
+            ORDER BY bn.rank
+            LIMIT %s
+        ) n
+        JOIN books b ON b.id = n.neighbor_id
+        {RECOMMENDED_BOOK_JOINS}
+        ORDER BY r.last_accessed_at DESC NULLS LAST, n.rank
+    """
+
+    try:
+        sections = [
+            Section("for_you", lambda db: db.execute_query(
+                for_you_query, (user_id, RECOMMENDATION_SHELF_SIZE)) or [], default=[], readonly=True),
+            Section("because", lambda db: db.execute_query(
+                because_query, (user_id, BECAUSE_YOU_LISTENED_SHELVES, user_id, RECOMMENDATION_SHELF_SIZE)) or [],
+                default=[], readonly=True),
+            Section("favorites", lambda db: db.execute_query(
+                "SELECT book_id FROM favorites WHERE user_id = %s", (user_id,)) or [], default=[], readonly=True),
+        ]
+        results, failed, _ = run_sections(sections)
+        fav_set = {row['book_id'] for row in results["favorites"]}
+
+        shelves = {}
+        for row in results["because"]:
+            shelf = shelves.get(row['source_id'])
+            if shelf is None:
+                shelf = shelves[row['source_id']] = {
+                    "book": {"id": str(row['source_id']), "title": row['source_title']},
+                    "books": [],
+                }
+            shelf["books"].append(library_book_json(row, fav_set))
+
+        response = {
+            "forYou": [library_book_json(row, fav_set) for row in results["for_you"]],
+            "becauseYouListened": list(shelves.values()),
+        }
+        if failed:
+            response["partialSections"] = failed
+        else:
+            cache.set(cache_key, response, 300)
+        return jsonify(response)
+    except Exception as e:
+        print(f"Error in get_recommendations: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/user-books/<int:user_id>', methods=['GET'])
+@jwt_required
+def get_user_books(user_id):
+    db = Database()
+    if not db.connect():
         return jsonify({"error": "Database connection failed"}), 500
 
     try:
@@ -2715,6 +3029,7 @@ def buy_book():
         # Insert tracking entry (no payment since subscribed)
         insert_query = "INSERT INTO user_books (user_id, book_id) VALUES (%s, %s)"
         db.execute_query(insert_query, (user_id, book_id))
+        invalidate_user_cache(user_id)
 
         new_badges = []
         try:
@@ -2751,6 +3066,7 @@ def complete_track():
         # 1. Mark track as completed
         query = "INSERT INTO user_completed_tracks (user_id, track_id) VALUES (%s, %s) ON CONFLICT (user_id, track_id) DO NOTHING"
         db.execute_query(query, (user_id, track_id))
+        invalidate_user_cache(user_id)
         
         # 2. Check if ALL tracks for this book are completed
         # First get book_id
@@ -2824,6 +3140,8 @@ def complete_track():
                     # Mark book as read
                     update_read = "UPDATE user_books SET is_read = 1, last_accessed_at = CURRENT_TIMESTAMP WHERE user_id = %s AND book_id = %s"
                     db.execute_query(update_read, (user_id, book_id))
+                    reels_state.mark_completed(db, user_id, book_id)
+                    invalidate_user_cache(user_id)
 
                     # Check Badges (since book is now read)
                     try:
@@ -2860,100 +3178,96 @@ def update_progress():
         return jsonify({"error": "Database connection failed"}), 500
         
     try:
-        check_query = "SELECT id FROM user_books WHERE user_id = %s AND book_id = %s"
-        existing = db.execute_query(check_query, (user_id, book_id))
-
-        # Auto-add book to library if user is subscriber but book not in user_books
-        if not existing and is_subscriber(user_id, db):
-            insert_query = "INSERT INTO user_books (user_id, book_id) VALUES (%s, %s)"
-            db.execute_query(insert_query, (user_id, book_id))
-            existing = True  # Now it exists
-            print(f"Auto-added book {book_id} to library for subscriber user {user_id}")
+        # All progress writes commit together (one COMMIT instead of one per statement)
+        with db.transaction():
+            # Independent reads in one round-trip: library entry, book info, track completion
+            existing, book_rows, completed_res = db.execute_batch([
+                ("SELECT id FROM user_books WHERE user_id = %s AND book_id = %s", (user_id, book_id)),
+                ("""
+                    SELECT b.duration_seconds, b.primary_category_id,
+                           EXISTS (SELECT 1 FROM playlist_items pi WHERE pi.book_id = b.id) as is_playlist
+                    FROM books b WHERE b.id = %s
+                """, (book_id,)),
+                ("SELECT id FROM user_completed_tracks WHERE user_id = %s AND track_id = %s",
+                 (user_id, playlist_item_id)),
+            ])
+
+            # Auto-add book to library if user is subscriber but book not in user_books
+            if not existing and is_subscriber(user_id, db):
+                insert_query = "INSERT INTO user_books (user_id, book_id) VALUES (%s, %s)"
+                db.execute_query(insert_query, (user_id, book_id))
+                existing = True  # Now it exists
+                print(f"Auto-added book {book_id} to library for subscriber user {user_id}")
+
+            if existing:
+                # Duration Logic
+                db_duration = (book_rows[0]['duration_seconds'] or 0) if book_rows else 0
+                category_id = book_rows[0]['primary_category_id'] if book_rows else None
+                is_playlist = bool(book_rows and book_rows[0]['is_playlist'])
+
+                writes = []
+                if db_duration == 0 and total_duration and total_duration > 0:
+                    # Only update duration if it's NOT a playlist (playlists usually have 0 or sum)
+                    # For now we let it update, but we won't use it for is_read if it's a playlist
+                    print(f"Updating duration for book {book_id} to {total_duration}")
+                    writes.append(("UPDATE books SET duration_seconds = %s WHERE id = %s", (total_duration, book_id)))
+                    db_duration = total_duration
+
+                # Completion Check (95% rule) - ONLY for non-playlists
+                # Playlists are marked read only via /complete-track when all items are done
+                is_read = False
+                if not is_playlist and db_duration > 0 and position >= (db_duration * 0.95):
+                    is_read = True
+
+                # Update user_books
+                update_sql = "UPDATE user_books SET last_played_position_seconds = %s, last_accessed_at = CURRENT_TIMESTAMP"
+                params = [position]
 
-        if existing:
-            # Duration Logic
-            duration_query = "SELECT duration_seconds FROM books WHERE id = %s"
-            duration_result = db.execute_query(duration_query, (book_id,))
-            db_duration = duration_result[0]['duration_seconds'] if duration_result else 0
-            
-            if db_duration == 0 and total_duration and total_duration > 0:
-                # Only update duration if it's NOT a playlist (playlists usually have 0 or sum)
-                # For now we let it update, but we won't use it for is_read if it's a playlist
-                print(f"Updating duration for book {book_id} to {total_duration}")
-                update_book_query = "UPDATE books SET duration_seconds = %s WHERE id = %s"
-                db.execute_query(update_book_query, (total_duration, book_id))
-                db_duration = total_duration
-
-            # Check if Playlist
-            count_pl_query = "SELECT COUNT(*) as c FROM playlist_items WHERE book_id = %s"
-            is_playlist = db.execute_query(count_pl_query, (book_id,))[0]['c'] > 0
-
-            # Completion Check (95% rule) - ONLY for non-playlists
-            # Playlists are marked read only via /complete-track when all items are done
-            is_read = False
-            if not is_playlist and db_duration > 0 and position >= (db_duration * 0.95):
-                is_read = True
-            
-            # Update user_books
-            update_sql = "UPDATE user_books SET last_played_position_seconds = %s, last_accessed_at = CURRENT_TIMESTAMP"
-            params = [position]
-            
-            if is_read:
-                update_sql += ", is_read = 1"
-            
-            if playlist_item_id:
-                update_sql += ", current_playlist_item_id = %s"
-                params.append(playlist_item_id)
+                if is_read:
+                    update_sql += ", is_read = 1"
+
+                if playlist_item_id:
+                    update_sql += ", current_playlist_item_id = %s"
+                    params.append(playlist_item_id)
+
+                update_sql += " WHERE user_id = %s AND book_id = %s"
+                params.extend([user_id, book_id])
+                writes.append((update_sql, tuple(params)))
+
+                if playlist_item_id:
+                    track_upd_query = """
+                        INSERT INTO user_track_progress (user_id, book_id, playlist_item_id, position_seconds)
+                        VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (user_id, book_id, playlist_item_id) DO UPDATE SET 
+                            position_seconds = EXCLUDED.position_seconds, 
+                            updated_at = CURRENT_TIMESTAMP
+                    """
+                    writes.append((track_upd_query, (user_id, book_id, playlist_item_id, position)))
 
-            update_sql += " WHERE user_id = %s AND book_id = %s"
-            params.extend([user_id, book_id])
-            
-            db.execute_query(update_sql, tuple(params))
-            
-            if playlist_item_id:
-                track_upd_query = """
-                    INSERT INTO user_track_progress (user_id, book_id, playlist_item_id, position_seconds)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (user_id, book_id, playlist_item_id) DO UPDATE SET 
-                        position_seconds = EXCLUDED.position_seconds, 
-                        updated_at = CURRENT_TIMESTAMP
-                """
-                db.execute_query(track_upd_query, (user_id, book_id, playlist_item_id, position))
+                # Different tables, no dependencies: one round-trip
+                db.execute_batch(writes)
 
-            
-            # Log to playback_history (History Log)
-            # Use INSERT ON DUPLICATE KEY UPDATE to ensure only one record per user/book/playlist_item
-            # Skip updating if track is completed (optimization)
-            
-            # First check if this track/book is already completed
-            should_update = True
-            if playlist_item_id:
-                # Check if track is completed
-                completed_check = "SELECT id FROM user_completed_tracks WHERE user_id = %s AND track_id = %s"
-                completed_res = db.execute_query(completed_check, (user_id, playlist_item_id))
+                # Log to playback_history (History Log)
+                # Skip updating if track is completed (optimization)
                 if completed_res:
-                    should_update = False
                     print(f"Track {playlist_item_id} already completed, skipping playback_history update")
-            
-            if should_update:
-                # Use INSERT ON CONFLICT to maintain only one record per combination
-                history_query = """
-                    INSERT INTO playback_history (user_id, book_id, playlist_item_id, start_time, end_time, played_seconds)
-                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, %s)
-                    ON CONFLICT (user_id, book_id, playlist_item_id) DO UPDATE SET 
-                        end_time = CURRENT_TIMESTAMP,
-                        played_seconds = EXCLUDED.played_seconds
-                """
-                db.execute_query(history_query, (user_id, book_id, playlist_item_id, position))
-            
-            # Check for new badges
-            badge_service = BadgeService(db.connection)
-            new_badges = badge_service.check_badges(user_id)
-            
-            return jsonify({"message": "Progress updated", "is_read": is_read, "new_badges": new_badges}), 200
-        else:
+                else:
+                    # History upsert + daily rollup delta in one statement
+                    record_playback(db, user_id, book_id, playlist_item_id, position, category_id)
+
+        if not existing:
             return jsonify({"error": "Book not found in library"}), 404
-            
+        invalidate_user_cache(user_id)
+        if is_read:
+            # Own transaction: a failure there must not abort the progress write
+            reels_state.mark_completed(db, user_id, book_id)
+
+        # Check for new badges (BadgeService commits on its own)
+        badge_service = BadgeService(db.connection)
+        new_badges = badge_service.check_badges(user_id)
+
+        return jsonify({"message": "Progress updated", "is_read": is_read, "new_badges": new_badges}), 200
+
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -2993,79 +3307,10 @@ def get_user_stats(user_id):
         return jsonify({"error": "Database connection failed"}), 500
         
     try:
-        # Get all user's books
-        books_query = """
-            SELECT b.id, b.duration_seconds,
-                   (SELECT COUNT(*) FROM playlist_items WHERE book_id = b.id) as playlist_count
-            FROM user_books ub
-            JOIN books b ON ub.book_id = b.id
-            WHERE ub.user_id = %s
-        """
-        books_result = db.execute_query(books_query, (user_id,))
-        
-        total_seconds = 0
-        completed_count = 0
-        
-        if books_result:
-            for book in books_result:
-                book_id = book['id']
-                is_playlist = book['playlist_count'] > 0
-                total_duration = book['duration_seconds'] or 0
-                
-                # Calculate listen time using same logic as listen_history
-                if is_playlist:
-                    playlist_progress_query = """
-                        SELECT 
-                            pi.id as playlist_item_id,
-                            pi.duration_seconds,
-                            COALESCE(MAX(ph.played_seconds), 0) as last_position,
-                            (SELECT COUNT(*) FROM user_completed_tracks WHERE user_id = %s AND track_id = pi.id) as is_completed
-                        FROM playlist_items pi
-                        LEFT JOIN playback_history ph ON ph.playlist_item_id = pi.id AND ph.user_id = %s
-                        WHERE pi.book_id = %s
-                        GROUP BY pi.id, pi.duration_seconds
-                    """
-                    tracks_result = db.execute_query(playlist_progress_query, (user_id, user_id, book_id))
-                    
-                    book_listened_seconds = 0
-                    if tracks_result:
-                        for track in tracks_result:
-                            track_duration = track['duration_seconds'] or 0
-                            is_completed = track['is_completed'] > 0
-                            
-                            if is_completed and track_duration > 0:
-                                listened = track_duration
-                            else:
-                                last_pos = track['last_position'] or 0
-                                listened = min(last_pos, track_duration) if track_duration > 0 else last_pos
-                            
-                            book_listened_seconds += listened
-                    
-                    total_seconds += book_listened_seconds
-                    
-                    # Check if book is completed (all tracks at 100%)
-                    if total_duration > 0 and book_listened_seconds >= total_duration:
-                        completed_count += 1
-                else:
-                    # Single file
-                    single_progress_query = """
-                        SELECT COALESCE(MAX(played_seconds), 0) as last_position
-                        FROM playback_history
-                        WHERE user_id = %s AND book_id = %s
-                    """
-                    single_result = db.execute_query(single_progress_query, (user_id, book_id))
-                    if single_result:
-                        listened = single_result[0]['last_position'] or 0
-                        total_seconds += listened
-                        
-                        # Check if completed (95% threshold)
-                        if total_duration > 0 and listened >= (total_duration * 0.95):
-                            completed_count += 1
-        
-        return jsonify({
-            "total_listening_time_seconds": total_seconds,
-            "books_completed": completed_count
-        })
+        # Listening time comes from the daily rollup (O(days), no playback_history scan);
+        # completion is tracked on user_books by /update-progress and /complete-track.
+        with db.transaction(readonly=True):
+            return jsonify(_user_stats_section(db, user_id))
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -3074,112 +3319,139 @@ def get_user_stats(user_id):
 
 
 
+LISTEN_HISTORY_DEFAULT_LIMIT = 100
+LISTEN_HISTORY_MAX_LIMIT = 200
+
+# One statement for a page of history: the page is read off
+# idx_user_books_history_recent, then progress is computed only for those books.
+# Playlist books sum per-track progress (full duration for completed tracks,
+# capped at the track length otherwise); single files use their MAX position.
+LISTEN_HISTORY_QUERY = """
+    WITH page AS (
+        SELECT ub.book_id, ub.last_accessed_at
+        FROM user_books ub
+        WHERE ub.user_id = %(user_id)s AND ub.last_played_position_seconds > 0
+        ORDER BY ub.last_accessed_at DESC, ub.book_id DESC
+        LIMIT %(limit)s OFFSET %(offset)s
+    ),
+    track_progress AS (
+        SELECT t.book_id,
+               SUM(CASE
+                       WHEN t.completed AND t.duration > 0 THEN t.duration
+                       WHEN t.duration > 0 THEN LEAST(t.last_position, t.duration)
+                       ELSE t.last_position
+                   END) AS listened
+        FROM (
+            SELECT pi.book_id,
+                   COALESCE(pi.duration_seconds, 0) AS duration,
+                   COALESCE((
+                       SELECT MAX(ph.played_seconds) FROM playback_history ph
+                       WHERE ph.user_id = %(user_id)s AND ph.book_id = pi.book_id
+                         AND ph.playlist_item_id = pi.id
+                   ), 0) AS last_position,
+                   EXISTS (
+                       SELECT 1 FROM user_completed_tracks uct
+                       WHERE uct.user_id = %(user_id)s AND uct.track_id = pi.id
+                   ) AS completed
+            FROM page
+            JOIN playlist_items pi ON pi.book_id = page.book_id
+        ) t
+        GROUP BY t.book_id
+    ),
+    single_progress AS (
+        SELECT ph.book_id, MAX(ph.played_seconds) AS listened
+        FROM page
+        JOIN playback_history ph ON ph.user_id = %(user_id)s AND ph.book_id = page.book_id
+        GROUP BY ph.book_id
+    )
+    SELECT b.id, b.title, b.author, b.audio_path, b.cover_image_path,
+           c.slug AS category_slug, b.duration_seconds, page.last_accessed_at,
+           b.premium, br.avg_rating AS average_rating, COALESCE(br.rating_cnt, 0) AS rating_count,
+           CASE WHEN tp.book_id IS NOT NULL THEN tp.listened
+                ELSE COALESCE(sp.listened, 0) END AS listened_seconds
+    FROM page
+    JOIN books b ON b.id = page.book_id
+    LEFT JOIN categories c ON b.primary_category_id = c.id
+    LEFT JOIN LATERAL (
+        SELECT AVG(stars) AS avg_rating, COUNT(*) AS rating_cnt
+        FROM book_ratings WHERE book_id = page.book_id
+    ) br ON TRUE
+    LEFT JOIN track_progress tp ON tp.book_id = page.book_id
+    LEFT JOIN single_progress sp ON sp.book_id = page.book_id
+    ORDER BY page.last_accessed_at DESC, page.book_id DESC
+"""
+
+
+def fetch_listen_history(db, user_id, limit=None, offset=0):
+    """
+    Recently played books with listened seconds and percentage, newest first.
+
+    Args:
+        limit (int or None): Page size; None returns the whole history (LIMIT NULL)
+
+    Returns:
+        tuple: (history list, has_more), or (None, False) if the query failed
+    """
+    rows = db.execute_query(
+        LISTEN_HISTORY_QUERY,
+        {"user_id": user_id, "limit": limit + 1 if limit is not None else None, "offset": offset},
+    )
+    if rows is None:
+        return None, False
+
+    has_more = limit is not None and len(rows) > limit
+    history = []
+    for book in rows[:limit]:
+        cover_path, cover_thumbnail_path = resolve_cover_urls(book['cover_image_path'])
+        audio_path = resolve_stored_url(book['audio_path'], "AudioBooks")
+        total_listened = book['listened_seconds'] or 0
+        total_duration = book['duration_seconds'] or 0
+        percentage = (total_listened / total_duration * 100) if total_duration > 0 else 0
+
+        history.append({
+            "id": str(book['id']),
+            "title": book['title'],
+            "author": book['author'],
+            "audioUrl": audio_path,
+            "coverUrl": cover_path,
+            "coverUrlThumbnail": cover_thumbnail_path,
+            "categoryId": book['category_slug'] or "",
+            "lastPosition": int(total_listened),
+            "duration": total_duration,
+            "percentage": round(percentage, 2),
+            "lastAccessed": str(book['last_accessed_at']),
+            "averageRating": float(book['average_rating'] or 0),
+            "ratingCount": int(book['rating_count'] or 0),
+            "premium": bool(book['premium'])
+        })
+    return history, has_more
+
+
 @app.route('/listen-history/<int:user_id>', methods=['GET'])
 @jwt_required
 def get_listen_history(user_id):
     db = Database()
     if not db.connect():
         return jsonify({"error": "Database connection failed"}), 500
-        
-    try:
-        # Get all books the user has accessed
-        books_query = """
-            SELECT DISTINCT b.id, b.title, b.author, b.audio_path, b.cover_image_path,
-                   c.slug as category_slug, b.duration_seconds, ub.last_accessed_at,
-                   b.premium,
-                   (SELECT AVG(stars) FROM book_ratings WHERE book_id = b.id) as average_rating,
-                   (SELECT COUNT(*) FROM book_ratings WHERE book_id = b.id) as rating_count,
-                   (SELECT COUNT(*) FROM playlist_items WHERE book_id = b.id) as playlist_count
-            FROM user_books ub
-            JOIN books b ON ub.book_id = b.id
-            LEFT JOIN categories c ON b.primary_category_id = c.id
-            WHERE ub.user_id = %s AND ub.last_played_position_seconds > 0
-            ORDER BY ub.last_accessed_at DESC
-        """
-        books_result = db.execute_query(books_query, (user_id,))
-        
-        history = []
-        if books_result:
-            for book in books_result:
-                book_id = book['id']
-                is_playlist = book['playlist_count'] > 0
-                
-                # Calculate total listen time based on playback_history
-                total_listened_seconds = 0
-                
-                if is_playlist:
-                    # For playlists: get the last (MAX) position for each track
-                    # For completed tracks, use full duration instead
-                    playlist_progress_query = """
-                        SELECT 
-                            pi.id as playlist_item_id,
-                            pi.duration_seconds,
-                            COALESCE(MAX(ph.played_seconds), 0) as last_position,
-                            (SELECT COUNT(*) FROM user_completed_tracks WHERE user_id = %s AND track_id = pi.id) as is_completed
-                        FROM playlist_items pi
-                        LEFT JOIN playback_history ph ON ph.playlist_item_id = pi.id AND ph.user_id = %s
-                        WHERE pi.book_id = %s
-                        GROUP BY pi.id, pi.duration_seconds
-                    """
-                    tracks_result = db.execute_query(playlist_progress_query, (user_id, user_id, book_id))
-                    
-                    if tracks_result:
-                        # Sum the last position of each track to get total listen time
-                        # For completed tracks, use full duration
-                        for track in tracks_result:
-                            track_duration = track['duration_seconds'] or 0
-                            is_completed = track['is_completed'] > 0
-                            
-                            if is_completed and track_duration > 0:
-                                # Track is completed - use full duration
-                                listened = track_duration
-                            else:
-                                # Track not completed - use last recorded position
-                                last_pos = track['last_position'] or 0
-                                # Use the minimum of last_position and duration to avoid over-counting
-                                listened = min(last_pos, track_duration) if track_duration > 0 else last_pos
-                            
-                            total_listened_seconds += listened
-                else:
-                    # For single files: get the MAX position from playback_history
-                    single_progress_query = """
-                        SELECT COALESCE(MAX(played_seconds), 0) as last_position
-                        FROM playback_history
-                        WHERE user_id = %s AND book_id = %s
-                    """
-                    single_result = db.execute_query(single_progress_query, (user_id, book_id))
-                    if single_result:
-                        total_listened_seconds = single_result[0]['last_position'] or 0
-                
-                # Resolve cover URL and thumbnail (handles R2 and local)
-                cover_path, cover_thumbnail_path = resolve_cover_urls(book['cover_image_path'])
-
-                # Resolve audio URL (handles R2 refs, http, and relative paths)
-                audio_path = resolve_stored_url(book['audio_path'], "AudioBooks")
 
-                # Calculate percentage
-                total_duration = book['duration_seconds'] or 0
-                percentage = (total_listened_seconds / total_duration * 100) if total_duration > 0 else 0
+    try:
+        page = max(1, request.args.get('page', 1, type=int))
+        if 'limit' in request.args or 'page' in request.args:
+            limit = request.args.get('limit', LISTEN_HISTORY_DEFAULT_LIMIT, type=int)
+            limit = min(max(1, limit), LISTEN_HISTORY_MAX_LIMIT)
+            history, has_more = fetch_listen_history(db, user_id, limit, (page - 1) * limit)
+        else:
+            # Clients that don't page keep getting the whole history
+            history, has_more = fetch_listen_history(db, user_id)
+        if history is None:
+            return jsonify({"error": "Failed to load listen history"}), 500
+
+        # Body stays a plain list for existing clients; paging info goes in headers
+        response = jsonify(history)
+        response.headers['X-Has-More'] = 'true' if has_more else 'false'
+        response.headers['X-Page'] = str(page)
+        return response
 
-                history.append({
-                    "id": str(book_id),
-                    "title": book['title'],
-                    "author": book['author'],
-                    "audioUrl": audio_path,
-                    "coverUrl": cover_path,
-                    "coverUrlThumbnail": cover_thumbnail_path,
-                    "categoryId": book['category_slug'] or "",
-                    "lastPosition": int(total_listened_seconds),
-                    "duration": total_duration,
-                    "percentage": round(percentage, 2),
-                    "lastAccessed": str(book['last_accessed_at']),
-                    "averageRating": float(book['average_rating'] or 0),
-                    "ratingCount": int(book['rating_count'] or 0),
-                    "premium": bool(book['premium'])
-                })
-                
-        return jsonify(history)
-        
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -3286,6 +3558,7 @@ def update_user_background_music():
         affected = db.execute_query(query, (user_id, book_id, bg_music_id))
         if affected is None:
             return jsonify({"error": "Failed to update background music preference"}), 500
+        invalidate_user_cache(user_id)
 
         return jsonify({"message": "Background music preference updated"}), 200
     except Exception as e:
@@ -3298,6 +3571,16 @@ def update_user_background_music():
 def health_check():
     return jsonify({"status": "ok", "message": "Audiobooks API is running"})
 
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics_endpoint():
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            return jsonify({"error": "Unauthorized"}), 401
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({"error": "Forbidden"}), 403
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/badges/<int:user_id>', methods=['GET'])
 @jwt_required
 def get_user_badges(user_id):
@@ -3331,6 +3614,7 @@ def add_favorite():
     try:
         query = "INSERT INTO favorites (user_id, book_id) VALUES (%s, %s) ON CONFLICT (user_id, book_id) DO NOTHING"
         db.execute_query(query, (user_id, book_id))
+        invalidate_user_cache(user_id)
         return jsonify({"message": "Added to favorites"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -3353,6 +3637,7 @@ def remove_favorite():
     try:
         query = "DELETE FROM favorites WHERE user_id = %s AND book_id = %s"
         db.execute_query(query, (user_id, book_id))
+        invalidate_user_cache(user_id)
         return jsonify({"message": "Removed from favorites"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -3454,6 +3739,11 @@ def upload_book():
             db.disconnect()
             return jsonify({"error": "Cover photo is required"}), 400
 
+        # File analysis and R2 uploads take minutes for a long playlist: don't
+        # hold a pooled connection through them (the pool reaper closes
+        # connections held past DB_POOL_MAX_HOLD_SECONDS). Reconnect for the INSERT.
+        db.disconnect()
+
         # Base directories
         base_dir = os.path.dirname(os.path.abspath(__file__))
         static_dir = os.path.join(base_dir, 'static')
@@ -3512,6 +3802,9 @@ def upload_book():
                         except Exception as e:
                             print(f"Could not extract WAV duration for {safe_fname}: {e}")
 
+                    # Waveform peaks + loudness (served to players for drawing/normalization)
+                    analysis = analyze_audio(temp_path) or {}
+
                     # Try R2 upload, fallback to local
                     r2_key = f"AudioBooks/{folder_name}/{safe_fname}"
                     r2_url = upload_local_file_to_r2(temp_path, r2_key)
@@ -3529,7 +3822,9 @@ def upload_book():
                         "path": full_url,
                         "title": file.filename,
                         "order": index,
-                        "duration": duration_seconds
+                        "duration": duration_seconds,
+                        "waveform_peaks": analysis.get('waveform_peaks'),
+                        "loudness_lufs": analysis.get('loudness_lufs')
                     })
 
                 main_audio_path = saved_files_info[0]["path"] if saved_files_info else ""
@@ -3564,6 +3859,9 @@ def upload_book():
                     except Exception as e:
                         print(f"Could not extract WAV duration for single file: {e}")
 
+                # Waveform peaks + loudness
+                analysis = analyze_audio(temp_path) or {}
+
                 # Try R2 upload, fallback to local
                 r2_key = f"AudioBooks/{audio_filename}"
                 r2_url = upload_local_file_to_r2(temp_path, r2_key)
@@ -3576,7 +3874,14 @@ def upload_book():
                     shutil.copy2(temp_path, local_path)
                     main_audio_path = f"{BASE_URL}static/AudioBooks/{audio_filename}"
 
-                saved_files_info.append({"path": main_audio_path, "title": audio_file.filename, "order": 0, "duration": duration_seconds})
+                saved_files_info.append({
+                    "path": main_audio_path,
+                    "title": audio_file.filename,
+                    "order": 0,
+                    "duration": duration_seconds,
+                    "waveform_peaks": analysis.get('waveform_peaks'),
+                    "loudness_lufs": analysis.get('loudness_lufs')
+                })
 
             # Handle Cover
             db_cover_path = None
@@ -3646,15 +3951,22 @@ def upload_book():
         # Insert Book
         # Calculate total duration for playlists
         total_duration = sum(item.get('duration', 0) for item in saved_files_info)
+
+        # Single-file books keep their analysis on the books row
+        book_peaks = None if is_playlist else saved_files_info[0].get('waveform_peaks')
+        book_loudness = None if is_playlist else saved_files_info[0].get('loudness_lufs')
         
         insert_query = """
             INSERT INTO books
-            (title, author, primary_category_id, audio_path, cover_image_path, posted_by_user_id, description, price, duration_seconds, pdf_path, premium, background_music_id)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            (title, author, primary_category_id, audio_path, cover_image_path, posted_by_user_id, description, price, duration_seconds, pdf_path, premium, background_music_id, waveform_peaks, loudness_lufs)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             RETURNING id
         """
-        params = (title, author, numeric_cat_id, main_audio_path, db_cover_path, user_id, description, price, total_duration, db_pdf_path, int(is_premium), background_music_id)
-        
+        params = (title, author, numeric_cat_id, main_audio_path, db_cover_path, user_id, description, price, total_duration, db_pdf_path, int(is_premium), background_music_id, book_peaks, book_loudness)
+
+        db = Database()
+        if not db.connect():
+            return jsonify({"error": "Database connection failed"}), 500
         cursor = db.connection.cursor()
         cursor.execute(insert_query, params)
         book_id = cursor.fetchone()[0]
@@ -3662,11 +3974,12 @@ def upload_book():
         # Insert Playlist Items if Playlist
         if is_playlist:
             pl_query = """
-                INSERT INTO playlist_items (book_id, file_path, title, track_order, duration_seconds)
-                VALUES (%s, %s, %s, %s, %s)
+                INSERT INTO playlist_items (book_id, file_path, title, track_order, duration_seconds, waveform_peaks, loudness_lufs)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
             """
             for item in saved_files_info:
-                cursor.execute(pl_query, (book_id, item['path'], item['title'], item['order'], item.get('duration', 0)))
+                cursor.execute(pl_query, (book_id, item['path'], item['title'], item['order'], item.get('duration', 0),
+                                          item.get('waveform_peaks'), item.get('loudness_lufs')))
 
         # Auto-Buy
         own_query = "INSERT INTO user_books (user_id, book_id) VALUES (%s, %s)"
@@ -3675,6 +3988,9 @@ def upload_book():
         db.connection.commit()
         cursor.close()
         db.disconnect()
+        reels.invalidate()
+        bump_catalog_version()
+        invalidate_user_cache(user_id)
         
         return jsonify({"message": "Book/Playlist uploaded successfully", "book_id": book_id}), 201
 
@@ -3791,6 +4107,7 @@ def save_quiz_result():
         cursor.execute(ins_query, (user_id, quiz_id, score_percentage, is_passed))
         db.connection.commit()
         cursor.close()
+        invalidate_user_cache(user_id)
 
         new_badges = []
 
@@ -3854,6 +4171,8 @@ def save_quiz_result():
                     # Mark book as read
                     update_read = "UPDATE user_books SET is_read = 1, last_accessed_at = CURRENT_TIMESTAMP WHERE user_id = %s AND book_id = %s"
                     db.execute_query(update_read, (user_id, book_id))
+                    reels_state.mark_completed(db, user_id, book_id)
+                    invalidate_user_cache(user_id)
 
                     # Check badges
                     try:
@@ -4021,7 +4340,7 @@ def get_subscription_status():
                     db.connection.commit()
                     cursor.close()
                     
-                    invalidate_user_cache(user_id)
+                    invalidate_subscription_cache(user_id)
                     
                     # Update local variable for return
                     sub['start_date'] = new_start
@@ -4132,7 +4451,7 @@ def subscribe():
         # end_date is UTC naive datetime, convert properly
         end_date_ts = int(end_date.replace(tzinfo=datetime.timezone.utc).timestamp()) if end_date else None
 
-        invalidate_user_cache(user_id)
+        invalidate_subscription_cache(user_id)
         return jsonify({
             "message": f"Subscription {action} successfully",
             "plan_type": plan_type,
@@ -4178,7 +4497,7 @@ def cancel_subscription():
         db.connection.commit()
         cursor.close()
 
-        invalidate_user_cache(user_id)
+        invalidate_subscription_cache(user_id)
         return jsonify({"message": "Subscription cancelled"}), 200
 
     except Exception as e:
@@ -4235,7 +4554,7 @@ def admin_set_subscription():
             cursor.execute(update_query, (user_id,))
             db.connection.commit()
             cursor.close()
-            invalidate_user_cache(user_id)
+            invalidate_subscription_cache(user_id)
             return jsonify({"message": f"Subscription deactivated for {target_email}"}), 200
 
         # Activate subscription
@@ -4260,7 +4579,7 @@ def admin_set_subscription():
         # end_date is UTC naive datetime, convert properly
         end_date_ts = int(end_date.replace(tzinfo=datetime.timezone.utc).timestamp()) if end_date else "lifetime"
 
-        invalidate_user_cache(user_id)
+        invalidate_subscription_cache(user_id)
         return jsonify({
             "message": f"Subscription activated for {target_email}",
             "plan_type": plan_type,
@@ -4473,354 +4792,196 @@ def get_user_book_rating(book_id, user_id):
 
 
 # ===================== COMBINED PROFILE-INIT ENDPOINT =====================
+def _profile_section(db, token_user_id):
+    users = db.execute_query(
+        "SELECT id, name, email, profile_picture_url, is_verified, preferences FROM users WHERE id = %s",
+        (token_user_id,)
+    )
+    if not users:
+        return None
+    user = users[0]
+    aes_key = get_or_create_user_aes_key(user['id'], db)
+
+    # Initialize preferences if NULL
+    user_prefs = user.get('preferences')
+    if user_prefs is None:
+        default_prefs = {
+            "categories": [],
+            "daily_goal_minutes": 15, # Default to 15
+            "primary_goal": "read_more",
+            "book_picks": []
+        }
+        # Update DB
+        try:
+             # Use json.dumps for the DB update
+            update_query = "UPDATE users SET preferences = %s WHERE id = %s"
+            db.execute_query(update_query, (json.dumps(default_prefs), token_user_id))
+            user_prefs = default_prefs # Use dict for response
+        except Exception as e:
+            print(f"Error initializing preferences: {e}")
+            user_prefs = default_prefs # Fallback for response
+
+    return {
+        "id": user['id'],
+        "name": user['name'],
+        "email": user['email'],
+        "profile_picture_url": resolve_stored_url(user['profile_picture_url'], "profilePictures"),
+        "aes_key": aes_key,
+        "preferences": user_prefs
+    }
+
+
+def _user_stats_section(db, user_id):
+    # Daily rollup + is_read, same as /user-stats
+    total_seconds = get_total_listening_seconds(db, user_id)
+    completed_res = db.execute_query(
+        "SELECT COUNT(*) as count FROM user_books WHERE user_id = %s AND is_read = 1", (user_id,)
+    )
+    completed_count = completed_res[0]['count'] if completed_res else 0
+    return {"total_listening_time_seconds": total_seconds, "books_completed": completed_count}
+
+
+def _subscription_section(db, user_id):
+    sub_data = {"user_id": user_id, "status": "none", "is_active": False}
+    sub_result = db.execute_query(
+        "SELECT id, plan_type, status, start_date, end_date, auto_renew FROM subscriptions WHERE user_id = %s",
+        (user_id,)
+    )
+    if sub_result:
+        sub = sub_result[0]
+        now = datetime.datetime.utcnow()
+        if sub['end_date'] and sub['end_date'] < now and sub['auto_renew']:
+            plan = sub['plan_type']
+            duration = datetime.timedelta(days=30)
+            if plan == 'test_minute': duration = datetime.timedelta(minutes=1)
+            elif plan == 'yearly': duration = datetime.timedelta(days=365)
+            elif plan == 'lifetime': duration = None
+            if duration:
+                new_start, new_end = now, now + duration
+                cursor = db.connection.cursor()
+                cursor.execute("UPDATE subscriptions SET start_date=%s, end_date=%s, status='active' WHERE id=%s", (new_start, new_end, sub['id']))
+                cursor.execute("INSERT INTO subscription_history (user_id,action,plan_type,notes) VALUES (%s,'renewed',%s,'Auto-renewal via profile-init')", (user_id, plan))
+                db.connection.commit()
+                cursor.close()
+                invalidate_subscription_cache(user_id)
+                sub['start_date'], sub['end_date'], sub['status'] = new_start, new_end, 'active'
+        is_active = sub['status'] == 'active'
+        if is_active and sub['end_date']:
+            is_active = sub['end_date'] > now
+        def to_ts(dt):
+            return int(dt.replace(tzinfo=datetime.timezone.utc).timestamp()) if dt else None
+        sub_data = {
+            "id": sub['id'], "user_id": user_id, "plan_type": sub['plan_type'],
+            "status": "active" if is_active else "expired",
+            "start_date": to_ts(sub['start_date']), "end_date": to_ts(sub['end_date']),
+            "auto_renew": bool(sub['auto_renew']), "is_active": is_active
+        }
+    return sub_data
+
+
+def _genres_section(db, user_id):
+    genre_query = """
+        SELECT c.slug, c.name, COUNT(DISTINCT ub.book_id) as count
+        FROM user_books ub
+        JOIN book_categories bc ON ub.book_id = bc.book_id
+        JOIN categories c ON bc.category_id = c.id
+        WHERE ub.user_id = %s
+        GROUP BY c.slug, c.name
+        ORDER BY count DESC
+        LIMIT 8
+    """
+    genre_rows = db.execute_query(genre_query, (user_id,))
+    return [
+        {"slug": row['slug'], "name": row['name'], "count": row['count']}
+        for row in genre_rows or []
+    ]
+
+
+def _mastery_section(db, user_id):
+    result = db.execute_query("""
+        SELECT
+            (SELECT COUNT(*) FROM user_books WHERE user_id = %s AND is_read = 1) as books_read,
+            (SELECT COUNT(*) FROM books) as books_total,
+            (SELECT COUNT(DISTINCT quiz_id) FROM user_quiz_results WHERE user_id = %s AND is_passed = 1) as quizzes_passed
+    """, (user_id, user_id))
+    row = result[0] if result else {}
+    return {
+        "books_read": row.get('books_read', 0),
+        "books_total": row.get('books_total', 0),
+        "quizzes_passed": row.get('quizzes_passed', 0)
+    }
+
+
 @app.route('/profile-init/<int:user_id>', methods=['GET'])
 @jwt_required
 def profile_init(user_id):
     """
     Combined endpoint for the profile screen. Returns in ONE call:
     - user profile, listen history, user stats, badges, subscription status
-    Replaces 5 separate API calls with 1.
+    Replaces 5 separate API calls with 1. Sections run concurrently on
+    separate connections (see composite.py); failed ones fall back to empty
+    values and are listed in "partialSections".
     """
-    db = Database()
-    if not db.connect():
-        return jsonify({"error": "Database connection failed"}), 500
-
     try:
-        # 1. User profile
-        user_data = None
+        token_user_id = None
         auth_header = request.headers.get('Authorization')
         if auth_header:
             access_token = auth_header.split()[1]
             payload = pyjwt.decode(access_token, options={"verify_signature": False})
             token_user_id = payload.get('user_id')
-            users = db.execute_query(
-                "SELECT id, name, email, profile_picture_url, is_verified, preferences FROM users WHERE id = %s",
-                (token_user_id,)
-            )
-            if users:
-                user = users[0]
-                aes_key = get_or_create_user_aes_key(user['id'], db)
-                
-                # Initialize preferences if NULL
-                user_prefs = user.get('preferences')
-                if user_prefs is None:
-                    default_prefs = {
-                        "categories": [],
-                        "daily_goal_minutes": 15, # Default to 15
-                        "primary_goal": "read_more",
-                        "book_picks": []
-                    }
-                    # Update DB
-                    try:
-                         # Use json.dumps for the DB update
-                        update_query = "UPDATE users SET preferences = %s WHERE id = %s"
-                        db.execute_query(update_query, (json.dumps(default_prefs), token_user_id))
-                        user_prefs = default_prefs # Use dict for response
-                    except Exception as e:
-                        print(f"Error initializing preferences: {e}")
-                        user_prefs = default_prefs # Fallback for response
-
-                user_data = {
-                    "id": user['id'],
-                    "name": user['name'],
-                    "email": user['email'],
-                    "profile_picture_url": resolve_stored_url(user['profile_picture_url'], "profilePictures"),
-                    "aes_key": aes_key,
-                    "preferences": user_prefs
-                }
-
-        # 2. Listen history with batched progress queries
-        history = []
-        books_query = """
-            SELECT DISTINCT b.id, b.title, b.author, b.audio_path, b.cover_image_path,
-                   c.slug as category_slug, b.duration_seconds, ub.last_accessed_at,
-                   b.premium,
-                   br_stats.avg_rating as average_rating,
-                   COALESCE(br_stats.rating_cnt, 0) as rating_count,
-                   COALESCE(pi_count.cnt, 0) as playlist_count
-            FROM user_books ub
-            JOIN books b ON ub.book_id = b.id
-            LEFT JOIN categories c ON b.primary_category_id = c.id
-            LEFT JOIN (SELECT book_id, COUNT(*) as cnt FROM playlist_items GROUP BY book_id) pi_count ON pi_count.book_id = b.id
-            LEFT JOIN (SELECT book_id, AVG(stars) as avg_rating, COUNT(*) as rating_cnt FROM book_ratings GROUP BY book_id) br_stats ON br_stats.book_id = b.id
-            WHERE ub.user_id = %s AND ub.last_played_position_seconds > 0
-            ORDER BY ub.last_accessed_at DESC
-        """
-        books_result = db.execute_query(books_query, (user_id,))
-
-        # Batch fetch all progress data once for history + stats
-        all_user_book_ids = []
-        if books_result:
-            all_user_book_ids = [b['id'] for b in books_result]
-
-        # Also get all user books for stats
-        ub_query = """
-            SELECT b.id, b.duration_seconds,
-                   COALESCE(pi_count.cnt, 0) as playlist_count
-            FROM user_books ub
-            JOIN books b ON ub.book_id = b.id
-            LEFT JOIN (SELECT book_id, COUNT(*) as cnt FROM playlist_items GROUP BY book_id) pi_count ON pi_count.book_id = b.id
-            WHERE ub.user_id = %s
-        """
-        ub_result = db.execute_query(ub_query, (user_id,))
-        stat_book_ids = [b['id'] for b in ub_result] if ub_result else []
-
-        # Combine all book IDs for a single batch fetch
-        combined_ids = list(set(all_user_book_ids + stat_book_ids))
-
-        tracks_by_book = {}
-        single_by_book = {}
-        if combined_ids:
-            ph = ','.join(['%s'] * len(combined_ids))
-            tracks_q = f"""
-                SELECT pi.book_id, pi.id as playlist_item_id, pi.duration_seconds,
-                       COALESCE(MAX(ph.played_seconds), 0) as last_position,
-                       CASE WHEN uct.id IS NOT NULL THEN 1 ELSE 0 END as is_completed
-                FROM playlist_items pi
-                LEFT JOIN playback_history ph ON ph.playlist_item_id = pi.id AND ph.user_id = %s
-                LEFT JOIN user_completed_tracks uct ON uct.track_id = pi.id AND uct.user_id = %s
-                WHERE pi.book_id IN ({ph})
-                GROUP BY pi.id, pi.book_id, pi.duration_seconds, uct.id
-            """
-            tracks_result = db.execute_query(tracks_q, (user_id, user_id, *combined_ids))
-            if tracks_result:
-                for t in tracks_result:
-                    bid = t['book_id']
-                    if bid not in tracks_by_book:
-                        tracks_by_book[bid] = []
-                    tracks_by_book[bid].append(t)
-
-            single_q = f"""
-                SELECT book_id, COALESCE(MAX(played_seconds), 0) as last_position
-                FROM playback_history WHERE user_id = %s AND book_id IN ({ph})
-                GROUP BY book_id
-            """
-            single_result = db.execute_query(single_q, (user_id, *combined_ids))
-            if single_result:
-                for r in single_result:
-                    single_by_book[r['book_id']] = r['last_position'] or 0
-
-        # Build history response
-        if books_result:
-            for book in books_result:
-                book_id = book['id']
-                is_playlist = book['playlist_count'] > 0
-                total_listened = 0
-                if is_playlist:
-                    for track in tracks_by_book.get(book_id, []):
-                        td = track['duration_seconds'] or 0
-                        if track['is_completed'] and td > 0:
-                            total_listened += td
-                        else:
-                            lp = track['last_position'] or 0
-                            total_listened += min(lp, td) if td > 0 else lp
-                else:
-                    total_listened = single_by_book.get(book_id, 0)
-
-                cover_path, cover_thumb = resolve_cover_urls(book['cover_image_path'])
-                audio_path = resolve_stored_url(book['audio_path'], "AudioBooks")
-                total_duration = book['duration_seconds'] or 0
-                pct = (total_listened / total_duration * 100) if total_duration > 0 else 0
-
-                history.append({
-                    "id": str(book_id), "title": book['title'], "author": book['author'],
-                    "audioUrl": audio_path, "coverUrl": cover_path, "coverUrlThumbnail": cover_thumb,
-                    "categoryId": book['category_slug'] or "", "lastPosition": int(total_listened),
-                    "duration": total_duration, "percentage": round(pct, 2),
-                    "lastAccessed": str(book['last_accessed_at']),
-                    "averageRating": float(book['average_rating'] or 0),
-                    "ratingCount": int(book['rating_count'] or 0),
-                    "premium": bool(book['premium'])
-                })
-
-        # 3. Stats (reuse batched data)
-        total_seconds = 0
-        completed_count = 0
-        if ub_result:
-            for book in ub_result:
-                bid = book['id']
-                is_playlist = book['playlist_count'] > 0
-                total_duration = book['duration_seconds'] or 0
-                if is_playlist:
-                    book_listened = 0
-                    for track in tracks_by_book.get(bid, []):
-                        td = track['duration_seconds'] or 0
-                        if track['is_completed'] and td > 0:
-                            book_listened += td
-                        else:
-                            lp = track['last_position'] or 0
-                            book_listened += min(lp, td) if td > 0 else lp
-                    total_seconds += book_listened
-                    if total_duration > 0 and book_listened >= total_duration:
-                        completed_count += 1
-                else:
-                    listened = single_by_book.get(bid, 0)
-                    total_seconds += listened
-                    if total_duration > 0 and listened >= (total_duration * 0.95):
-                        completed_count += 1
-        stats = {"total_listening_time_seconds": total_seconds, "books_completed": completed_count}
-
-        # 4. Badges
-        badge_service = BadgeService(db.connection)
-        badges = badge_service.get_all_badges_with_progress(user_id)
-
-        # 5. Subscription
-        sub_data = {"user_id": user_id, "status": "none", "is_active": False}
-        sub_result = db.execute_query(
-            "SELECT id, plan_type, status, start_date, end_date, auto_renew FROM subscriptions WHERE user_id = %s",
-            (user_id,)
-        )
-        if sub_result:
-            sub = sub_result[0]
-            now = datetime.datetime.utcnow()
-            if sub['end_date'] and sub['end_date'] < now and sub['auto_renew']:
-                plan = sub['plan_type']
-                duration = datetime.timedelta(days=30)
-                if plan == 'test_minute': duration = datetime.timedelta(minutes=1)
-                elif plan == 'yearly': duration = datetime.timedelta(days=365)
-                elif plan == 'lifetime': duration = None
-                if duration:
-                    new_start, new_end = now, now + duration
-                    cursor = db.connection.cursor()
-                    cursor.execute("UPDATE subscriptions SET start_date=%s, end_date=%s, status='active' WHERE id=%s", (new_start, new_end, sub['id']))
-                    cursor.execute("INSERT INTO subscription_history (user_id,action,plan_type,notes) VALUES (%s,'renewed',%s,'Auto-renewal via profile-init')", (user_id, plan))
-                    db.connection.commit()
-                    cursor.close()
-                    sub['start_date'], sub['end_date'], sub['status'] = new_start, new_end, 'active'
-            is_active = sub['status'] == 'active'
-            if is_active and sub['end_date']:
-                is_active = sub['end_date'] > now
-            def to_ts(dt):
-                return int(dt.replace(tzinfo=datetime.timezone.utc).timestamp()) if dt else None
-            sub_data = {
-                "id": sub['id'], "user_id": user_id, "plan_type": sub['plan_type'],
-                "status": "active" if is_active else "expired",
-                "start_date": to_ts(sub['start_date']), "end_date": to_ts(sub['end_date']),
-                "auto_renew": bool(sub['auto_renew']), "is_active": is_active
-            }
 
-        # 6. Chart Stats (heatmap, genres, weekly, mastery) — merged from /user/stats
-        chart_stats = {}
-
-        # 6a. Listening Heatmap (Last 365 days)
-        try:
-            heatmap_query = """
-                SELECT DATE(start_time) as day, SUM(played_seconds) as total_seconds
-                FROM playback_history
-                WHERE user_id = %s
-                  AND start_time > NOW() - INTERVAL '365 days'
-                GROUP BY day
-                ORDER BY day
-            """
-            heatmap_rows = db.execute_query(heatmap_query, (user_id,))
-            if heatmap_rows:
-                chart_stats['heatmap'] = {
-                    str(row['day']): round(row['total_seconds'] / 60)
-                    for row in heatmap_rows
-                }
-            else:
-                chart_stats['heatmap'] = {}
-        except Exception as e:
-            print(f"Error fetching heatmap in profile-init: {e}")
-            chart_stats['heatmap'] = {}
+        empty_charts = {"heatmap": {}, "heatmapDays": [], "heatmapStart": None, "weekly": []}
+        sections = [
+            Section("history", lambda db: fetch_listen_history(db, user_id)[0] or [], default=[], readonly=True),
+            Section("stats", lambda db: _user_stats_section(db, user_id),
+                    default={"total_listening_time_seconds": 0, "books_completed": 0}, readonly=True),
+            Section("badges", lambda db: BadgeService(db.connection).get_all_badges_with_progress(user_id), default=[]),
+            Section("subscription", lambda db: _subscription_section(db, user_id),
+                    default={"user_id": user_id, "status": "none", "is_active": False}),
+            # Chart stats (heatmap, genres, weekly, mastery) — merged from /user/stats
+            Section("charts", lambda db: build_listening_charts(db, user_id), default=empty_charts, readonly=True),
+            Section("genres", lambda db: _genres_section(db, user_id), default=[], readonly=True),
+            Section("mastery", lambda db: _mastery_section(db, user_id),
+                    default={"books_read": 0, "books_total": 0, "quizzes_passed": 0}, readonly=True),
+        ]
+        if token_user_id:
+            sections.insert(0, Section("user", lambda db: _profile_section(db, token_user_id)))
 
-        # 6b. Genre Distribution
-        try:
-            genre_query = """
-                SELECT c.slug, c.name, COUNT(DISTINCT ub.book_id) as count
-                FROM user_books ub
-                JOIN book_categories bc ON ub.book_id = bc.book_id
-                JOIN categories c ON bc.category_id = c.id
-                WHERE ub.user_id = %s
-                GROUP BY c.slug, c.name
-                ORDER BY count DESC
-                LIMIT 8
-            """
-            genre_rows = db.execute_query(genre_query, (user_id,))
-            if genre_rows:
-                chart_stats['genres'] = [
-                    {"slug": row['slug'], "name": row['name'], "count": row['count']}
-                    for row in genre_rows
-                ]
-            else:
-                chart_stats['genres'] = []
-        except Exception as e:
-            print(f"Error fetching genres in profile-init: {e}")
-            chart_stats['genres'] = []
+        results, failed, timings = run_sections(sections)
+        if failed:
+            print(f"[PROFILE-INIT] Partial response for user {user_id}: {failed} ({timings})")
 
-        # 6c. Weekly Activity (Last 7 days)
-        try:
-            weekly_query = """
-                SELECT DATE(start_time) as day, SUM(played_seconds) as total_seconds, EXTRACT(DOW FROM start_time) as dow
-                FROM playback_history
-                WHERE user_id = %s
-                  AND start_time > NOW() - INTERVAL '7 days'
-                GROUP BY day, dow
-                ORDER BY day
-            """
-            weekly_rows = db.execute_query(weekly_query, (user_id,))
-            if weekly_rows:
-                chart_stats['weekly'] = [
-                    {
-                        "date": str(row['day']),
-                        "minutes": round(row['total_seconds'] / 60),
-                        "dow": int(row['dow'])
-                    }
-                    for row in weekly_rows
-                ]
-            else:
-                chart_stats['weekly'] = []
-        except Exception as e:
-            print(f"Error fetching weekly stats in profile-init: {e}")
-            chart_stats['weekly'] = []
+        chart_stats = dict(results["charts"])
+        chart_stats['genres'] = results["genres"]
+        chart_stats['mastery'] = results["mastery"]
 
-        # 6d. Mastery
-        try:
-            books_read_query = "SELECT COUNT(*) as count FROM user_books WHERE user_id = %s AND is_read = 1"
-            books_read_res = db.execute_query(books_read_query, (user_id,))
-            books_read = books_read_res[0]['count'] if books_read_res else 0
-
-            quizzes_passed_query = "SELECT COUNT(DISTINCT quiz_id) as count FROM user_quiz_results WHERE user_id = %s AND is_passed = 1"
-            quizzes_passed_res = db.execute_query(quizzes_passed_query, (user_id,))
-            quizzes_passed = quizzes_passed_res[0]['count'] if quizzes_passed_res else 0
-
-            total_books_query = "SELECT COUNT(*) as count FROM books"
-            total_books_res = db.execute_query(total_books_query)
-            total_books = total_books_res[0]['count'] if total_books_res else 0
-
-            chart_stats['mastery'] = {
-                "books_read": books_read,
-                "books_total": total_books,
-                "quizzes_passed": quizzes_passed
-            }
-        except Exception as e:
-            print(f"Error fetching mastery in profile-init: {e}")
-            chart_stats['mastery'] = {"books_read": 0, "books_total": 0, "quizzes_passed": 0}
-
-        return jsonify({
-            "user": user_data, "listenHistory": history, "stats": stats,
-            "badges": badges, "subscription": sub_data,
+        response = {
+            "user": results.get("user"), "listenHistory": results["history"], "stats": results["stats"],
+            "badges": results["badges"], "subscription": results["subscription"],
             "chartStats": chart_stats,
-        }), 200
+        }
+        if failed:
+            response["partialSections"] = failed
+        return jsonify(response), 200
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
-    finally:
-        db.disconnect()
 
 
 # ===================== COMBINED APP-INIT ENDPOINT =====================
 @app.route('/app-init', methods=['GET'])
+@conditional(category_versions)
 def app_init():
     """
     Combined endpoint for app startup. Returns categories + background music in ONE call.
     No auth required. Replaces 2 separate API calls.
     """
     # Check cache
-    cached_data = cache.get("app_init")
+    cache_key = f"app_init:{g.etag}"
+    cached_data = cache.get(cache_key)
     if cached_data:
-        response = jsonify(cached_data)
+        response = encoded_response(cached_data)
         response.headers['Cache-Control'] = 'public, max-age=300'  # 5 min CDN cache
         return response, 200
 
@@ -4839,8 +5000,9 @@ def app_init():
                 music_list.append({"id": row['id'], "title": row['title'], "url": url, "isDefault": bool(row['is_default'])})
 
         response_data = {"categories": categories, "backgroundMusic": music_list}
-        cache.set("app_init", response_data, 300)
-        response = jsonify(response_data)
+        encoded = encode_json(response_data)
+        cache.set(cache_key, encoded, 300)
+        response = encoded_response(encoded)
         response.headers['Cache-Control'] = 'public, max-age=300'  # 5 min CDN cache
         return response, 200
     except Exception as e:
@@ -4931,6 +5093,7 @@ def upload_bg_music():
         
         if result is None:
              return jsonify({"error": "Database insert failed (check server logs)"}), 500
+        bump_catalog_version()
 
         return jsonify({"message": "Background music uploaded successfully"}), 200
     except Exception as e:
@@ -5138,107 +5301,29 @@ def user_stats():
     if not user_id:
         return jsonify({"error": "Missing user_id"}), 400
 
-    db = Database()
+    db = Database(replica=True, user_id=user_id)
     if not db.connect():
         return jsonify({"error": "Database connection failed"}), 500
 
     try:
         stats = {}
-        
-        # 1. Listening Heatmap (Last 365 days)
-        try:
-            heatmap_query = """
-                SELECT DATE(start_time) as day, SUM(played_seconds) as total_seconds
-                FROM playback_history
-                WHERE user_id = %s 
-                  AND start_time > NOW() - INTERVAL '365 days'
-                GROUP BY day
-                ORDER BY day
-            """
-            heatmap_rows = db.execute_query(heatmap_query, (user_id,))
-            if heatmap_rows:
-                stats['heatmap'] = {
-                    str(row['day']): round(row['total_seconds'] / 60) 
-                    for row in heatmap_rows
-                }
-            else:
-                 stats['heatmap'] = {}
-        except Exception as e:
-            print(f"Error fetching heatmap: {e}")
-            stats['heatmap'] = {}
 
-        # 2. Genre Distribution
-        try:
-            genre_query = """
-                SELECT c.slug, c.name, COUNT(DISTINCT ub.book_id) as count
-                FROM user_books ub
-                JOIN book_categories bc ON ub.book_id = bc.book_id
-                JOIN categories c ON bc.category_id = c.id
-                WHERE ub.user_id = %s
-                GROUP BY c.slug, c.name
-                ORDER BY count DESC
-                LIMIT 8
-            """
-            genre_rows = db.execute_query(genre_query, (user_id,))
-            if genre_rows:
-                stats['genres'] = [
-                    {"slug": row['slug'], "name": row['name'], "count": row['count']}
-                    for row in genre_rows
-                ]
-            else:
-                stats['genres'] = []
-        except Exception as e:
-            print(f"Error fetching genres: {e}")
-            stats['genres'] = []
-
-        # 3. Weekly Activity (Last 7 days)
-        try:
-            weekly_query = """
-                SELECT DATE(start_time) as day, SUM(played_seconds) as total_seconds, EXTRACT(DOW FROM start_time) as dow
-                FROM playback_history
-                WHERE user_id = %s
-                  AND start_time > NOW() - INTERVAL '7 days'
-                GROUP BY day, dow
-                ORDER BY day
-            """
-            weekly_rows = db.execute_query(weekly_query, (user_id,))
-            if weekly_rows:
-                stats['weekly'] = [
-                    {
-                        "date": str(row['day']), 
-                        "minutes": round(row['total_seconds'] / 60),
-                        "dow": int(row['dow']) 
-                    }
-                    for row in weekly_rows
-                ]
-            else:
-                stats['weekly'] = []
-        except Exception as e:
-            print(f"Error fetching weekly stats: {e}")
-            stats['weekly'] = []
-
-        # 4. Mastery
-        try:
-            books_read_query = "SELECT COUNT(*) as count FROM user_books WHERE user_id = %s AND is_read = 1"
-            books_read_res = db.execute_query(books_read_query, (user_id,))
-            books_read = books_read_res[0]['count'] if books_read_res else 0
-            
-            quizzes_passed_query = "SELECT COUNT(DISTINCT quiz_id) as count FROM user_quiz_results WHERE user_id = %s AND is_passed = 1"
-            quizzes_passed_res = db.execute_query(quizzes_passed_query, (user_id,))
-            quizzes_passed = quizzes_passed_res[0]['count'] if quizzes_passed_res else 0
-            
-            total_books_query = "SELECT COUNT(*) as count FROM books"
-            total_books_res = db.execute_query(total_books_query)
-            total_books = total_books_res[0]['count'] if total_books_res else 0
-
-            stats['mastery'] = {
-                "books_read": books_read,
-                "books_total": total_books,
-                "quizzes_passed": quizzes_passed
-            }
-        except Exception as e:
-            print(f"Error fetching mastery stats: {e}")
-            stats['mastery'] = {"books_read": 0, "books_total": 0, "quizzes_passed": 0}
+        # All reads in one read-only transaction: a single BEGIN/COMMIT, one cursor
+        with db.transaction(readonly=True):
+            # 1. Listening Heatmap + 3. Weekly Activity (one read of the daily rollup)
+            charts = build_listening_charts(db, user_id)
+            # compact=1: only the 365-element array (clients that don't need the date map)
+            if request.args.get('compact') != '1':
+                stats['heatmap'] = charts['heatmap']
+            stats['heatmapDays'] = charts['heatmapDays']
+            stats['heatmapStart'] = charts['heatmapStart']
+            stats['weekly'] = charts['weekly']
+
+            # 2. Genre Distribution
+            stats['genres'] = _genres_section(db, user_id)
+
+            # 4. Mastery
+            stats['mastery'] = _mastery_section(db, user_id)
 
         return jsonify(stats)
 
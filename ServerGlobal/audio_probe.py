@@ -0,0 +1,191 @@
+"""
+Header-only audio probing for remote (R2 / HTTP) files.
+
+mutagen only touches a few regions of a file to work out its duration: the ID3
+header and first MPEG frame (Xing/VBRI), the moov atom for MP4/M4A, STREAMINFO
+for FLAC, the last Ogg page, etc. RangedFile exposes a remote object as a
+seekable file that fetches just the blocks mutagen actually reads, so probing a
+multi-hundred-MB audiobook typically costs a few ranged GETs and <1 MB.
+"""
+
+import io
+import os
+import threading
+import urllib.request
+
+try:
+    import mutagen
+    MUTAGEN_AVAILABLE = True
+except ImportError:
+    MUTAGEN_AVAILABLE = False
+    print("Warning: mutagen not installed. Audio probing will not work.")
+
+from r2_storage import is_r2_ref, get_r2_key, get_r2_client, R2_BUCKET_NAME, is_r2_enabled
+
+PROBE_BLOCK_SIZE = 64 * 1024       # Bytes fetched per ranged GET (rounded to block boundaries)
+PROBE_MAX_BYTES = 8 * 1024 * 1024  # Safety cap per object; mutagen should never need this much
+
+_thread_local = threading.local()
+
+
+def _r2_client():
+    """One boto3 client per worker thread."""
+    client = getattr(_thread_local, 'r2_client', None)
+    if client is None:
+        client = get_r2_client()
+        _thread_local.r2_client = client
+    return client
+
+
+class RangedFile(io.RawIOBase):
+    """
+    Read-only, seekable file over a remote object, backed by ranged GETs.
+
+    Args:
+        fetch_range (callable): fetch_range(start, end_inclusive) -> bytes
+        size (int): Total object size in bytes
+        name (str): Name/key of the object (mutagen uses the extension for format scoring)
+    """
+
+    def __init__(self, fetch_range, size, name):
+        super().__init__()
+        self._fetch_range = fetch_range
+        self.size = size
+        self._pos = 0
+        self._blocks = {}
+        self.name = name
+        self.bytes_fetched = 0
+        self.requests = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        if self._pos < 0:
+            raise OSError("negative seek position")
+        return self._pos
+
+    def _ensure_blocks(self, first, last):
+        """Fetch missing blocks in [first, last], one GET per contiguous run."""
+        run_start = None
+        for index in range(first, last + 2):
+            missing = index <= last and index not in self._blocks
+            if missing and run_start is None:
+                run_start = index
+            elif not missing and run_start is not None:
+                start = run_start * PROBE_BLOCK_SIZE
+                end = min(index * PROBE_BLOCK_SIZE, self.size) - 1
+                if self.bytes_fetched + (end - start + 1) > PROBE_MAX_BYTES:
+                    raise OSError(f"probe exceeded {PROBE_MAX_BYTES} bytes for {self.name}")
+                data = self._fetch_range(start, end)
+                self.requests += 1
+                self.bytes_fetched += len(data)
+                for i in range(run_start, index):
+                    offset = (i - run_start) * PROBE_BLOCK_SIZE
+                    self._blocks[i] = data[offset:offset + PROBE_BLOCK_SIZE]
+                run_start = None
+
+    def readinto(self, buffer):
+        if self._pos >= self.size:
+            return 0
+        n = min(len(buffer), self.size - self._pos)
+        first = self._pos // PROBE_BLOCK_SIZE
+        last = (self._pos + n - 1) // PROBE_BLOCK_SIZE
+        self._ensure_blocks(first, last)
+
+        written = 0
+        while written < n:
+            index, offset = divmod(self._pos, PROBE_BLOCK_SIZE)
+            chunk = self._blocks[index][offset:offset + (n - written)]
+            if not chunk:
+                break
+            buffer[written:written + len(chunk)] = chunk
+            written += len(chunk)
+            self._pos += len(chunk)
+        return written
+
+
+def open_ranged(stored_path):
+    """
+    Open a stored audio path (r2:// ref or http URL) as a RangedFile.
+
+    Returns:
+        RangedFile, or None if the path is not remote
+    """
+    if is_r2_ref(stored_path):
+        if not is_r2_enabled():
+            raise RuntimeError("R2 is not configured")
+        key = get_r2_key(stored_path)
+        client = _r2_client()
+        size = client.head_object(Bucket=R2_BUCKET_NAME, Key=key)['ContentLength']
+
+        def fetch(start, end):
+            resp = client.get_object(Bucket=R2_BUCKET_NAME, Key=key, Range=f"bytes={start}-{end}")
+            return resp['Body'].read()
+
+        return RangedFile(fetch, size, key)
+
+    if stored_path and stored_path.startswith('http'):
+        head = urllib.request.Request(stored_path, method='HEAD')
+        with urllib.request.urlopen(head, timeout=15) as resp:
+            size = int(resp.headers.get('Content-Length') or 0)
+
+        def fetch(start, end):
+            req = urllib.request.Request(stored_path, headers={'Range': f"bytes={start}-{end}"})
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                data = resp.read()
+                if resp.status == 200 and len(data) > end - start + 1:
+                    # Server ignored Range; keep just the slice we asked for
+                    data = data[start:end + 1]
+                return data
+
+        return RangedFile(fetch, size, os.path.basename(stored_path.split('?')[0]))
+
+    return None
+
+
+def probe_remote_audio(stored_path):
+    """
+    Read duration and basic stream info from a remote audio file without downloading it.
+
+    Args:
+        stored_path (str): r2:// reference or http(s) URL
+
+    Returns:
+        dict: {'duration_seconds', 'bitrate', 'sample_rate', 'size', 'bytes_fetched', 'requests'},
+              or None if the file could not be probed
+    """
+    if not MUTAGEN_AVAILABLE:
+        return None
+
+    try:
+        ranged = open_ranged(stored_path)
+        if ranged is None or ranged.size == 0:
+            return None
+        audio = mutagen.File(ranged)
+        if audio is None or not hasattr(audio.info, 'length'):
+            print(f"Warning: Could not determine audio format for {stored_path}")
+            return None
+        return {
+            'duration_seconds': int(audio.info.length),
+            'bitrate': getattr(audio.info, 'bitrate', None),
+            'sample_rate': getattr(audio.info, 'sample_rate', None),
+            'size': ranged.size,
+            'bytes_fetched': ranged.bytes_fetched,
+            'requests': ranged.requests,
+        }
+    except Exception as e:
+        print(f"Error probing {stored_path}: {e}")
+        return None
@@ -2,6 +2,13 @@
 Audio utility functions for extracting duration and metadata.
 """
 
+import base64
+import math
+import os
+import shutil
+import subprocess
+import wave
+
 try:
     from mutagen.wave import WAVE
     from mutagen.mp3 import MP3
@@ -16,6 +23,25 @@ except ImportError:
     MUTAGEN_AVAILABLE = False
     print("Warning: mutagen not installed. Audio duration extraction will not work.")
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    print("Warning: numpy not installed. Waveform/loudness analysis will not work.")
+
+try:
+    from scipy.signal import lfilter
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# Waveform / loudness analysis settings
+WAVEFORM_BUCKETS = 1000          # Number of peak buckets stored per track (int8 each)
+ANALYSIS_SAMPLE_RATE = 22050     # PCM is decoded to mono at this rate for analysis
+ANALYSIS_BLOCK_SECONDS = 0.1     # Sub-block size (BS.1770 gating blocks are 4 sub-blocks)
+ANALYSIS_CHUNK_BLOCKS = 50       # Sub-blocks decoded per read (5s of audio)
+
 def get_audio_duration_seconds(file_path):
     """
     Extract audio duration in seconds from a file.
@@ -62,3 +88,197 @@ def get_total_playlist_duration(playlist_durations):
         int: Total duration in seconds
     """
     return sum(d for d in playlist_durations if d > 0)
+
+
+def _k_weighting_coefficients(rate):
+    """
+    Biquad coefficients for the ITU-R BS.1770 K-weighting filter at an arbitrary rate.
+
+    Returns:
+        list: [(b, a), (b, a)] for the high-shelf pre-filter and the RLB high-pass
+    """
+    # Stage 1: high shelf (+4 dB above ~1.5 kHz)
+    gain_db, q, fc = 4.0, 1 / math.sqrt(2), 1500.0
+    A = 10 ** (gain_db / 40.0)
+    w0 = 2.0 * math.pi * fc / rate
+    alpha = math.sin(w0) / (2.0 * q)
+    cos_w0 = math.cos(w0)
+    shelf_b = [
+        A * ((A + 1) + (A - 1) * cos_w0 + 2 * math.sqrt(A) * alpha),
+        -2 * A * ((A - 1) + (A + 1) * cos_w0),
+        A * ((A + 1) + (A - 1) * cos_w0 - 2 * math.sqrt(A) * alpha),
+    ]
+    shelf_a = [
+        (A + 1) - (A - 1) * cos_w0 + 2 * math.sqrt(A) * alpha,
+        2 * ((A - 1) - (A + 1) * cos_w0),
+        (A + 1) - (A - 1) * cos_w0 - 2 * math.sqrt(A) * alpha,
+    ]
+
+    # Stage 2: high pass (~38 Hz)
+    q, fc = 0.5, 38.0
+    w0 = 2.0 * math.pi * fc / rate
+    alpha = math.sin(w0) / (2.0 * q)
+    cos_w0 = math.cos(w0)
+    hp_b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+    hp_a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+
+    return [
+        (np.array(shelf_b) / shelf_a[0], np.array(shelf_a) / shelf_a[0]),
+        (np.array(hp_b) / hp_a[0], np.array(hp_a) / hp_a[0]),
+    ]
+
+
+def _iter_pcm_chunks(file_path, rate=ANALYSIS_SAMPLE_RATE):
+    """
+    Yield mono float32 PCM chunks in [-1, 1] decoded from an audio file.
+
+    Uses ffmpeg when it is on PATH (any format), otherwise falls back to the
+    stdlib wave module, which only handles PCM WAV files.
+    """
+    chunk_samples = int(rate * ANALYSIS_BLOCK_SECONDS) * ANALYSIS_CHUNK_BLOCKS
+
+    if shutil.which('ffmpeg'):
+        proc = subprocess.Popen(
+            ['ffmpeg', '-v', 'error', '-nostdin', '-i', file_path,
+             '-f', 's16le', '-ac', '1', '-ar', str(rate), '-'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            while True:
+                raw = proc.stdout.read(chunk_samples * 2)
+                if not raw:
+                    break
+                if len(raw) % 2:
+                    raw = raw[:-1]
+                yield np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+        finally:
+            proc.stdout.close()
+            proc.wait()
+        return
+
+    if not file_path.lower().endswith('.wav'):
+        raise ValueError("ffmpeg not available and file is not a WAV")
+
+    with wave.open(file_path, 'rb') as f:
+        channels = f.getnchannels()
+        width = f.getsampwidth()
+        if width not in (1, 2, 4):
+            raise ValueError(f"Unsupported WAV sample width: {width}")
+        src_rate = f.getframerate()
+        frames_per_read = int(src_rate * ANALYSIS_BLOCK_SECONDS) * ANALYSIS_CHUNK_BLOCKS
+        while True:
+            raw = f.readframes(frames_per_read)
+            if not raw:
+                break
+            if width == 1:
+                samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+            elif width == 2:
+                samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+            else:
+                samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648.0
+            if channels > 1:
+                samples = samples[:len(samples) - len(samples) % channels]
+                samples = samples.reshape(-1, channels).mean(axis=1)
+            if src_rate != rate:
+                # Linear resample; plenty for peak display and loudness gating
+                n_out = int(len(samples) * rate / src_rate)
+                if n_out == 0:
+                    continue
+                samples = np.interp(
+                    np.linspace(0, len(samples) - 1, n_out),
+                    np.arange(len(samples)),
+                    samples,
+                ).astype(np.float32)
+            yield samples
+
+
+def analyze_audio(file_path, buckets=WAVEFORM_BUCKETS, rate=ANALYSIS_SAMPLE_RATE):
+    """
+    Compute waveform peaks and integrated loudness for an audio file.
+
+    PCM is streamed in chunks and reduced to 100ms sub-block peaks and mean
+    squares, so memory stays flat even for multi-hour audiobooks. Loudness follows
+    BS.1770 gating (400ms blocks, 75% overlap, -70 LUFS absolute and -10 LU relative
+    gates); K-weighting is applied when scipy is installed, otherwise the
+    unweighted signal is used.
+
+    Args:
+        file_path (str): Path to the audio file
+        buckets (int): Number of waveform buckets
+        rate (int): Sample rate used for analysis
+
+    Returns:
+        dict: {'waveform_peaks': bytes (int8, 0..127), 'loudness_lufs': float or None},
+              or None if the file could not be analyzed
+    """
+    if not NUMPY_AVAILABLE:
+        print(f"Warning: numpy not available. Cannot analyze {file_path}")
+        return None
+
+    block = int(rate * ANALYSIS_BLOCK_SECONDS)
+    filters = _k_weighting_coefficients(rate) if SCIPY_AVAILABLE else []
+    filter_state = [np.zeros(2) for _ in filters]
+
+    block_peaks = []
+    block_power = []
+    carry = np.zeros(0, dtype=np.float32)
+
+    try:
+        for chunk in _iter_pcm_chunks(file_path, rate):
+            samples = np.concatenate((carry, chunk)) if len(carry) else chunk
+            usable = len(samples) - len(samples) % block
+            carry = samples[usable:]
+            if usable == 0:
+                continue
+            samples = samples[:usable]
+
+            weighted = samples
+            for i, (b, a) in enumerate(filters):
+                weighted, filter_state[i] = lfilter(b, a, weighted, zi=filter_state[i])
+
+            block_peaks.append(np.abs(samples).reshape(-1, block).max(axis=1))
+            block_power.append(np.square(weighted, dtype=np.float64).reshape(-1, block).mean(axis=1))
+    except Exception as e:
+        print(f"Error analyzing audio {file_path}: {e}")
+        return None
+
+    if not block_peaks:
+        print(f"Warning: no PCM decoded from {file_path}")
+        return None
+
+    peaks = np.concatenate(block_peaks)
+    power = np.concatenate(block_power)
+
+    # Waveform: max of sub-block peaks per bucket
+    starts = np.linspace(0, len(peaks), buckets, endpoint=False).astype(np.int64)
+    bucket_peaks = np.maximum.reduceat(peaks, starts)
+    waveform = np.clip(np.rint(bucket_peaks * 127.0), 0, 127).astype(np.int8)
+
+    # Integrated loudness: 400ms gating blocks = 4 consecutive 100ms sub-blocks
+    loudness = None
+    if len(power) >= 4:
+        gating = np.convolve(power, np.full(4, 0.25), mode='valid')
+        with np.errstate(divide='ignore'):
+            block_lufs = -0.691 + 10.0 * np.log10(gating)
+        gated = gating[block_lufs > -70.0]
+        if len(gated):
+            relative_gate = -0.691 + 10.0 * np.log10(gated.mean()) - 10.0
+            gated = gated[(-0.691 + 10.0 * np.log10(gated)) > relative_gate]
+            if len(gated):
+                loudness = round(float(-0.691 + 10.0 * np.log10(gated.mean())), 2)
+
+    print(f"Analyzed {os.path.basename(file_path)}: {len(peaks) * ANALYSIS_BLOCK_SECONDS:.0f}s, loudness={loudness} LUFS")
+    return {'waveform_peaks': waveform.tobytes(), 'loudness_lufs': loudness}
+
+
+def encode_waveform(peaks):
+    """
+    Encode stored waveform peaks (BYTEA / bytes / memoryview) as base64 for JSON responses.
+
+    Returns:
+        str: base64 string, or None if there are no peaks
+    """
+    if not peaks:
+        return None
+    return base64.b64encode(bytes(peaks)).decode('ascii')
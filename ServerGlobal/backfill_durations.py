@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Repair duration_seconds for R2/HTTP-hosted tracks without downloading them.
+
+Each file is probed through ranged GETs (see audio_probe.py), many at a time,
+and results are written back in batches. Book totals for playlist books are
+recomputed in a single statement at the end.
+
+Usage:
+    python backfill_durations.py               # only rows with duration_seconds = 0 / NULL
+    python backfill_durations.py --all         # re-probe every track
+    python backfill_durations.py --workers 32 --batch-size 500
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from psycopg2.extras import execute_values
+
+from database import Database
+from audio_probe import probe_remote_audio
+from audio_utils import get_audio_duration_seconds
+
+DEFAULT_WORKERS = 16
+DEFAULT_BATCH_SIZE = 200
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def probe(row):
+    """Probe one row; local paths fall back to the regular mutagen path."""
+    path = row['path']
+    if path and (path.startswith('r2://') or path.startswith('http')):
+        info = probe_remote_audio(path)
+        if info:
+            return row, info['duration_seconds'], info['bytes_fetched']
+        return row, 0, 0
+    if not path:
+        return row, 0, 0
+    # Legacy local storage: paths are relative to (or contain) static/
+    relative = path.split('static/', 1)[1] if 'static/' in path else f"AudioBooks/{path.lstrip('/')}"
+    return row, get_audio_duration_seconds(os.path.join(SERVER_DIR, 'static', relative)), 0
+
+
+def flush(db, table, batch):
+    """Write a batch of (id, duration) pairs in one statement."""
+    if not batch:
+        return
+    cursor = db.connection.cursor()
+    try:
+        execute_values(
+            cursor,
+            f"""
+                UPDATE {table} AS t SET duration_seconds = v.duration
+                FROM (VALUES %s) AS v(id, duration)
+                WHERE t.id = v.id
+            """,
+            batch,
+            page_size=len(batch),
+        )
+        db.connection.commit()
+    except Exception as e:
+        db.connection.rollback()
+        print(f"  Batch write to {table} failed: {e}")
+    finally:
+        cursor.close()
+    batch.clear()
+
+
+def backfill(reprobe_all=False, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE):
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database")
+        return False
+
+    try:
+        missing = "" if reprobe_all else "AND COALESCE(duration_seconds, 0) = 0"
+        tracks = db.execute_query(
+            f"SELECT id, file_path AS path FROM playlist_items WHERE TRUE {missing} ORDER BY id"
+        ) or []
+        books = db.execute_query(f"""
+            SELECT b.id, b.audio_path AS path FROM books b
+            WHERE NOT EXISTS (SELECT 1 FROM playlist_items pi WHERE pi.book_id = b.id)
+              {missing.replace('duration_seconds', 'b.duration_seconds')}
+            ORDER BY b.id
+        """) or []
+
+        print(f"Probing {len(tracks)} tracks and {len(books)} single-file books with {workers} workers...")
+        started = time.time()
+        total_bytes = 0
+        failed = 0
+
+        for table, rows in (("playlist_items", tracks), ("books", books)):
+            batch = []
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(probe, row) for row in rows]
+                for done, future in enumerate(as_completed(futures), 1):
+                    row, duration, fetched = future.result()
+                    total_bytes += fetched
+                    if duration > 0:
+                        batch.append((row['id'], duration))
+                    else:
+                        failed += 1
+                    if len(batch) >= batch_size:
+                        flush(db, table, batch)
+                    if done % 100 == 0:
+                        print(f"  {table}: {done}/{len(rows)} probed")
+            flush(db, table, batch)
+
+        # Playlist books: total = sum of their tracks
+        updated = db.execute_query("""
+            UPDATE books b SET duration_seconds = t.total
+            FROM (
+                SELECT book_id, SUM(duration_seconds)::int AS total
+                FROM playlist_items
+                WHERE duration_seconds > 0
+                GROUP BY book_id
+            ) t
+            WHERE b.id = t.book_id AND b.duration_seconds IS DISTINCT FROM t.total
+        """)
+
+        elapsed = time.time() - started
+        print(f"\nDone in {elapsed:.1f}s. Fetched {total_bytes / (1024 * 1024):.1f} MB total, "
+              f"{failed} file(s) could not be probed, {updated or 0} book total(s) updated.")
+        return True
+
+    except Exception as e:
+        print(f"Error during backfill: {e}")
+        return False
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill audio durations via ranged GETs")
+    parser.add_argument("--all", action="store_true", help="Re-probe every track, not just missing durations")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    backfill(reprobe_all=args.all, workers=args.workers, batch_size=args.batch_size)
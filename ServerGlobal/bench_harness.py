@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Local benchmark harness (replaces load_test.py and benchmark_endpoints.py).
+
+Starts the API under gunicorn + gevent against a LOCAL seeded Postgres, with R2
+switched off so uploads go to local storage instead of the real bucket. It then
+drives a weighted mix of authenticated scenarios from concurrent greenlets:
+discover, library, playlist, progress heartbeats and profile-picture uploads.
+
+Per endpoint it reports requests, error rate, p50/p95/p99 latency and the
+average number of SQL statements (read from the X-SQL-Profile header, so the
+server runs with SQL_PROFILER_ENABLED). Results can be saved and compared
+against a stored baseline. Regressions beyond the thresholds make the process
+exit with status 1, so it can gate CI.
+
+Database settings come from BENCH_DB_HOST/PORT/NAME/USER/PASSWORD (default
+localhost:5432/echo_bench). Seed the database first (see the dataset generator).
+The harness refuses to run against a non-local host unless --allow-remote-db
+is given.
+
+Usage:
+    python bench_harness.py --duration 60 --concurrency 32 --out run.json
+    python bench_harness.py --duration 60 --baseline bench_baseline.json
+    python bench_harness.py --url http://127.0.0.1:5000 --no-server ...
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import struct
+import subprocess
+import sys
+import time
+import urllib.parse
+import uuid
+import zlib
+
+import gevent
+from gevent.pool import Pool
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1", "")
+
+# Same shared secret the app sends (api.APP_SOURCE_VALUE); importing api here
+# would start the whole application in the harness process.
+APP_SOURCE_HEADER = "X-App-Source"
+APP_SOURCE_VALUE = "Echo_Secured_9xQ2zP5mL8kR4wN1vJ7"
+
+
+def _tiny_png():
+    """1x1 transparent PNG for the upload scenario."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 6, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(b"\x00\x00\x00\x00\x00")) + chunk(b"IEND", b""))
+
+
+TINY_PNG = _tiny_png()
+
+# Scenario weights; roughly the production request mix
+SCENARIOS = {
+    "discover": 25,
+    "library": 20,
+    "playlist": 20,
+    "progress": 30,
+    "upload": 5,
+}
+
+DEFAULT_P95_REGRESSION = 0.15   # +15% p95 latency
+DEFAULT_P99_REGRESSION = 0.25   # +25% p99 latency
+DEFAULT_ERROR_REGRESSION = 0.01  # +1 percentage point error rate
+
+
+def bench_db_env():
+    return {
+        "DB_HOST": os.getenv("BENCH_DB_HOST", "localhost"),
+        "DB_PORT": os.getenv("BENCH_DB_PORT", "5432"),
+        "DB_NAME": os.getenv("BENCH_DB_NAME", "echo_bench"),
+        "DB_USER": os.getenv("BENCH_DB_USER", "postgres"),
+        "DB_PASSWORD": os.getenv("BENCH_DB_PASSWORD", "postgres"),
+    }
+
+
+# ---------------------------------------------------------------- server
+
+def start_server(port, workers):
+    env = dict(os.environ)
+    env.update(bench_db_env())
+    env.update({
+        # Fake object store: with no R2 credentials uploads use local storage
+        "R2_ACCESS_KEY_ID": "", "R2_SECRET_ACCESS_KEY": "", "R2_ENDPOINT_URL": "",
+        "RATELIMIT_ENABLED": "false",
+        "SQL_PROFILER_ENABLED": "true",
+        "LOG_SAMPLE_RATES": "default=0",
+    })
+    cmd = [sys.executable, "-m", "gunicorn", "-k", "gevent", "-w", str(workers),
+           "-b", f"127.0.0.1:{port}", "--log-level", "warning", "api:app"]
+    print(f"[BENCH] Starting server: {' '.join(cmd)}")
+    return subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+
+
+def wait_until_ready(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, _, _ = request(base_url, "GET", "/", {})
+            if status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+# ---------------------------------------------------------------- fixtures
+
+def load_fixtures(user_count):
+    """Pick users and books from the seeded DB and give each user a live session."""
+    os.environ.update(bench_db_env())
+    from database import Database
+    from jwt_config import generate_access_token, generate_refresh_token
+    from session_manager import SessionManager
+
+    db = Database()
+    if not db.connect():
+        raise SystemExit("Failed to connect to the benchmark database")
+    try:
+        users = [r['id'] for r in db.execute_query(
+            "SELECT id FROM users ORDER BY id LIMIT %s", (user_count,)) or []]
+        books = db.execute_query("""
+            SELECT b.id, COALESCE(b.duration_seconds, 0) AS duration,
+                   (SELECT MIN(pi.id) FROM playlist_items pi WHERE pi.book_id = b.id) AS first_track
+            FROM books b ORDER BY b.id
+        """) or []
+    finally:
+        db.disconnect()
+    if not users or not books:
+        raise SystemExit("Benchmark database has no users or books; seed it first")
+
+    tokens = {}
+    sessions = SessionManager()
+    for user_id in users:
+        session_id = f"bench-{uuid.uuid4()}"
+        sessions.store_session(user_id, session_id, generate_refresh_token(user_id, session_id), "bench_harness")
+        tokens[user_id] = generate_access_token(user_id, session_id)
+    return tokens, books
+
+
+# ---------------------------------------------------------------- client
+
+_connections = {}
+
+
+def _connection(base_url):
+    # One keep-alive connection per greenlet, like a real client
+    key = (gevent.getcurrent(), base_url)
+    conn = _connections.get(key)
+    if conn is None:
+        parsed = urllib.parse.urlparse(base_url)
+        conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+        _connections[key] = conn
+    return conn
+
+
+def request(base_url, method, path, headers, body=None):
+    """Returns (status, seconds, response headers)."""
+    headers = dict(headers, **{APP_SOURCE_HEADER: APP_SOURCE_VALUE, "X-Debug-SQL": "1"})
+    conn = _connection(base_url)
+    started = time.perf_counter()
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+    except (OSError, http.client.HTTPException):
+        conn.close()
+        _connections.pop((gevent.getcurrent(), base_url), None)
+        raise
+    return response.status, time.perf_counter() - started, dict(response.getheaders())
+
+
+def _multipart(fields, file_field, filename, content, content_type):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append((f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                  f'Content-Type: {content_type}\r\n\r\n').encode() + content + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def run_scenario(name, base_url, rng, tokens, books):
+    """Returns (endpoint label, status, seconds, sql statement count or None)."""
+    user_id = rng.choice(list(tokens))
+    auth = {"Authorization": f"Bearer {tokens[user_id]}"}
+    book = rng.choice(books)
+
+    if name == "discover":
+        label, method, path, headers, body = "GET /discover", "GET", f"/discover?user_id={user_id}&page=1&limit=10", auth, None
+    elif name == "library":
+        label, method, path, headers, body = "GET /library", "GET", f"/library?user_id={user_id}", auth, None
+    elif name == "playlist":
+        label, method, path, headers, body = "GET /playlist", "GET", f"/playlist/{book['id']}?user_id={user_id}", auth, None
+    elif name == "progress":
+        payload = {"user_id": user_id, "book_id": book['id'],
+                   "position_seconds": rng.randint(0, max(1, book['duration'])),
+                   "duration": book['duration']}
+        if book['first_track']:
+            payload["playlist_item_id"] = book['first_track']
+        label, method, path, body = "POST /update-progress", "POST", "/update-progress", json.dumps(payload)
+        headers = dict(auth, **{"Content-Type": "application/json"})
+    elif name == "upload":
+        body, content_type = _multipart({"user_id": user_id}, "file", "bench.png", TINY_PNG, "image/png")
+        label, method, path = "POST /upload-profile-picture", "POST", "/upload-profile-picture"
+        headers = dict(auth, **{"Content-Type": content_type})
+    else:
+        raise ValueError(f"unknown scenario {name}")
+
+    try:
+        status, seconds, response_headers = request(base_url, method, path, headers, body)
+    except (OSError, http.client.HTTPException):
+        return label, 0, 0.0, None
+    return label, status, seconds, _sql_count(response_headers)
+
+
+def _sql_count(headers):
+    profile = headers.get("X-SQL-Profile") or ""
+    for part in profile.split(";"):
+        if part.startswith("queries="):
+            return int(part.split("=", 1)[1])
+    return None
+
+
+# ---------------------------------------------------------------- load
+
+def drive(base_url, tokens, books, duration, concurrency, seed, warmup):
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[n] for n in names]
+    samples = []
+    record_from = time.time() + warmup
+    stop_at = record_from + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        while time.time() < stop_at:
+            name = rng.choices(names, weights)[0]
+            sample = run_scenario(name, base_url, rng, tokens, books)
+            if time.time() >= record_from:
+                samples.append(sample)
+
+    pool = Pool(concurrency)
+    for i in range(concurrency):
+        pool.spawn(worker, i)
+    pool.join()
+    return samples
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, duration):
+    by_endpoint = {}
+    for label, status, seconds, queries in samples:
+        by_endpoint.setdefault(label, []).append((status, seconds, queries))
+
+    summary = {}
+    for label, rows in sorted(by_endpoint.items()):
+        latencies = sorted(s * 1000 for status, s, _ in rows if status)
+        errors = sum(1 for status, _, _ in rows if status == 0 or status >= 500)
+        query_counts = [q for _, _, q in rows if q is not None]
+        summary[label] = {
+            "requests": len(rows),
+            "rps": round(len(rows) / duration, 2),
+            "error_rate": round(errors / len(rows), 4),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "avg_queries": round(sum(query_counts) / len(query_counts), 2) if query_counts else None,
+        }
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'ENDPOINT':<32} {'REQS':>7} {'RPS':>8} {'ERR%':>6} {'P50':>9} {'P95':>9} {'P99':>9} {'SQL':>6}")
+    print("-" * 92)
+    for label, s in summary.items():
+        queries = "-" if s['avg_queries'] is None else f"{s['avg_queries']:.1f}"
+        print(f"{label:<32} {s['requests']:>7} {s['rps']:>8.1f} {s['error_rate'] * 100:>5.1f}% "
+              f"{s['p50_ms']:>8.1f}ms {s['p95_ms']:>7.1f}ms {s['p99_ms']:>7.1f}ms {queries:>6}")
+
+
+def compare(summary, baseline, p95_limit, p99_limit, error_limit):
+    """Returns a list of regression messages (empty when the run is within limits)."""
+    regressions = []
+    for label, base in baseline.get("endpoints", {}).items():
+        current = summary.get(label)
+        if current is None:
+            regressions.append(f"{label}: missing from this run")
+            continue
+        for key, limit in (("p95_ms", p95_limit), ("p99_ms", p99_limit)):
+            if base[key] and current[key] > base[key] * (1 + limit):
+                regressions.append(f"{label}: {key} {base[key]:.1f} -> {current[key]:.1f} (+{(current[key] / base[key] - 1) * 100:.0f}%)")
+        if current["error_rate"] > base["error_rate"] + error_limit:
+            regressions.append(f"{label}: error rate {base['error_rate']:.2%} -> {current['error_rate']:.2%}")
+        if base.get("avg_queries") is not None and current.get("avg_queries") is not None \
+                and current["avg_queries"] > base["avg_queries"] + 0.5:
+            regressions.append(f"{label}: SQL statements {base['avg_queries']:.1f} -> {current['avg_queries']:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API against a local seeded database")
+    parser.add_argument("--duration", type=float, default=60, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=10, help="Unrecorded seconds before measuring")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent simulated clients")
+    parser.add_argument("--users", type=int, default=50, help="Distinct users to authenticate as")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the scenario mix")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--url", help="Target an already running local server instead of starting one")
+    parser.add_argument("--no-server", action="store_true", help="Don't start gunicorn (use with --url)")
+    parser.add_argument("--allow-remote-db", action="store_true")
+    parser.add_argument("--out", help="Write results JSON here")
+    parser.add_argument("--baseline", help="Compare against this results JSON")
+    parser.add_argument("--save-baseline", help="Write this run as the new baseline")
+    parser.add_argument("--max-p95-regression", type=float, default=DEFAULT_P95_REGRESSION)
+    parser.add_argument("--max-p99-regression", type=float, default=DEFAULT_P99_REGRESSION)
+    parser.add_argument("--max-error-regression", type=float, default=DEFAULT_ERROR_REGRESSION)
+    args = parser.parse_args()
+
+    if bench_db_env()["DB_HOST"] not in LOCAL_HOSTS and not args.allow_remote_db:
+        raise SystemExit("BENCH_DB_HOST is not local; pass --allow-remote-db if you really mean it")
+
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+    tokens, books = load_fixtures(args.users)
+
+    server = None if args.no_server else start_server(args.port, args.workers)
+    try:
+        if not wait_until_ready(base_url):
+            raise SystemExit(f"Server at {base_url} did not become ready")
+        print(f"[BENCH] {len(tokens)} users, {len(books)} books, concurrency {args.concurrency}, "
+              f"{args.warmup:.0f}s warmup + {args.duration:.0f}s")
+        samples = drive(base_url, tokens, books, args.duration, args.concurrency, args.seed, args.warmup)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    summary = summarize(samples, args.duration)
+    print_summary(summary)
+
+    result = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: getattr(args, k) for k in ("duration", "concurrency", "users", "seed", "workers")},
+        "endpoints": summary,
+    }
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(result, f, indent=2)
+            print(f"[BENCH] Wrote {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(summary, baseline, args.max_p95_regression,
+                              args.max_p99_regression, args.max_error_regression)
+        if regressions:
+            print("\n[BENCH] REGRESSIONS vs baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("\n[BENCH] Within baseline limits")
+
+
+if __name__ == "__main__":
+    main()
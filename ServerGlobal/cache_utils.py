@@ -7,6 +7,19 @@ import threading
 from functools import wraps
 import hashlib
 import json
+import mmap
+import os
+import struct
+import tempfile
+
+try:
+    import fcntl
+    SHARED_VERSIONS_AVAILABLE = True
+except ImportError:
+    # Windows dev machines: counters stay per process (fine with one worker)
+    SHARED_VERSIONS_AVAILABLE = False
+
+import metrics
 
 class SimpleCache:
     """Thread-safe in-memory cache with TTL."""
@@ -17,6 +30,12 @@ class SimpleCache:
     
     def get(self, key):
         """Get value from cache. Returns None if expired or not found."""
+        value = self._get(key)
+        # Label by key prefix ("library", "discover", ...) to keep cardinality low
+        metrics.record_cache(key.split(":", 1)[0], value is not None)
+        return value
+
+    def _get(self, key):
         with self._lock:
             if key in self._cache:
                 value, expire_time = self._cache[key]
@@ -112,12 +131,167 @@ def cache_key_for_user(prefix, user_id, *args):
 
 
 def invalidate_user_cache(user_id):
-    """Invalidate all cache entries for a specific user."""
+    """Invalidate all cache entries for a specific user. Call after the write has committed."""
     # Invalidate all user-specific cache keys
     cache.delete_pattern(f"discover:{user_id}")
     cache.delete_pattern(f"library:{user_id}")
-    cache.delete_pattern(f"sub:{user_id}")
     cache.delete_pattern(f"playlist:{user_id}")
+    cache.delete_pattern(f"reels_bg:{user_id}")
+    # Other workers' caches and clients' copies: their ETags/keys carry this version
+    bump_user_version(user_id)
+
+
+def invalidate_subscription_cache(user_id):
+    """invalidate_user_cache plus the cached is_subscriber() answer. Call after subscription changes."""
+    # Kept out of invalidate_user_cache: progress heartbeats would re-query it every time
+    cache.delete(f"sub:{user_id}")
+    invalidate_user_cache(user_id)
+
+
+# ===================== VERSION COUNTERS (ETags) =====================
+# Responses are tagged with the versions of the data they were built from
+# (api.conditional). User versions live in a small mmap'd file shared by every
+# worker on the host, so a bump in one worker is seen by all of them without a
+# DB query. Users hash into VERSION_SLOTS slots; a collision only costs an
+# extra 200, never a stale 304. The file starts with a random epoch, so
+# counters that restart from zero (reboot, new file) can't match old tags.
+#
+# The catalog version comes from catalog_versions, bumped by triggers (see
+# reels_feed.setup), polled at most every CATALOG_VERSION_CHECK_SECONDS, plus
+# slot 0, bumped by API writes so those are visible immediately.
+
+def shared_file_path(name):
+    """Path for a file shared by the workers on this host (tmpfs when available)."""
+    return os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), name)
+
+
+VERSION_FILE = os.getenv('VERSION_COUNTERS_FILE') or shared_file_path('echo_version_counters')
+VERSION_SLOTS = 1 << 16
+CATALOG_VERSION_CHECK_SECONDS = float(os.getenv('CATALOG_VERSION_CHECK_SECONDS', '5'))
+CATALOG_FALLBACK_SECONDS = 300  # bound on staleness if catalog_versions is missing
+
+_VERSION_HEADER = 16  # 8 byte epoch + reserved
+_COUNTER = struct.Struct("<Q")
+
+
+class SharedCounters:
+    """Fixed array of u64 counters in a file mapped by every worker process."""
+
+    def __init__(self, path, slots):
+        self._path = path
+        self._slots = slots
+        self._lock = threading.Lock()
+        self._fd = None
+        self._map = None
+        self._pid = None
+        self._local = {}  # fallback when the file can't be shared
+        self.epoch = os.urandom(8).hex()
+
+    def _mapping(self):
+        if not SHARED_VERSIONS_AVAILABLE:
+            return None
+        if self._map is not None and self._pid == os.getpid():
+            return self._map
+        with self._lock:
+            # Reopen after a fork: flock is per open file, so a descriptor
+            # inherited from the parent would not exclude the other workers
+            if self._map is None or self._pid != os.getpid():
+                size = _VERSION_HEADER + self._slots * _COUNTER.size
+                try:
+                    fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    try:
+                        if os.fstat(fd).st_size < size:
+                            os.ftruncate(fd, size)
+                            os.pwrite(fd, os.urandom(8), 0)
+                        mapping = mmap.mmap(fd, size)
+                    finally:
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+                    self.epoch = mapping[:8].hex()
+                    self._fd, self._map, self._pid = fd, mapping, os.getpid()
+                except OSError as e:
+                    print(f"[CACHE] Shared version counters unavailable ({e}), using per-process counters")
+                    return None
+        return self._map
+
+    def get(self, slot):
+        mapping = self._mapping()
+        if mapping is None:
+            return self._local.get(slot, 0)
+        return _COUNTER.unpack_from(mapping, _VERSION_HEADER + slot * _COUNTER.size)[0]
+
+    def bump(self, slot):
+        mapping = self._mapping()
+        if mapping is None:
+            with self._lock:
+                self._local[slot] = self._local.get(slot, 0) + 1
+            return
+        offset = _VERSION_HEADER + slot * _COUNTER.size
+        # Read-modify-write under an exclusive lock so concurrent bumps can't collapse into one
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            _COUNTER.pack_into(mapping, offset, _COUNTER.unpack_from(mapping, offset)[0] + 1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def store(self, slot, value):
+        """Set a slot to value (e.g. a timestamp)."""
+        mapping = self._mapping()
+        if mapping is None:
+            with self._lock:
+                self._local[slot] = value
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            _COUNTER.pack_into(mapping, _VERSION_HEADER + slot * _COUNTER.size, value)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+versions = SharedCounters(VERSION_FILE, VERSION_SLOTS)
+_catalog_versions = {"checked_at": 0.0, "rows": {}}
+
+
+def _user_slot(user_id):
+    return 1 + int(user_id) % (VERSION_SLOTS - 1)
+
+
+def user_version(user_id):
+    return versions.get(_user_slot(user_id))
+
+
+def bump_user_version(user_id):
+    versions.bump(_user_slot(user_id))
+
+
+def bump_catalog_version():
+    """Mark catalog data changed by this API (immediately, for every worker)."""
+    versions.bump(0)
+
+
+def catalog_version(name="catalog"):
+    """(db version, local version) for a catalog_versions entry; DB read at most every few seconds."""
+    now = time.time()
+    if now - _catalog_versions["checked_at"] >= CATALOG_VERSION_CHECK_SECONDS:
+        _catalog_versions["checked_at"] = now
+        from database import Database  # lazy: database imports cache_utils, a top-level import would be circular
+        db = Database(replica=True)
+        if db.connect():
+            try:
+                rows = db.execute_query("SELECT name, version FROM catalog_versions")
+                _catalog_versions["rows"] = {row['name']: row['version'] for row in rows or []}
+            finally:
+                db.disconnect()
+    db_version = _catalog_versions["rows"].get(name)
+    if db_version is None:
+        db_version = f"t{int(now // CATALOG_FALLBACK_SECONDS)}"
+    return db_version, versions.get(0)
+
+
+def etag(*parts):
+    """Weak-comparable tag for a response built from the given versions and parameters."""
+    raw = repr((versions.epoch,) + parts).encode()
+    return hashlib.blake2b(raw, digest_size=10).hexdigest()
 
 
 # Cache TTL constants (in seconds)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Category hierarchy index: ancestor/descendant closure in SQL and in memory.
+
+category_closure holds one row per (ancestor, descendant) pair, including each
+category with itself at depth 0. A statement-level trigger on categories rebuilds
+it whenever the hierarchy changes (categories are small, and change only through
+admin scripts), so SQL filters like "books anywhere under X" become one indexed
+join:
+
+    JOIN category_closure cc ON cc.descendant_id = bc.category_id
+    WHERE cc.ancestor_id = <X>
+
+CategoryIndex is the in-memory counterpart (slug lookups, children lists,
+descendants, the /categories tree). It is built in O(n) from one query and
+cached for CACHE_TTL seconds.
+
+Run once to create the table, trigger and indexes (idempotent):
+
+    python category_closure.py
+"""
+
+from cache_utils import cache, bump_catalog_version
+from database import Database
+
+CACHE_KEY = "category_index"
+CACHE_TTL = 300
+MAX_DEPTH = 64  # guards the recursive CTE against accidental cycles
+
+
+class CategoryIndex:
+    """Parent/child lookups over all categories rows (id, name, slug, parent_id)."""
+
+    def __init__(self, rows):
+        self.by_id = {row['id']: row for row in rows}
+        self.by_slug = {row['slug']: row['id'] for row in rows if row.get('slug')}
+        self.children = {}  # parent_id (None for roots) -> rows, in query order
+        for row in rows:
+            self.children.setdefault(row.get('parent_id'), []).append(row)
+
+    def id_for_slug(self, slug):
+        return self.by_slug.get(slug)
+
+    def descendants(self, category_id, include_self=True):
+        """Ids of every category under category_id (iterative, so deep trees are fine)."""
+        found = [category_id] if include_self else []
+        stack = [category_id]
+        seen = {category_id}
+        while stack:
+            for child in self.children.get(stack.pop(), ()):
+                if child['id'] not in seen:
+                    seen.add(child['id'])
+                    found.append(child['id'])
+                    stack.append(child['id'])
+        return found
+
+    def tree(self, parent_id=None):
+        """Nested {'id': slug, 'title': name, 'children': [...]} as served by /categories."""
+        return [
+            {'id': row['slug'], 'title': row['name'], 'children': self.tree(row['id'])}
+            for row in self.children.get(parent_id, ())
+        ]
+
+
+def build_tree(categories, parent_id=None):
+    """O(n) replacement for the old recursive scan; same output and ordering."""
+    return CategoryIndex(categories).tree(parent_id)
+
+
+def get_index(db):
+    """Cached CategoryIndex, loaded with one query on a miss."""
+    index = cache.get(CACHE_KEY)
+    if index is None:
+        rows = db.execute_query("SELECT id, name, slug, parent_id FROM categories ORDER BY id ASC")
+        if rows is None:
+            return None
+        index = CategoryIndex(rows)
+        cache.set(CACHE_KEY, index, CACHE_TTL)
+    return index
+
+
+def invalidate():
+    cache.delete(CACHE_KEY)
+    cache.delete_pattern("categories:")
+    cache.delete_pattern("app_init:")
+    bump_catalog_version()
+
+
+CLOSURE_SQL = f"""
+    WITH RECURSIVE tree AS (
+        SELECT id AS ancestor_id, id AS descendant_id, 0 AS depth FROM categories
+        UNION ALL
+        SELECT t.ancestor_id, c.id, t.depth + 1
+        FROM tree t
+        JOIN categories c ON c.parent_id = t.descendant_id
+        WHERE t.depth < {MAX_DEPTH}
+    )
+    INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+    SELECT ancestor_id, descendant_id, MIN(depth) FROM tree GROUP BY ancestor_id, descendant_id
+"""
+
+
+def setup(db):
+    """Create the closure table, its trigger and the lookup indexes. Returns True on success."""
+    try:
+        with db.transaction():
+            db.execute_query("""
+                CREATE TABLE IF NOT EXISTS category_closure (
+                    ancestor_id INT NOT NULL,
+                    descendant_id INT NOT NULL,
+                    depth INT NOT NULL,
+                    PRIMARY KEY (ancestor_id, descendant_id)
+                )
+            """)
+            db.execute_query("""
+                CREATE INDEX IF NOT EXISTS idx_category_closure_descendant
+                ON category_closure (descendant_id, ancestor_id)
+            """)
+            # Category -> books direction for the closure join
+            db.execute_query("""
+                CREATE INDEX IF NOT EXISTS idx_book_categories_category_book
+                ON book_categories (category_id, book_id)
+            """)
+            db.execute_query("""
+                CREATE INDEX IF NOT EXISTS idx_books_primary_category
+                ON books (primary_category_id)
+            """)
+            db.execute_query(f"""
+                CREATE OR REPLACE FUNCTION rebuild_category_closure() RETURNS trigger AS $$
+                BEGIN
+                    DELETE FROM category_closure;
+                    {CLOSURE_SQL};
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            db.execute_query("DROP TRIGGER IF EXISTS trg_category_closure ON categories")
+            db.execute_query("""
+                CREATE TRIGGER trg_category_closure
+                AFTER INSERT OR DELETE OR UPDATE OF parent_id ON categories
+                FOR EACH STATEMENT EXECUTE FUNCTION rebuild_category_closure()
+            """)
+        return True
+    except Exception as e:
+        print(f"[CATEGORIES] Closure setup failed: {e}")
+        return False
+
+
+def rebuild_closure(db):
+    """Recompute category_closure from categories. Returns the row count, or None on failure."""
+    try:
+        with db.transaction():
+            db.execute_query("DELETE FROM category_closure")
+            db.execute_query(CLOSURE_SQL)
+            count = db.execute_query("SELECT COUNT(*) AS n FROM category_closure")[0]['n']
+        invalidate()
+        return count
+    except Exception as e:
+        print(f"[CATEGORIES] Closure rebuild failed: {e}")
+        return None
+
+
+def main():
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database")
+        return
+
+    try:
+        if not setup(db):
+            return
+        count = rebuild_closure(db)
+        if count is not None:
+            print(f"[CATEGORIES] category_closure rebuilt: {count} rows")
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Reconcile the daily listening rollup against playback_history.
+
+Incremental updates in record_playback keep user_daily_listening current; this
+job rebuilds a trailing window from the source rows to correct any drift
+(failed writes, manual history edits, resets). Meant to run nightly from cron:
+
+    15 3 * * * cd /var/www/server_global && ./venv/bin/python compact_listening_rollup.py >> /var/log/echo_cron.log 2>&1
+
+Usage:
+    python compact_listening_rollup.py             # last 3 days
+    python compact_listening_rollup.py --days 30
+    python compact_listening_rollup.py --full      # rebuild everything
+    python compact_listening_rollup.py --user 45
+"""
+
+import argparse
+import time
+
+from database import Database
+from listening_rollup import reconcile_rollups
+from playback_partitions import retained_since
+
+DEFAULT_WINDOW_DAYS = 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile user_daily_listening from playback_history")
+    parser.add_argument("--days", type=int, default=DEFAULT_WINDOW_DAYS, help="Trailing window to rebuild")
+    parser.add_argument("--full", action="store_true", help="Rebuild all days")
+    parser.add_argument("--user", type=int, default=None, help="Only rebuild one user")
+    args = parser.parse_args()
+
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database")
+        return
+
+    try:
+        started = time.time()
+        since = None if args.full else args.days
+        # Months pruned by retention only live on in the rollup; never rebuild them
+        written = reconcile_rollups(db, since_days=since, user_id=args.user, floor_day=retained_since(db))
+        scope = "all days" if since is None else f"last {since} day(s)"
+        if written is None:
+            print(f"[ROLLUP] Reconcile of {scope} failed")
+        else:
+            print(f"[ROLLUP] Rebuilt {written} row(s) for {scope} in {time.time() - started:.1f}s")
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
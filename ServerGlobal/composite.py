@@ -0,0 +1,112 @@
+"""
+Concurrent sections for combined endpoints (/profile-init, /library).
+
+A combined endpoint is a handful of independent reads. Instead of running them
+one after another on a single connection, each Section runs in its own
+greenlet on its own pooled connection, so the endpoint takes roughly as long as
+its slowest section rather than the sum of all of them.
+
+A section that fails or exceeds its timeout contributes its default value, and
+its name is reported in `failed` so the endpoint can flag a partial response
+(and skip caching it).
+
+Sections run outside the Flask request context: read request args/headers
+before calling run_sections and pass them in through closures.
+"""
+
+import os
+import time
+
+import gevent
+from gevent.pool import Pool
+
+import metrics
+from database import Database
+
+SECTION_TIMEOUT = float(os.getenv('COMPOSITE_SECTION_TIMEOUT', '2.5'))
+# Connections one composite request may hold at once (pool maxconn is 40)
+MAX_CONCURRENT_SECTIONS = int(os.getenv('COMPOSITE_MAX_CONCURRENCY', '4'))
+
+
+class Section:
+    """
+    One independent piece of a combined response.
+
+    Args:
+        name (str): Key used in the results dict
+        fn (callable): fn(db) -> value, or fn() when needs_db is False
+        default: Value used if the section fails or times out
+        timeout (float): Seconds before the section is abandoned
+        needs_db (bool): Whether to give the section its own pooled connection
+        readonly (bool): Run fn inside db.transaction(readonly=True), i.e. one
+            BEGIN READ ONLY/COMMIT instead of a commit per statement
+    """
+
+    def __init__(self, name, fn, default=None, timeout=SECTION_TIMEOUT, needs_db=True, readonly=False):
+        self.name = name
+        self.fn = fn
+        self.default = default
+        self.timeout = timeout
+        self.needs_db = needs_db
+        self.readonly = readonly
+
+
+def _call_section(section):
+    """Returns (ok, value)."""
+    db = None
+    try:
+        with gevent.Timeout(section.timeout):
+            if not section.needs_db:
+                return True, section.fn()
+            db = Database()
+            if not db.connect():
+                print(f"[COMPOSITE] {section.name}: no database connection")
+                return False, section.default
+            if section.readonly:
+                with db.transaction(readonly=True):
+                    return True, section.fn(db)
+            return True, section.fn(db)
+    except gevent.Timeout:
+        print(f"[COMPOSITE] {section.name}: timed out after {section.timeout}s")
+        return False, section.default
+    except Exception as e:
+        print(f"[COMPOSITE] {section.name}: {e}")
+        return False, section.default
+    finally:
+        if db is not None:
+            db.disconnect()
+
+
+def _run_section(section, ctx):
+    # Pool metrics from this greenlet count towards the parent request
+    metrics.attach_context(ctx)
+    started = time.time()
+    ok, value = _call_section(section)
+    return ok, value, round((time.time() - started) * 1000)
+
+
+def run_sections(sections, max_concurrency=MAX_CONCURRENT_SECTIONS):
+    """
+    Run sections concurrently and collect their results.
+
+    Args:
+        sections (list): Section objects (names must be unique)
+        max_concurrency (int): Upper bound on simultaneously running sections
+
+    Returns:
+        tuple: (results dict name -> value, list of failed section names,
+                dict name -> elapsed ms)
+    """
+    pool = Pool(max(1, max_concurrency))
+    ctx = metrics.current_context()
+    greenlets = [(section, pool.spawn(_run_section, section, ctx)) for section in sections]
+    pool.join()
+
+    results, failed, timings = {}, [], {}
+    for section, greenlet in greenlets:
+        ok, value, elapsed_ms = greenlet.value if greenlet.successful() else (False, section.default, 0)
+        results[section.name] = value
+        timings[section.name] = elapsed_ms
+        if not ok:
+            failed.append(section.name)
+    return results, failed, timings
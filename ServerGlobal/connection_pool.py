@@ -0,0 +1,327 @@
+"""
+Greenlet-friendly PostgreSQL connection pool.
+
+Replaces psycopg2's ThreadedConnectionPool, which raises PoolError the moment
+it is exhausted. Here a caller that finds no free connection joins a FIFO
+wait queue and is handed the next returned connection directly (no barging),
+up to an acquire timeout. Everything uses the threading module, so under
+gevent's monkey patching waiters are greenlets parked on the hub, not OS
+threads.
+
+Housekeeping:
+- health check on borrow: connections idle longer than health_check_after
+  run a `SELECT 1` before being handed out; broken ones are replaced
+- max lifetime: connections older than max_lifetime are closed on return
+  (or on borrow) and recreated lazily
+- a background reaper force-closes connections checked out for longer than
+  max_hold (leaked or stuck), replacing the scan that used to run on every
+  acquire
+"""
+
+import collections
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+import metrics
+
+DEFAULT_ACQUIRE_TIMEOUT = 5.0
+DEFAULT_MAX_LIFETIME = 30 * 60
+DEFAULT_HEALTH_CHECK_AFTER = 30.0
+DEFAULT_REAP_INTERVAL = 1.0
+
+
+class PoolTimeout(PoolError):
+    """No connection became available within the acquire timeout."""
+
+
+class _Waiter:
+    __slots__ = ("event", "conn", "slot")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.conn = None    # a returned connection handed over directly
+        self.slot = False   # or a freed slot, already reserved for this waiter
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool with a FIFO wait queue.
+
+    Args:
+        name (str): Label for metrics ("primary", "replica")
+        minconn (int): Connections opened up front and kept warm
+        maxconn (int): Upper bound on open connections
+        acquire_timeout (float): Default seconds getconn() waits before PoolTimeout
+        max_lifetime (float): Recycle connections older than this (seconds)
+        health_check_after (float): Ping connections idle longer than this before reuse
+        max_hold (float or None): Force-close connections checked out longer than this;
+            None disables the reaper
+        reap_interval (float): Seconds between reaper passes
+        **connect_kwargs: Passed to psycopg2.connect
+    """
+
+    def __init__(self, name, minconn, maxconn, acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT,
+                 max_lifetime=DEFAULT_MAX_LIFETIME, health_check_after=DEFAULT_HEALTH_CHECK_AFTER,
+                 max_hold=None, reap_interval=DEFAULT_REAP_INTERVAL, **connect_kwargs):
+        self.name = name
+        self._labels = {"pool": name}
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.max_hold = max_hold
+        self.reap_interval = reap_interval
+        self.connect_kwargs = connect_kwargs
+        self.closed = False
+
+        self._lock = threading.Lock()
+        self._idle = collections.deque()    # (conn, returned_at), most recently returned on the right
+        self._waiters = collections.deque()  # _Waiter, oldest first
+        self._created = {}                   # id(conn) -> created_at
+        self._used = {}                      # id(conn) -> (conn, checked_out_at)
+        self._size = 0                       # open + being-opened connections (reserved before connecting)
+
+        for _ in range(minconn):
+            self._size += 1
+            conn = self._open()
+            self._idle.append((conn, time.time()))
+
+        if max_hold:
+            reaper = threading.Thread(target=self._reap_forever, name="db-pool-reaper", daemon=True)
+            reaper.start()
+
+    # ------------------------------------------------------------------ stats
+
+    @property
+    def in_use(self):
+        return len(self._used)
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    @property
+    def size(self):
+        return self._size
+
+    # ------------------------------------------------------------- lifecycle
+
+    def _open(self):
+        """Connect in a slot the caller already counted in _size; the slot is released on failure."""
+        try:
+            conn = psycopg2.connect(**self.connect_kwargs)
+        except Exception:
+            self._release_slot()
+            metrics.inc("db_pool_connect_errors_total", self._labels)
+            raise
+        metrics.inc("db_pool_connections_opened_total", self._labels)
+        self._created[id(conn)] = time.time()
+        return conn
+
+    def _discard(self, conn):
+        """Close a connection and give its slot back. Caller must not hold the lock."""
+        self._created.pop(id(conn), None)
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+        metrics.inc("db_pool_connections_closed_total", self._labels)
+        self._release_slot()
+
+    def _release_slot(self):
+        """Give a slot back, or hand it to the oldest waiter still reserved. Caller must not hold the lock."""
+        with self._lock:
+            waiter = self._waiters.popleft() if self._waiters else None
+            if waiter is None:
+                self._size -= 1
+                return
+            # The slot stays counted in _size, so a newcomer can't take it first
+            waiter.slot = True
+        waiter.event.set()
+
+    def _expired(self, conn, now):
+        return now - self._created.get(id(conn), now) > self.max_lifetime
+
+    def _healthy(self, conn, idle_since, now):
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if self._expired(conn, now):
+            return False
+        if now - idle_since > self.health_check_after:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+                cursor.close()
+                conn.rollback()
+            except Exception:
+                metrics.inc("db_pool_health_check_failures_total", self._labels)
+                return False
+        return True
+
+    # --------------------------------------------------------------- acquire
+
+    def getconn(self, timeout=None):
+        """
+        Borrow a connection, waiting in FIFO order if the pool is exhausted.
+
+        Raises:
+            PoolTimeout: nothing became available within `timeout` seconds
+            PoolError: the pool is closed
+        """
+        if self.closed:
+            raise PoolError("connection pool is closed")
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+
+        while True:
+            conn, idle_since, waiter, may_open = None, None, None, False
+            with self._lock:
+                if self._idle and not self._waiters:
+                    conn, idle_since = self._idle.pop()
+                elif self._size < self.maxconn and not self._waiters:
+                    self._size += 1
+                    may_open = True
+                else:
+                    waiter = _Waiter()
+                    self._waiters.append(waiter)
+                    metrics.inc("db_pool_exhausted_total", self._labels)
+
+            if waiter is not None:
+                remaining = deadline - time.time()
+                if remaining > 0:
+                    waiter.event.wait(remaining)
+                with self._lock:
+                    # Checked under the lock: a hand-over can land just after the wait times out
+                    handed, slot = waiter.conn, waiter.slot
+                    if handed is None and not slot:
+                        try:
+                            self._waiters.remove(waiter)
+                        except ValueError:
+                            pass
+                if handed is not None:
+                    return self._checkout(handed)
+                if not slot:
+                    if self.closed:
+                        raise PoolError("connection pool is closed")
+                    metrics.inc("db_pool_acquire_timeouts_total", self._labels)
+                    raise PoolTimeout(f"no connection available within {timeout:.1f}s "
+                                      f"(size={self._size}, in_use={len(self._used)})")
+                # Handed a freed slot: open a fresh connection in it
+                may_open = True
+
+            if may_open:
+                return self._checkout(self._open())
+
+            now = time.time()
+            if self._healthy(conn, idle_since, now):
+                return self._checkout(conn)
+            self._discard(conn)
+
+    def _checkout(self, conn):
+        self._used[id(conn)] = (conn, time.time())
+        return conn
+
+    # ---------------------------------------------------------------- return
+
+    def putconn(self, conn, close=False):
+        """Return a borrowed connection (closing it if asked, broken, or too old)."""
+        if self._used.pop(id(conn), None) is None:
+            # Already reaped or never ours: make sure it doesn't linger
+            if not conn.closed and id(conn) not in self._created:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            return
+
+        if close or self.closed or conn.closed or self._expired(conn, time.time()):
+            self._discard(conn)
+            return
+        try:
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            waiter = self._waiters.popleft() if self._waiters else None
+            if waiter is None:
+                self._idle.append((conn, time.time()))
+                return
+            # Hand over directly so a newcomer can't jump the queue
+            waiter.conn = conn
+        waiter.event.set()
+
+    # ---------------------------------------------------------------- reaper
+
+    def reap(self):
+        """
+        Force-close connections held longer than max_hold and prune idle
+        connections past their lifetime. Returns the number force-closed.
+        """
+        if not self.max_hold:
+            return 0
+        now = time.time()
+        stale = [conn for conn, since in list(self._used.values()) if now - since > self.max_hold]
+        for conn in stale:
+            held = now - self._used.get(id(conn), (None, now))[1]
+            if self._used.pop(id(conn), None) is None:
+                continue
+            print(f"WARNING: Force-closing stale connection (held for {held:.1f}s)")
+            metrics.inc("db_pool_force_closed_total", self._labels)
+            try:
+                conn.cancel()
+            except Exception:
+                pass
+            self._discard(conn)
+
+        expired = []
+        with self._lock:
+            keep = collections.deque()
+            while self._idle:
+                conn, since = self._idle.popleft()
+                if self._expired(conn, now) and len(keep) + len(self._idle) >= self.minconn:
+                    expired.append(conn)
+                else:
+                    keep.append((conn, since))
+            self._idle = keep
+        for conn in expired:
+            self._discard(conn)
+        return len(stale)
+
+    def _reap_forever(self):
+        while not self.closed:
+            time.sleep(self.reap_interval)
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Connection reaper error: {e}")
+
+    def closeall(self):
+        self.closed = True
+        with self._lock:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            waiters = list(self._waiters)
+            self._waiters.clear()
+        for conn in idle + [conn for conn, _ in list(self._used.values())]:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        for waiter in waiters:
+            waiter.event.set()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Create the user_daily_listening rollup table and backfill it from playback_history."""
+
+from database import Database
+from listening_rollup import create_rollup_table, reconcile_rollups
+from playback_partitions import retained_since
+
+
+def migrate():
+    db = Database()
+    if db.connect():
+        print("Migrating database for daily listening rollups...")
+
+        try:
+            print("Creating user_daily_listening table...")
+            create_rollup_table(db)
+
+            # Latest single-file row per user/book (delta base for record_playback)
+            print("Creating playback_history index for single-file progress...")
+            db.execute_query("""
+                CREATE INDEX IF NOT EXISTS idx_playback_history_single_latest
+                ON playback_history (user_id, book_id, id DESC)
+                WHERE playlist_item_id IS NULL
+            """)
+
+            print("Backfilling rollups from playback_history (full rebuild)...")
+            written = reconcile_rollups(db, floor_day=retained_since(db))
+            if written is None:
+                print("Backfill failed.")
+            else:
+                print(f"Backfilled {written} user/day rows.")
+
+            print("Migration successful.")
+
+        except Exception as e:
+            print(f"Error during migration: {e}")
+        finally:
+            db.disconnect()
+    else:
+        print("Failed to connect to database.")
+
+if __name__ == "__main__":
+    migrate()
@@ -1,18 +1,73 @@
 import os
+import re
 import time
 import platform
 import threading
+import zlib
+from contextlib import contextmanager
 import psycopg2
-from psycopg2 import pool
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
 
+import metrics
+import sql_profiler
+from cache_utils import SharedCounters, shared_file_path
+from connection_pool import ConnectionPool, PoolTimeout
+
+try:
+    from gevent.monkey import is_module_patched
+    from gevent.socket import wait_read, wait_write
+    _has_gevent = True
+except ImportError:
+    _has_gevent = False
+
 # Global connection pool - created once, reused for all requests
 _connection_pool = None
 
-# Track active connections with timestamps for auto-cleanup
-_active_connections = {}  # connection_id -> (connection, acquire_time)
-_connections_lock = threading.Lock()
-MAX_CONNECTION_AGE_SECONDS = 3  # Auto-release connections older than 3 seconds
+# Seconds a request waits in the pool's FIFO queue before giving up
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5"))
+# Recycle server connections after this long (PgBouncer/PG memory, failovers)
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+# Connections held longer than this are treated as leaked and force-closed by
+# the background reaper (API server only; scripts legitimately hold one for minutes)
+MAX_CONNECTION_AGE_SECONDS = float(os.getenv("DB_POOL_MAX_HOLD_SECONDS", "30"))
+
+# Optional read replica (DB_REPLICA_HOST unset = everything goes to the primary)
+_replica_pool = None
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_LAG_CHECK_INTERVAL", "5"))
+# After a user writes, their reads stay on the primary for this long
+REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "15"))
+_replica_state = {"checked_at": 0.0, "lag": None, "usable": False}
+_replica_lock = threading.Lock()
+# user slot -> ms timestamp of the user's last write, shared by every worker on
+# the host: the follow-up read usually lands on a different worker than the
+# write. Users sharing a slot only cost a few extra primary reads.
+RECENT_WRITERS_FILE = os.getenv('RECENT_WRITERS_FILE') or shared_file_path('echo_recent_writers')
+RECENT_WRITER_SLOTS = 1 << 16
+_recent_writers = SharedCounters(RECENT_WRITERS_FILE, RECENT_WRITER_SLOTS)
+
+def _gevent_wait_callback(conn, timeout=None):
+    """Let psycopg2 yield to the gevent hub while waiting on the server."""
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+
+# psycopg2 is a C extension, so monkey.patch_all() alone doesn't stop a query
+# from blocking the whole worker. Under gevent (api.py patches before importing
+# us) queries on different connections can then run concurrently.
+_under_gevent = _has_gevent and is_module_patched('socket')
+if _under_gevent:
+    extensions.set_wait_callback(_gevent_wait_callback)
+
 
 def get_connection_pool():
     """Get or create the global connection pool."""
@@ -34,9 +89,13 @@ def get_connection_pool():
         effective_db = os.getenv("DB_NAME", "velorusb_echoHistory")
         effective_user = os.getenv("DB_USER", "velorusb_echoHistoryAdmin")
 
-        _connection_pool = pool.ThreadedConnectionPool(
+        _connection_pool = ConnectionPool(
+            "primary",
             minconn=5,      # Minimum connections to keep open
             maxconn=40,     # PgBouncer limits real PG connections to 80, app pool can be larger
+            acquire_timeout=POOL_ACQUIRE_TIMEOUT,
+            max_lifetime=POOL_MAX_LIFETIME,
+            max_hold=MAX_CONNECTION_AGE_SECONDS if _under_gevent else None,
             host=effective_host,
             database=effective_db,
             user=effective_user,
@@ -51,42 +110,157 @@ def get_connection_pool():
     return _connection_pool
 
 
-def cleanup_stale_connections():
-    """Force-return any connections that have been held for too long."""
-    global _active_connections
+def get_replica_pool():
+    """Get or create the read-replica pool. Returns None when no replica is configured."""
+    global _replica_pool
+    replica_host = os.getenv("DB_REPLICA_HOST")
+    if not replica_host:
+        return None
+    if _replica_pool is None or _replica_pool.closed:
+        primary = get_connection_pool()
+        params = primary.connect_kwargs
+        replica_port = int(os.getenv("DB_REPLICA_PORT", params.get("port", 6432)))
+        _replica_pool = ConnectionPool(
+            "replica",
+            minconn=2,
+            maxconn=int(os.getenv("DB_REPLICA_MAXCONN", "40")),
+            acquire_timeout=POOL_ACQUIRE_TIMEOUT,
+            max_lifetime=POOL_MAX_LIFETIME,
+            max_hold=MAX_CONNECTION_AGE_SECONDS if _under_gevent else None,
+            host=replica_host,
+            database=params.get("database"),
+            user=os.getenv("DB_REPLICA_USER", params.get("user")),
+            password=os.getenv("DB_REPLICA_PASSWORD", params.get("password")),
+            port=replica_port,
+            connect_timeout=3,
+            options=params.get("options", "")
+        )
+        print(f"Replica connection pool created (host={replica_host}, port={replica_port})")
+    return _replica_pool
+
+
+def _check_replica_lag(replica):
+    """Measure replay lag on a replica connection (0 when fully caught up)."""
+    cursor = replica.cursor()
+    try:
+        cursor.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+            END
+        """)
+        lag = float(cursor.fetchone()[0])
+        replica.commit()
+        return lag
+    finally:
+        cursor.close()
+
+
+def replica_is_usable(conn=None):
+    """
+    True if the replica's lag is within REPLICA_MAX_LAG_SECONDS.
+
+    The lag is measured at most every REPLICA_LAG_CHECK_INTERVAL seconds (on
+    `conn` if given); everyone else uses the cached answer.
+    """
     now = time.time()
-    stale = []
-    
-    with _connections_lock:
-        for conn_id, (conn, acquire_time) in list(_active_connections.items()):
-            age = now - acquire_time
-            if age > MAX_CONNECTION_AGE_SECONDS:
-                print(f"WARNING: Force-releasing stale connection (held for {age:.1f}s)")
-                stale.append(conn_id)
-                try:
-                    p = get_connection_pool()
-                    if not conn.closed:
-                        conn.rollback()
-                    p.putconn(conn)
-                except Exception as e:
-                    print(f"Error force-releasing connection: {e}")
-                    try:
-                        p.putconn(conn, close=True)
-                    except:
-                        pass
-        
-        for conn_id in stale:
-            del _active_connections[conn_id]
-    
-    return len(stale)
+    if now - _replica_state["checked_at"] < REPLICA_LAG_CHECK_INTERVAL or conn is None:
+        return _replica_state["usable"] or _replica_state["checked_at"] == 0.0
+    if not _replica_lock.acquire(blocking=False):
+        return _replica_state["usable"]
+    try:
+        lag = _check_replica_lag(conn)
+        usable = lag <= REPLICA_MAX_LAG_SECONDS
+        if usable != _replica_state["usable"]:
+            print(f"[REPLICA] lag={lag:.1f}s -> {'using replica' if usable else 'routing reads to primary'}")
+        _replica_state.update(checked_at=now, lag=lag, usable=usable)
+    except Exception as e:
+        print(f"[REPLICA] Lag check failed, routing reads to primary: {e}")
+        _replica_state.update(checked_at=now, lag=None, usable=False)
+    finally:
+        _replica_lock.release()
+    return _replica_state["usable"]
+
+
+def _writer_slot(user_id):
+    # crc32, not hash(): the slot must be the same in every worker process
+    return zlib.crc32(str(user_id).encode()) % RECENT_WRITER_SLOTS
+
+
+def mark_user_write(user_id):
+    """Record that `user_id` just wrote, so their reads stick to the primary for a while (all workers)."""
+    if user_id is None:
+        return
+    _recent_writers.store(_writer_slot(user_id), int(time.time() * 1000))
+
+
+def wrote_recently(user_id):
+    if user_id is None:
+        return False
+    wrote_at_ms = _recent_writers.get(_writer_slot(user_id))
+    return wrote_at_ms > 0 and time.time() * 1000 - wrote_at_ms < REPLICA_STICKY_SECONDS * 1000
+
+
+def _pool_gauges():
+    for p in (_connection_pool, _replica_pool):
+        if p is None or p.closed:
+            continue
+        labels = {"pool": p.name}
+        yield "db_pool_in_use", labels, p.in_use
+        yield "db_pool_idle", labels, p.idle
+        yield "db_pool_waiting", labels, p.waiting
+        yield "db_pool_size", labels, p.size
+        yield "db_pool_max", labels, p.maxconn
+
+
+metrics.register_gauges(_pool_gauges)
+metrics.describe("db_pool_acquire_wait_seconds", "Time spent waiting for a pooled connection")
+metrics.describe("db_pool_hold_seconds", "Time a connection stayed checked out")
+metrics.describe("db_pool_exhausted_total", "Acquires that had to queue because every connection was busy")
+metrics.describe("db_pool_acquire_timeouts_total", "Acquires that gave up after the acquire timeout")
+metrics.describe("db_pool_force_closed_total", "Connections force-closed by the reaper after exceeding the hold limit")
+
+
+def _record_acquire(pool_name, waited, ok):
+    """Feed acquire-wait into the per-route histogram and the request's debug stats."""
+    route = metrics.current_route()
+    metrics.observe("db_pool_acquire_wait_seconds", waited, {"pool": pool_name, "route": route})
+    ctx = metrics.current_context()
+    if ctx is not None:
+        ctx.add("acquires")
+        ctx.add("wait_ms", waited * 1000)
+        if not ok:
+            ctx.add("failed")
+
+
+def cleanup_stale_connections():
+    """Force-close leaked connections now (the pools' reapers also do this in the background)."""
+    cleaned = 0
+    for p in (_connection_pool, _replica_pool):
+        if p is not None and not p.closed:
+            cleaned += p.reap()
+    return cleaned
 
 
 class Database:
-    def __init__(self):
+    def __init__(self, replica=False, user_id=None):
+        """
+        Args:
+            replica (bool): Prefer the read replica (read-only work only). Falls
+                back to the primary when no replica is configured, it lags, or
+                `user_id` wrote within REPLICA_STICKY_SECONDS.
+            user_id: Requesting user, for read-your-writes stickiness
+        """
         self.connection = None
         self._from_pool = False
-        self._conn_id = None
+        self._pool = None
+        self.is_replica = False
+        self._want_replica = replica
+        self._user_id = user_id
         self._acquire_time = None
+        self._in_transaction = False
+        self._cursor = None
 
     def __enter__(self):
         """Context manager entry - connects to database."""
@@ -106,71 +280,214 @@ class Database:
             except Exception:
                 pass
 
-    def connect(self, retries=2, delay=0.1):
-        """Get a connection from the pool with retry logic."""
-        # First, try to cleanup any stale connections
-        cleanup_stale_connections()
-        
-        for attempt in range(retries):
-            try:
-                p = get_connection_pool()
-                self.connection = p.getconn()
-                # Validate the connection is still alive
-                if self.connection.closed:
-                    p.putconn(self.connection, close=True)
-                    self.connection = None
-                    continue
-                self._from_pool = True
-                self._acquire_time = time.time()
-                self._conn_id = id(self.connection)
-                
-                # Track this connection
-                with _connections_lock:
-                    _active_connections[self._conn_id] = (self.connection, self._acquire_time)
-                
-                return True
-            except pool.PoolError as e:
-                # Pool exhausted - try cleanup and retry
-                print(f"Pool exhausted (attempt {attempt+1}/{retries}): {e}")
-                cleaned = cleanup_stale_connections()
-                if cleaned > 0:
-                    print(f"Cleaned up {cleaned} stale connection(s), retrying...")
-                if attempt < retries - 1:
-                    time.sleep(delay)
-            except Exception as e:
-                print(f"Error getting connection from pool: {e}")
+    def _connect_replica(self):
+        """Try to check out a healthy replica connection. Returns True on success."""
+        if wrote_recently(self._user_id) or not replica_is_usable():
+            return False
+        try:
+            p = get_replica_pool()
+            if p is None:
                 return False
-        print("Failed to get connection after all retries")
-        return False
+            # Don't queue for the replica; the primary is the fallback
+            started = time.time()
+            conn = p.getconn(timeout=0)
+            _record_acquire(p.name, time.time() - started, True)
+            if conn.closed or not replica_is_usable(conn):
+                p.putconn(conn, close=conn.closed)
+                return False
+        except Exception as e:
+            print(f"[REPLICA] Falling back to primary: {e}")
+            return False
+        self._checkout(conn, p)
+        self.is_replica = True
+        return True
+
+    def _checkout(self, conn, p):
+        self.connection = conn
+        self._pool = p
+        self._from_pool = True
+        self._acquire_time = time.time()
+
+    def connect(self, timeout=None):
+        """
+        Get a connection from the pool.
+
+        Waits in the pool's FIFO queue for up to `timeout` seconds
+        (DB_POOL_ACQUIRE_TIMEOUT by default) when all connections are busy.
+        """
+        if self._want_replica and self._connect_replica():
+            return True
+
+        started = time.time()
+        try:
+            p = get_connection_pool()
+            conn = p.getconn(timeout=timeout)
+        except PoolTimeout as e:
+            _record_acquire("primary", time.time() - started, False)
+            print(f"Pool exhausted: {e}")
+            return False
+        except Exception as e:
+            print(f"Error getting connection from pool: {e}")
+            return False
+        _record_acquire(p.name, time.time() - started, True)
+        self._checkout(conn, p)
+        self.is_replica = False
+        return True
 
     def disconnect(self):
         """Return connection to the pool (don't actually close it)."""
         if self.connection and self._from_pool:
-            # Remove from tracking
-            if self._conn_id:
-                with _connections_lock:
-                    _active_connections.pop(self._conn_id, None)
-            
+            held = time.time() - self._acquire_time
+            metrics.observe("db_pool_hold_seconds", held,
+                            {"pool": self._pool.name, "route": metrics.current_route()})
+            ctx = metrics.current_context()
+            if ctx is not None:
+                ctx.add("hold_ms", held * 1000)
             try:
                 # Rollback any uncommitted state before returning to pool
                 # (rollback instead of reset for PgBouncer transaction pooling compatibility)
                 if not self.connection.closed:
                     self.connection.rollback()
-                p = get_connection_pool()
-                p.putconn(self.connection)
+                self._pool.putconn(self.connection)
             except Exception as e:
                 print(f"Error returning connection to pool: {e}")
                 # If we can't return it cleanly, close it so pool can create a fresh one
                 try:
-                    p = get_connection_pool()
-                    p.putconn(self.connection, close=True)
+                    self._pool.putconn(self.connection, close=True)
                 except Exception:
                     pass
             self.connection = None
-            self._conn_id = None
+            self._pool = None
+
+    @contextmanager
+    def transaction(self, readonly=False):
+        """
+        Run a block of statements as one unit of work.
+
+        Inside the block execute_query reuses a single cursor, never commits and
+        raises on errors instead of returning None. The transaction commits once
+        when the block exits, or rolls back if it raises. Nested calls join the
+        outer transaction.
+
+        Args:
+            readonly (bool): Start the transaction with BEGIN READ ONLY
+
+        Example:
+            with db.transaction(readonly=True):
+                books = db.execute_query("SELECT ...")
+                stats = db.execute_query("SELECT ...")
+        """
+        if self._in_transaction:
+            yield self
+            return
+
+        if not self.connection or self.connection.closed:
+            if not self.connect():
+                raise psycopg2.OperationalError("Database connection failed")
+        if self.connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            # Don't fold earlier autocommit-style work into this unit
+            self.connection.commit()
+
+        self.connection.readonly = bool(readonly)
+        self._cursor = self.connection.cursor(cursor_factory=RealDictCursor)
+        self._in_transaction = True
+        try:
+            yield self
+            self.connection.commit()
+        except BaseException:
+            try:
+                self.connection.rollback()
+            except Exception as e:
+                print(f"Error rolling back transaction: {e}")
+            raise
+        finally:
+            self._in_transaction = False
+            self._cursor.close()
+            self._cursor = None
+            if not self.connection.closed:
+                self.connection.readonly = None  # back to the server default
+
+    def execute_batch(self, statements):
+        """
+        Run several independent statements in a single round-trip.
+
+        psycopg2 has no pipeline mode and only returns the last result of a
+        multi-statement string, so the batch is folded into one SELECT: reads
+        become json_agg scalar subqueries and INSERT/UPDATE/DELETE become
+        data-modifying CTEs. Every statement sees the same snapshot, so none of
+        them observes another's writes; only batch statements that don't depend
+        on each other. Statements that are themselves WITH ... INSERT/UPDATE
+        can't be nested and must run on their own.
+
+        Args:
+            statements (list): [(query, params)], params None, a tuple or a dict
+
+        Returns:
+            list: One entry per statement, in order: a list of dicts for reads
+                  and for writes with RETURNING, the affected row count for
+                  other writes. Values are JSON-decoded (timestamps as ISO
+                  strings, bytea as hex text). None if the batch failed.
+        """
+        if not statements:
+            return []
+        if not self.connection or self.connection.closed:
+            if not self.connect():
+                return None
+
+        cursor = self.connection.cursor()
+        try:
+            rendered = [cursor.mogrify(query, params).decode() if params else query
+                        for query, params in statements]
+        finally:
+            cursor.close()
+
+        ctes, columns = [], []
+        for i, sql in enumerate(rendered):
+            sql = sql.strip().rstrip(';').strip()
+            verb = sql.split(None, 1)[0].upper()
+            if verb in ('SELECT', 'WITH', 'VALUES'):
+                columns.append(f"(SELECT COALESCE(json_agg(b{i}), '[]'::json) FROM ({sql}) b{i}) AS r{i}")
+            elif verb in ('INSERT', 'UPDATE', 'DELETE'):
+                if re.search(r'\bRETURNING\b', sql, re.IGNORECASE):
+                    ctes.append(f"w{i} AS ({sql})")
+                    columns.append(f"(SELECT COALESCE(json_agg(b{i}), '[]'::json) FROM w{i} b{i}) AS r{i}")
+                else:
+                    ctes.append(f"w{i} AS ({sql} RETURNING 1)")
+                    columns.append(f"(SELECT COUNT(*) FROM w{i}) AS r{i}")
+            else:
+                raise ValueError(f"execute_batch can't combine {verb} statements")
+
+        combined = (f"WITH {', '.join(ctes)} " if ctes else "") + "SELECT " + ", ".join(columns)
+        result = self.execute_query(combined)
+        if not result:
+            return None
+        row = result[0]
+        return [row[f"r{i}"] for i in range(len(rendered))]
 
     def execute_query(self, query, params=None):
         """Executes a query and returns the results for SELECT queries."""
+        started = time.perf_counter()
+        try:
+            return self._execute_query(query, params)
+        finally:
+            # Per-request DB time for Server-Timing and the per-route histogram
+            elapsed = time.perf_counter() - started
+            metrics.record_query(elapsed)
+            if sql_profiler.ENABLED:
+                sql_profiler.record(query, elapsed)
+
+    def _execute_query(self, query, params):
+        if self._in_transaction:
+            # Unit of work: shared cursor, no commit, errors abort the whole unit
+            cursor = self._cursor
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            if cursor.description is not None:
+                return [dict(row) for row in cursor.fetchall()]
+            return cursor.rowcount
+
         if not self.connection or self.connection.closed:
              if not self.connect():
                  return None
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Synthetic dataset generator for capacity and performance testing.
+
+Builds a statistically plausible catalogue and listening history and streams it
+into Postgres with COPY (no per-row INSERTs):
+
+- categories: a random recursive tree (a few roots, depth ~log n)
+- books: ~40% multi-track playlists (lognormal track counts, 2-200 tracks),
+  the rest single files; popularity follows a Zipf law over a random
+  permutation of books, so a few titles dominate like in production
+- users: lognormal activity, i.e. most users start a handful of books and a
+  long tail starts hundreds
+- progress: a quarter of started books are finished, the rest stop early
+  (Beta(0.8, 2.0) of the duration). user_books, user_completed_tracks and
+  playback_history rows agree with each other, and sessions cluster in the
+  evening
+- favorites, ratings (skewed to 4-5 stars) and active subscriptions for a share
+  of users
+
+Scale 1.0 is 1M users, 100k books, 2k categories and ~500M playback_history
+rows. The default 0.01 loads in about a minute. Output depends only on --seed,
+--scale/overrides and --as-of: every chunk of users gets its own random stream,
+so --jobs only changes speed, never the data.
+
+Targets BENCH_DB_HOST/PORT/NAME/USER/PASSWORD (default localhost:5432/echo_bench)
+with the application schema already created. Refuses to touch a non-local host
+without --allow-remote-db, or a non-empty database without --truncate.
+
+Usage:
+    python generate_dataset.py --scale 0.01 --seed 42 --truncate
+    python generate_dataset.py --scale 0.2 --jobs 8 --truncate --rollups
+"""
+
+import argparse
+import datetime
+import io
+import multiprocessing
+import os
+import time
+
+import numpy as np
+from werkzeug.security import generate_password_hash
+
+from database import Database
+
+BASE_COUNTS = {
+    "users": 1_000_000,
+    "books": 100_000,
+    "categories": 2_000,
+    "plays": 500_000_000,
+}
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1", "")
+
+USER_CHUNK = 20_000
+HISTORY_DAYS = 3 * 365
+PLAYLIST_SHARE = 0.4
+COMPLETED_SHARE = 0.25
+FAVORITE_SHARE = 0.10
+RATING_SHARE = 0.06
+SUBSCRIBER_SHARE = 0.20
+BENCH_PASSWORD = "Bench123!"
+
+# Share of sessions starting in each hour of the day (evening peak)
+HOUR_WEIGHTS = np.array([2, 1, 1, 1, 1, 1, 2, 4, 5, 4, 3, 3, 4, 4, 3, 3, 4, 5, 6, 8, 9, 9, 7, 4], dtype=float)
+HOUR_WEIGHTS /= HOUR_WEIGHTS.sum()
+
+# Truncated in this order (children first) by --truncate
+TABLES = [
+    "user_completed_tracks", "playback_history", "book_ratings", "favorites", "user_books",
+    "subscriptions", "user_sessions", "playlist_items", "book_categories", "books", "categories", "users",
+]
+
+
+def bench_db_env():
+    return {
+        "DB_HOST": os.getenv("BENCH_DB_HOST", "localhost"),
+        "DB_PORT": os.getenv("BENCH_DB_PORT", "5432"),
+        "DB_NAME": os.getenv("BENCH_DB_NAME", "echo_bench"),
+        "DB_USER": os.getenv("BENCH_DB_USER", "postgres"),
+        "DB_PASSWORD": os.getenv("BENCH_DB_PASSWORD", "postgres"),
+    }
+
+
+# ---------------------------------------------------------------- COPY plumbing
+
+class _CopyStream(io.RawIOBase):
+    """File-like view over an iterator of text chunks, for cursor.copy_expert."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = memoryview(b"")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos >= len(self._buf):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buf = memoryview(chunk.encode())
+            self._pos = 0
+        n = min(len(b), len(self._buf) - self._pos)
+        b[:n] = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+def copy_rows(db, table, columns, chunks):
+    """COPY text-format chunks (tab separated, \\N for NULL) into table."""
+    cursor = db.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", _CopyStream(chunks), size=1 << 20)
+        db.connection.commit()
+    finally:
+        cursor.close()
+
+
+def _lines(*columns):
+    rows = zip(*(c.tolist() if isinstance(c, np.ndarray) else c for c in columns))
+    return "".join("\t".join("\\N" if v is None else str(v) for v in row) + "\n" for row in rows)
+
+
+def _timestamps(epoch_seconds):
+    return np.asarray(epoch_seconds, dtype="int64").astype("datetime64[s]").astype(str)
+
+
+def _evening_times(rng, day_start, day_end):
+    """Random timestamps between two epoch-second bounds, clustered by HOUR_WEIGHTS."""
+    days = rng.integers(day_start // 86400, np.maximum(day_start // 86400 + 1, day_end // 86400 + 1))
+    hours = rng.choice(24, size=len(days), p=HOUR_WEIGHTS)
+    stamp = days * 86400 + hours * 3600 + rng.integers(0, 3600, size=len(days))
+    return np.clip(stamp, day_start, day_end)
+
+
+# ---------------------------------------------------------------- catalogue
+
+class Catalogue:
+    """Books, tracks and popularity, rebuilt identically from the seed in every worker."""
+
+    def __init__(self, seed, n_books, n_categories, zipf):
+        rng = np.random.default_rng([seed, 1])
+        self.n_books = n_books
+        self.n_categories = n_categories
+
+        # Category tree: ids 1..n, each non-root hangs under a random earlier category
+        roots = max(1, n_categories // 100)
+        ids = np.arange(1, n_categories + 1)
+        self.category_parent = np.where(ids <= roots, 0, (rng.random(n_categories) * (ids - 1)).astype(int) + 1)
+
+        self.is_playlist = rng.random(n_books) < PLAYLIST_SHARE
+        track_counts = np.clip(rng.lognormal(np.log(12), 0.8, n_books), 2, 200).astype(int)
+        self.track_count = np.where(self.is_playlist, track_counts, 0)
+        self.track_offset = np.concatenate(([0], np.cumsum(self.track_count)[:-1]))
+        self.track_duration = np.clip(rng.lognormal(np.log(1200), 0.5, int(self.track_count.sum())), 60, 7200).astype(int)
+        track_totals = np.bincount(np.repeat(np.arange(n_books), self.track_count),
+                                   weights=self.track_duration, minlength=n_books).astype(int)
+        # Cumulative track lengths (0-prefixed), to locate a position inside a playlist
+        self.track_ends = np.concatenate(([0], np.cumsum(self.track_duration)))
+        singles = np.clip(rng.lognormal(np.log(6 * 3600), 0.6, n_books), 600, 60 * 3600).astype(int)
+        self.duration = np.where(self.is_playlist, track_totals, singles)
+
+        # Zipf popularity over a random permutation, so popularity is not id order
+        ranks = rng.permutation(n_books) + 1
+        weights = 1.0 / ranks ** zipf
+        self.popularity = weights / weights.sum()
+        self.primary_category = rng.integers(1, n_categories + 1, n_books)
+
+    def book_id(self, index):
+        return index + 1
+
+    def track_id(self, book_index, track_index):
+        return self.track_offset[book_index] + track_index + 1
+
+
+def load_catalogue(db, cat, seed, as_of):
+    rng = np.random.default_rng([seed, 2])
+    n = cat.n_categories
+    ids = np.arange(1, n + 1)
+    parents = [None if p == 0 else p for p in cat.category_parent.tolist()]
+    copy_rows(db, "categories", ["id", "name", "slug", "parent_id"],
+              [_lines(ids, [f"Category {i}" for i in ids.tolist()], [f"bench-cat-{i}" for i in ids.tolist()], parents)])
+
+    step = 50_000
+    now = int(as_of.timestamp())
+
+    def book_chunks():
+        for start in range(0, cat.n_books, step):
+            idx = np.arange(start, min(start + step, cat.n_books))
+            book_ids = idx + 1
+            created = _timestamps(now - rng.integers(0, HISTORY_DAYS * 86400, len(idx)))
+            titles = [f"Bench Book {i}" for i in book_ids.tolist()]
+            authors = [f"Author {i % 5000}" for i in book_ids.tolist()]
+            audio = [f"AudioBooks/bench/{i}.mp3" for i in book_ids.tolist()]
+            covers = [f"BookCovers/bench/{i}.jpg" for i in book_ids.tolist()]
+            yield _lines(book_ids, titles, authors, cat.duration[idx], audio, covers, created,
+                         cat.primary_category[idx], ["Synthetic benchmark book"] * len(idx))
+    copy_rows(db, "books", ["id", "title", "author", "duration_seconds", "audio_path", "cover_image_path",
+                            "created_at", "primary_category_id", "description"], book_chunks())
+
+    def book_category_chunks():
+        for start in range(0, cat.n_books, step):
+            idx = np.arange(start, min(start + step, cat.n_books))
+            extra = rng.integers(0, 3, len(idx))
+            book_ids = np.concatenate((idx + 1, np.repeat(idx + 1, extra)))
+            categories = np.concatenate((cat.primary_category[idx], rng.integers(1, n + 1, int(extra.sum()))))
+            pairs = np.unique(np.stack((book_ids, categories), axis=1), axis=0)
+            yield _lines(pairs[:, 0], pairs[:, 1])
+    copy_rows(db, "book_categories", ["book_id", "category_id"], book_category_chunks())
+
+    def track_chunks():
+        playlist_books = np.flatnonzero(cat.track_count)
+        for start in range(0, len(playlist_books), step):
+            books = playlist_books[start:start + step]
+            counts = cat.track_count[books]
+            book_ids = np.repeat(books + 1, counts)
+            order = np.concatenate([np.arange(c) for c in counts.tolist()]) if len(books) else np.array([], int)
+            track_ids = cat.track_offset[np.repeat(books, counts)] + order + 1
+            paths = [f"AudioBooks/bench/{b}/{o + 1:03d}.mp3" for b, o in zip(book_ids.tolist(), order.tolist())]
+            titles = [f"Chapter {o + 1}" for o in order.tolist()]
+            yield _lines(track_ids, book_ids, paths, titles, cat.track_duration[track_ids - 1], order + 1)
+    copy_rows(db, "playlist_items", ["id", "book_id", "file_path", "title", "duration_seconds", "track_order"],
+              track_chunks())
+
+
+# ---------------------------------------------------------------- users and activity
+
+def load_user_chunk(db, cat, seed, chunk_index, first_user, last_user, plays_per_user, as_of, password_hash):
+    """Users [first_user, last_user] and everything they did. Deterministic per chunk."""
+    rng = np.random.default_rng([seed, 10, chunk_index])
+    now = int(as_of.timestamp())
+    user_ids = np.arange(first_user, last_user + 1)
+    n_users = len(user_ids)
+    joined = now - rng.integers(0, HISTORY_DAYS * 86400, n_users)
+
+    copy_rows(db, "users", ["id", "name", "email", "password_hash", "is_verified", "created_at"], [_lines(
+        user_ids, [f"Bench User {u}" for u in user_ids.tolist()],
+        [f"user{u}@bench.local" for u in user_ids.tolist()], [password_hash] * n_users,
+        ["t"] * n_users, _timestamps(joined))])
+
+    subscribed = np.flatnonzero(rng.random(n_users) < SUBSCRIBER_SHARE)
+    if len(subscribed):
+        yearly = rng.random(len(subscribed)) < 0.3
+        sub_start = joined[subscribed] + rng.integers(0, np.maximum(1, now - joined[subscribed]))
+        sub_end = np.maximum(sub_start + np.where(yearly, 365, 30) * 86400, now + 86400)
+        copy_rows(db, "subscriptions", ["user_id", "plan_type", "status", "start_date", "end_date"], [_lines(
+            user_ids[subscribed], np.where(yearly, "yearly", "monthly"), ["active"] * len(subscribed),
+            _timestamps(sub_start), _timestamps(sub_end))])
+
+    # Books started per user: lognormal activity, popular books far more likely
+    started = np.clip(rng.lognormal(np.log(6), 1.0, n_users), 0, 500).astype(int)
+    pair_users = np.repeat(np.arange(n_users), started)
+    pair_books = rng.choice(cat.n_books, size=len(pair_users), p=cat.popularity)
+    keys = np.unique(pair_users.astype(np.int64) * cat.n_books + pair_books)
+    pair_users, pair_books = keys // cat.n_books, keys % cat.n_books
+    n_pairs = len(keys)
+    if n_pairs == 0:
+        return 0
+
+    durations = cat.duration[pair_books]
+    finished = rng.random(n_pairs) < COMPLETED_SHARE
+    fraction = np.where(finished, 1.0, rng.beta(0.8, 2.0, n_pairs))
+    position = (fraction * durations).astype(int)
+
+    # Where in the playlist each user is: track index and offset within it
+    is_playlist = cat.track_count[pair_books] > 0
+    book_start = cat.track_ends[cat.track_offset[pair_books]]
+    global_track = np.searchsorted(cat.track_ends, book_start + position, side="right") - 1
+    current_track = np.where(is_playlist, np.clip(global_track - cat.track_offset[pair_books], 0,
+                                                  np.maximum(cat.track_count[pair_books] - 1, 0)), 0)
+    track_start = cat.track_ends[cat.track_offset[pair_books] + current_track]
+    current_len = np.where(is_playlist, cat.track_duration[np.minimum(cat.track_offset[pair_books] + current_track,
+                                                                      max(len(cat.track_duration) - 1, 0))]
+                           if len(cat.track_duration) else 0, 0)
+    offset = np.where(is_playlist, np.minimum(book_start + position - track_start, current_len), position)
+
+    first_seen = joined[pair_users] + rng.integers(0, np.maximum(1, now - joined[pair_users]))
+    last_seen = first_seen + (rng.random(n_pairs) * (now - first_seen)).astype(np.int64)
+    current_item = [int(cat.track_id(b, t)) if p else None
+                    for b, t, p in zip(pair_books.tolist(), current_track.tolist(), is_playlist.tolist())]
+    copy_rows(db, "user_books", ["user_id", "book_id", "last_played_position_seconds", "is_read",
+                                 "started_at", "last_accessed_at", "current_playlist_item_id"], [_lines(
+        user_ids[pair_users], pair_books + 1, offset, np.where(finished, "t", "f"),
+        _timestamps(first_seen), _timestamps(last_seen), current_item)])
+
+    fav = np.flatnonzero(rng.random(n_pairs) < FAVORITE_SHARE)
+    if len(fav):
+        copy_rows(db, "favorites", ["user_id", "book_id"], [_lines(user_ids[pair_users[fav]], pair_books[fav] + 1)])
+    rated = np.flatnonzero((rng.random(n_pairs) < RATING_SHARE) & (fraction > 0.3))
+    if len(rated):
+        stars = rng.choice([1, 2, 3, 4, 5], size=len(rated), p=[0.03, 0.05, 0.12, 0.35, 0.45])
+        copy_rows(db, "book_ratings", ["book_id", "user_id", "stars"],
+                  [_lines(pair_books[rated] + 1, user_ids[pair_users[rated]], stars)])
+
+    # Tracks before the current one are completed (all of them for finished books)
+    done_counts = np.where(is_playlist, np.where(finished, cat.track_count[pair_books], current_track), 0)
+    done_pairs = np.repeat(np.arange(n_pairs), done_counts)
+    if len(done_pairs):
+        done_index = np.concatenate([np.arange(c) for c in done_counts[done_counts > 0].tolist()])
+        done_tracks = cat.track_offset[pair_books[done_pairs]] + done_index + 1
+        copy_rows(db, "user_completed_tracks", ["user_id", "track_id", "completed_at"], [_lines(
+            user_ids[pair_users[done_pairs]], done_tracks, _timestamps(last_seen[done_pairs]))])
+
+    # Sessions: more progress means more sessions; the newest one carries the final position
+    weights = 0.2 + fraction
+    plays_per_pair = plays_per_user * n_users / n_pairs
+    sessions = np.maximum(1, rng.poisson(plays_per_pair * weights / weights.mean()))
+    session_pairs = np.repeat(np.arange(n_pairs), sessions)
+    is_last = np.zeros(len(session_pairs), dtype=bool)
+    is_last[np.cumsum(sessions) - 1] = True
+
+    starts = np.where(is_last, last_seen[session_pairs],
+                      _evening_times(rng, first_seen[session_pairs], last_seen[session_pairs]))
+    pl = is_playlist[session_pairs]
+    # Earlier sessions on playlists replay a track at or before the current one
+    session_track = np.where(is_last, current_track[session_pairs],
+                             (rng.random(len(session_pairs)) * (current_track[session_pairs] + 1)).astype(int))
+    track_ids = np.where(pl, cat.track_offset[pair_books[session_pairs]] + session_track + 1, 0)
+    track_len = np.where(pl, cat.track_duration[np.maximum(track_ids - 1, 0)] if len(cat.track_duration) else 0, 0)
+    played = np.where(
+        is_last | (pl & (session_track == current_track[session_pairs])),
+        np.where(pl, offset[session_pairs], position[session_pairs]),
+        np.where(pl, track_len, (position[session_pairs] * rng.random(len(session_pairs))).astype(int)),
+    )
+    ends = starts + np.minimum(played, 4 * 3600)
+
+    step = 250_000
+
+    def play_chunks():
+        for lo in range(0, len(session_pairs), step):
+            hi = lo + step
+            items = [t if p else None for t, p in zip(track_ids[lo:hi].tolist(), pl[lo:hi].tolist())]
+            yield _lines(user_ids[pair_users[session_pairs[lo:hi]]], pair_books[session_pairs[lo:hi]] + 1, items,
+                         _timestamps(starts[lo:hi]), _timestamps(ends[lo:hi]), played[lo:hi])
+    copy_rows(db, "playback_history", ["user_id", "book_id", "playlist_item_id", "start_time", "end_time",
+                                       "played_seconds"], play_chunks())
+    return len(session_pairs)
+
+
+# ---------------------------------------------------------------- orchestration
+
+_worker = {}
+
+
+def _init_worker(seed, n_books, n_categories, zipf):
+    os.environ.update(bench_db_env())
+    _worker["cat"] = Catalogue(seed, n_books, n_categories, zipf)
+    _worker["db"] = Database()
+    if not _worker["db"].connect():
+        raise RuntimeError("worker could not connect to the benchmark database")
+
+
+def _run_chunk(task):
+    chunk_index, first_user, last_user, seed, plays_per_user, as_of, password_hash = task
+    return load_user_chunk(_worker["db"], _worker["cat"], seed, chunk_index, first_user, last_user,
+                           plays_per_user, as_of, password_hash)
+
+
+def ensure_history_partitions(db, as_of):
+    """Create monthly playback_history partitions for the generated window, if partitioned."""
+    import playback_partitions as pp
+    if not pp.is_partitioned(db):
+        return
+    month = pp.month_start(as_of.date() - datetime.timedelta(days=HISTORY_DAYS))
+    while month <= pp.month_start(as_of.date()):
+        pp.create_partition(db, month)
+        month = pp.add_months(month, 1)
+
+
+def reset_sequences(db):
+    for table in ("categories", "books", "playlist_items", "users"):
+        db.execute_query(f"""
+            SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 1))
+        """)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset for performance tests")
+    parser.add_argument("--scale", type=float, default=0.01, help="1.0 = 1M users, 100k books, ~500M plays")
+    parser.add_argument("--users", type=int, help="Override user count")
+    parser.add_argument("--books", type=int, help="Override book count")
+    parser.add_argument("--categories", type=int, help="Override category count")
+    parser.add_argument("--plays", type=int, help="Approximate playback_history rows")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Popularity skew exponent")
+    parser.add_argument("--as-of", help="Reference date YYYY-MM-DD (default today); part of the seed")
+    parser.add_argument("--jobs", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--truncate", action="store_true", help="Empty the target tables first")
+    parser.add_argument("--rollups", action="store_true", help="Rebuild user_daily_listening afterwards")
+    parser.add_argument("--allow-remote-db", action="store_true")
+    args = parser.parse_args()
+
+    env = bench_db_env()
+    if env["DB_HOST"] not in LOCAL_HOSTS and not args.allow_remote_db:
+        raise SystemExit("BENCH_DB_HOST is not local; pass --allow-remote-db if you really mean it")
+    os.environ.update(env)
+
+    counts = {k: max(1, int(v * args.scale)) for k, v in BASE_COUNTS.items()}
+    for key in ("users", "books", "categories", "plays"):
+        if getattr(args, key):
+            counts[key] = getattr(args, key)
+    as_of = datetime.datetime.strptime(args.as_of, "%Y-%m-%d") if args.as_of else \
+        datetime.datetime.combine(datetime.date.today(), datetime.time())
+
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database")
+        return
+
+    started = time.time()
+    try:
+        existing = db.execute_query("SELECT EXISTS (SELECT 1 FROM users) AS has_rows")
+        if existing and existing[0]['has_rows'] and not args.truncate:
+            print("Target database already has users; rerun with --truncate to replace its data")
+            return
+        if args.truncate:
+            db.execute_query(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE")
+
+        ensure_history_partitions(db, as_of)
+        cat = Catalogue(args.seed, counts["books"], counts["categories"], args.zipf)
+        load_catalogue(db, cat, args.seed, as_of)
+        print(f"[DATASET] Catalogue: {counts['categories']} categories, {counts['books']} books, "
+              f"{int(cat.track_count.sum())} tracks ({time.time() - started:.0f}s)")
+
+        plays_per_user = counts["plays"] / counts["users"]
+        password_hash = generate_password_hash(BENCH_PASSWORD)
+        tasks = [(i, first, min(first + USER_CHUNK - 1, counts["users"]), args.seed, plays_per_user, as_of, password_hash)
+                 for i, first in enumerate(range(1, counts["users"] + 1, USER_CHUNK))]
+
+        plays = 0
+        with multiprocessing.get_context("spawn").Pool(
+                args.jobs, initializer=_init_worker,
+                initargs=(args.seed, counts["books"], counts["categories"], args.zipf)) as pool:
+            for done, rows in enumerate(pool.imap_unordered(_run_chunk, tasks), 1):
+                plays += rows
+                print(f"[DATASET] Users chunk {done}/{len(tasks)}: {plays} playback rows so far "
+                      f"({time.time() - started:.0f}s)")
+
+        reset_sequences(db)
+        db.execute_query("ANALYZE")
+
+        if args.rollups:
+            from listening_rollup import reconcile_rollups
+            written = reconcile_rollups(db)
+            print(f"[DATASET] Rebuilt {written} rollup rows")
+
+        print(f"[DATASET] Done: {counts['users']} users, {plays} playback rows in {time.time() - started:.0f}s "
+              f"(seed {args.seed}, as of {as_of.date()})")
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Change feed behind /library?since=<token> (library delta sync).
+
+change_log holds one row per changed entity, upserted by row triggers:
+
+- books, playlist_items, book_ratings -> (0, 'book', book id)        catalog-wide
+- user_books                          -> (user, 'user_book', book id) progress, ownership, bg music
+- favorites                           -> (user, 'favorite', book id)
+
+Each upsert stamps the writing transaction's txid. A plain sequence would not
+be a safe cursor: values are taken before commit, so a reader can see 101
+committed while 100 is still in flight and skip 100 for good. The sync token
+is the xmin of the reader's snapshot instead (the oldest transaction still
+running when it read). Every change it could not see has a txid >= xmin, so
+"xid >= token" on the next sync returns everything missed, at the cost of
+sometimes sending an entity twice. The delta carries the current state of
+each changed entity, so repeats are harmless.
+
+Rows are upserted, so the table stays at one row per entity that changed
+within RETENTION_DAYS; prune() drops older rows. Tokens older than
+TOKEN_MAX_AGE could have lost rows to pruning and get a full response.
+
+Run once to create the table and triggers (idempotent):
+
+    python library_changes.py
+
+Prune daily from cron:
+
+    30 4 * * * cd /var/www/server_global && ./venv/bin/python library_changes.py --prune >> /var/log/echo_cron.log 2>&1
+"""
+
+import argparse
+import time
+
+from database import Database
+
+RETENTION_DAYS = 30
+# One day of margin: a row's changed_at is its transaction's start time
+TOKEN_MAX_AGE = (RETENTION_DAYS - 1) * 86400
+
+CATALOG = 0
+
+# table -> (kind, user column or None for catalog-wide, book id column)
+LOGGED_TABLES = {
+    "books": ("book", None, "id"),
+    "playlist_items": ("book", None, "book_id"),
+    "book_ratings": ("book", None, "book_id"),
+    "user_books": ("user_book", "user_id", "book_id"),
+    "favorites": ("favorite", "user_id", "book_id"),
+}
+
+CHANGES_SQL = """
+    WITH snap AS (SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin)
+    SELECT snap.xmin, cl.kind, cl.entity_id
+    FROM snap
+    LEFT JOIN LATERAL (
+        SELECT kind, entity_id FROM change_log WHERE user_id = %(catalog)s AND xid >= %(since)s
+        UNION ALL
+        SELECT kind, entity_id FROM change_log WHERE user_id = %(user_id)s AND xid >= %(since)s
+    ) cl ON TRUE
+"""
+
+SNAPSHOT_SQL = "SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin"
+
+
+def make_token(xmin, subscribed):
+    """Opaque sync token: snapshot xmin, issue time and the entitlement it was built with."""
+    return f"{xmin}.{int(time.time())}.{int(bool(subscribed))}"
+
+
+def parse_token(token):
+    """(xmin, issued_at, subscribed) or None if the token is malformed."""
+    try:
+        xmin, issued_at, subscribed = token.split(".")
+        return int(xmin), int(issued_at), subscribed == "1"
+    except (AttributeError, ValueError):
+        return None
+
+
+def snapshot_xmin(db):
+    """xmin for a token issued before reading a full library. None on failure."""
+    rows = db.execute_query(SNAPSHOT_SQL)
+    return rows[0]['xmin'] if rows else None
+
+
+def changes_since(db, user_id, since):
+    """
+    Entities changed for user_id (or catalog-wide) since a token's xmin.
+
+    Returns:
+        tuple: (xmin for the next token, {kind: set(book ids)}), or (None, None)
+               if change_log couldn't be read
+    """
+    rows = db.execute_query(CHANGES_SQL, {"catalog": CATALOG, "user_id": user_id, "since": since})
+    if not rows:
+        return None, None
+    changed = {}
+    for row in rows:
+        if row['kind'] is not None:
+            changed.setdefault(row['kind'], set()).add(row['entity_id'])
+    return rows[0]['xmin'], changed
+
+
+def setup(db):
+    """Create change_log and its triggers (idempotent). Returns True on success."""
+    try:
+        with db.transaction():
+            db.execute_query("""
+                CREATE TABLE IF NOT EXISTS change_log (
+                    user_id INT NOT NULL,
+                    kind TEXT NOT NULL,
+                    entity_id INT NOT NULL,
+                    xid BIGINT NOT NULL,
+                    changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, kind, entity_id)
+                )
+            """)
+            db.execute_query("CREATE INDEX IF NOT EXISTS idx_change_log_user_xid ON change_log (user_id, xid)")
+            db.execute_query("CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log (changed_at)")
+            # TG_ARGV: kind, user column ('' for catalog-wide), book id column
+            db.execute_query("""
+                CREATE OR REPLACE FUNCTION log_library_change() RETURNS trigger AS $$
+                DECLARE
+                    rec JSONB := to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END);
+                BEGIN
+                    INSERT INTO change_log (user_id, kind, entity_id, xid, changed_at)
+                    VALUES (CASE WHEN TG_ARGV[1] = '' THEN 0 ELSE (rec ->> TG_ARGV[1])::int END,
+                            TG_ARGV[0], (rec ->> TG_ARGV[2])::int, txid_current(), CURRENT_TIMESTAMP)
+                    ON CONFLICT (user_id, kind, entity_id) DO UPDATE
+                    SET xid = EXCLUDED.xid, changed_at = EXCLUDED.changed_at;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            for table, (kind, user_column, book_column) in LOGGED_TABLES.items():
+                db.execute_query(f"DROP TRIGGER IF EXISTS trg_{table}_change_log ON {table}")
+                db.execute_query(f"""
+                    CREATE TRIGGER trg_{table}_change_log
+                    AFTER INSERT OR UPDATE OR DELETE ON {table}
+                    FOR EACH ROW EXECUTE FUNCTION log_library_change('{kind}', '{user_column or ''}', '{book_column}')
+                """)
+        return True
+    except Exception as e:
+        print(f"[CHANGES] Setup failed: {e}")
+        return False
+
+
+def prune(db, days=RETENTION_DAYS):
+    """Drop rows older than days. Returns the row count, or None on failure."""
+    return db.execute_query(
+        "DELETE FROM change_log WHERE changed_at < CURRENT_TIMESTAMP - make_interval(days => %s)", (days,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Set up or prune the library change log")
+    parser.add_argument("--prune", action="store_true", help=f"Delete rows older than {RETENTION_DAYS} days")
+    args = parser.parse_args()
+
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database")
+        return
+
+    try:
+        if args.prune:
+            count = prune(db)
+            if count is not None:
+                print(f"[CHANGES] Pruned {count} rows")
+        elif setup(db):
+            print("[CHANGES] change_log ready")
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Per-user daily listening rollup (user_daily_listening).
+
+One row per (user_id, day) holding seconds listened, seconds per primary
+category, the distinct books touched and the number of distinct tracks touched.
+It is maintained incrementally on every progress write (record_playback) and
+reconciled from playback_history by compact_listening_rollup.py, so the stats
+endpoints read at most 365 small rows instead of scanning playback_history.
+
+Attribution matches playback_history itself:
+- playlist tracks have one row per (user, book, track); its played_seconds is
+  credited to DATE(start_time), and later updates adjust that day by the delta
+- single-file books get a new row per update; each row credits the forward
+  progress since the previous row (seeking backwards never subtracts)
+- rows moved forward by the playback_history retention job (see
+  playback_partitions.py) carry `carried_seconds`, the part of played_seconds
+  already credited to an older day, so it is never counted twice
+"""
+
+import datetime
+
+HEATMAP_DAYS = 365
+
+
+def create_rollup_table(db):
+    """Create user_daily_listening and the playback_history bookkeeping column (idempotent)."""
+    db.execute_query(
+        "ALTER TABLE playback_history ADD COLUMN IF NOT EXISTS carried_seconds INT NOT NULL DEFAULT 0"
+    )
+    db.execute_query("""
+        CREATE TABLE IF NOT EXISTS user_daily_listening (
+            user_id INT NOT NULL,
+            day DATE NOT NULL,
+            seconds_listened INT NOT NULL DEFAULT 0,
+            category_seconds JSONB NOT NULL DEFAULT '{}'::jsonb,
+            book_ids INT[] NOT NULL DEFAULT '{}',
+            tracks_touched INT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, day)
+        )
+    """)
+
+
+# Shared tail of the record_playback statements: apply the delta CTE to the rollup.
+_ROLLUP_UPSERT = """
+    INSERT INTO user_daily_listening AS r
+        (user_id, day, seconds_listened, category_seconds, book_ids, tracks_touched, updated_at)
+    SELECT %(user_id)s, d.day, GREATEST(d.secs, 0),
+           CASE WHEN %(category)s::text IS NULL THEN '{}'::jsonb
+                ELSE jsonb_build_object(%(category)s::text, GREATEST(d.secs, 0)) END,
+           ARRAY[%(book_id)s]::int[], d.is_new::int, CURRENT_TIMESTAMP
+    FROM delta d
+    ON CONFLICT (user_id, day) DO UPDATE SET
+        seconds_listened = GREATEST(r.seconds_listened + (SELECT secs FROM delta), 0),
+        category_seconds = CASE WHEN %(category)s::text IS NULL THEN r.category_seconds
+            ELSE r.category_seconds || jsonb_build_object(
+                %(category)s::text,
+                GREATEST(COALESCE((r.category_seconds ->> %(category)s::text)::int, 0) + (SELECT secs FROM delta), 0)
+            ) END,
+        book_ids = CASE WHEN %(book_id)s = ANY(r.book_ids) THEN r.book_ids
+                        ELSE array_append(r.book_ids, %(book_id)s) END,
+        tracks_touched = r.tracks_touched + EXCLUDED.tracks_touched,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# Tracks keep one history row per (user, book, track). Update-then-insert rather
+# than ON CONFLICT: once playback_history is partitioned by start_time, a unique
+# constraint on (user_id, book_id, playlist_item_id) is no longer possible.
+# record_playback serializes writers with _LOCK first, so two heartbeats can't
+# both miss `prev` and insert twice.
+_RECORD_TRACK = """
+    WITH prev AS (
+        SELECT id, start_time, played_seconds FROM playback_history
+        WHERE user_id = %(user_id)s AND book_id = %(book_id)s AND playlist_item_id = %(item_id)s
+        LIMIT 1
+    ),
+    updated AS (
+        UPDATE playback_history ph SET
+            end_time = CURRENT_TIMESTAMP,
+            played_seconds = %(position)s
+        FROM prev
+        WHERE ph.id = prev.id AND ph.start_time IS NOT DISTINCT FROM prev.start_time
+        RETURNING ph.start_time, ph.played_seconds
+    ),
+    inserted AS (
+        INSERT INTO playback_history (user_id, book_id, playlist_item_id, start_time, end_time, played_seconds)
+        SELECT %(user_id)s, %(book_id)s, %(item_id)s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, %(position)s
+        WHERE NOT EXISTS (SELECT 1 FROM prev)
+        RETURNING start_time, played_seconds
+    ),
+    hist AS (
+        SELECT * FROM updated UNION ALL SELECT * FROM inserted
+    ),
+    delta AS (
+        SELECT hist.start_time::date AS day,
+               hist.played_seconds - COALESCE((SELECT played_seconds FROM prev), 0) AS secs,
+               NOT EXISTS (SELECT 1 FROM prev) AS is_new
+        FROM hist
+    )
+""" + _ROLLUP_UPSERT
+
+_RECORD_SINGLE = """
+    WITH prev AS (
+        SELECT played_seconds FROM playback_history
+        WHERE user_id = %(user_id)s AND book_id = %(book_id)s AND playlist_item_id IS NULL
+        ORDER BY id DESC
+        LIMIT 1
+    ),
+    hist AS (
+        INSERT INTO playback_history (user_id, book_id, playlist_item_id, start_time, end_time, played_seconds)
+        VALUES (%(user_id)s, %(book_id)s, NULL, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, %(position)s)
+        RETURNING start_time, played_seconds
+    ),
+    delta AS (
+        SELECT hist.start_time::date AS day,
+               GREATEST(hist.played_seconds - COALESCE((SELECT played_seconds FROM prev), 0), 0) AS secs,
+               NOT EXISTS (
+                   SELECT 1 FROM playback_history
+                   WHERE user_id = %(user_id)s AND book_id = %(book_id)s AND playlist_item_id IS NULL
+                     AND start_time >= CURRENT_DATE
+               ) AS is_new
+        FROM hist
+    )
+""" + _ROLLUP_UPSERT
+
+
+# Per (user, book, track) transaction lock; taken in its own statement, before
+# the CTE, so the CTE's snapshot sees whatever the previous holder committed
+_LOCK = "SELECT pg_advisory_xact_lock(hashtext(%s))"
+
+
+def record_playback(db, user_id, book_id, playlist_item_id, position, category_id=None):
+    """
+    Write a playback_history entry and fold its delta into the daily rollup.
+
+    Both happen in one statement, so the rollup can never miss a history
+    write. Concurrent writes for the same track (or single-file book) are
+    serialized by an advisory lock held until the caller's transaction commits.
+
+    Args:
+        db: Connected Database
+        user_id, book_id (int): Listener and book
+        playlist_item_id (int or None): Track id, None for single-file books
+        position (int): Current position in seconds
+        category_id (int or None): Book's primary category
+
+    Returns:
+        bool: True if the write succeeded
+    """
+    params = {
+        "user_id": user_id,
+        "book_id": book_id,
+        "item_id": playlist_item_id,
+        "position": position,
+        "category": str(category_id) if category_id is not None else None,
+    }
+    query = _RECORD_TRACK if playlist_item_id else _RECORD_SINGLE
+    # Joins the caller's transaction if there is one, so the lock lasts until its commit
+    with db.transaction():
+        db.execute_query(_LOCK, (f"playback:{user_id}:{book_id}:{playlist_item_id or 0}",))
+        return db.execute_query(query, params) is not None
+
+
+def get_daily_listening(db, user_id, days=HEATMAP_DAYS):
+    """
+    Rollup rows for the last `days` days (today included), oldest first.
+
+    Returns:
+        list: [{'day': date, 'seconds_listened': int, 'category_seconds': dict, ...}]
+    """
+    return db.execute_query("""
+        SELECT day, seconds_listened, category_seconds,
+               cardinality(book_ids) AS books_touched, tracks_touched
+        FROM user_daily_listening
+        WHERE user_id = %s AND day > CURRENT_DATE - %s
+        ORDER BY day
+    """, (user_id, days)) or []
+
+
+def build_listening_charts(db, user_id):
+    """
+    Heatmap and weekly activity for the profile charts from a single rollup read.
+
+    Returns:
+        dict: {
+            'heatmap': {'YYYY-MM-DD': minutes} for days with listening,
+            'heatmapDays': [minutes] * 365, oldest first, last element = today,
+            'heatmapStart': 'YYYY-MM-DD' (date of heatmapDays[0]),
+            'weekly': [{'date', 'minutes', 'dow'}] for the last 7 days with listening
+        }
+    """
+    rows = get_daily_listening(db, user_id, HEATMAP_DAYS)
+
+    today = datetime.date.today()
+    start = today - datetime.timedelta(days=HEATMAP_DAYS - 1)
+    heatmap_days = [0] * HEATMAP_DAYS
+    heatmap = {}
+    weekly = []
+
+    for row in rows:
+        day = row['day']
+        minutes = round(row['seconds_listened'] / 60)
+        index = (day - start).days
+        if 0 <= index < HEATMAP_DAYS:
+            heatmap_days[index] = minutes
+        heatmap[str(day)] = minutes
+        if (today - day).days < 7 and row['seconds_listened'] > 0:
+            # Postgres DOW: Sunday = 0
+            weekly.append({"date": str(day), "minutes": minutes, "dow": day.isoweekday() % 7})
+
+    return {
+        "heatmap": heatmap,
+        "heatmapDays": heatmap_days,
+        "heatmapStart": str(start),
+        "weekly": weekly,
+    }
+
+
+def get_total_listening_seconds(db, user_id):
+    """All-time listening seconds for a user, summed from the rollup."""
+    result = db.execute_query(
+        "SELECT COALESCE(SUM(seconds_listened), 0) AS total FROM user_daily_listening WHERE user_id = %s",
+        (user_id,)
+    )
+    return int(result[0]['total']) if result else 0
+
+
+def reconcile_rollups(db, since_days=None, user_id=None, from_day=None, to_day=None, floor_day=None):
+    """
+    Rebuild rollup rows from playback_history.
+
+    Args:
+        db: Connected Database
+        since_days (int or None): Only rebuild days newer than this many days ago
+        user_id (int or None): Restrict to one user
+        from_day, to_day (date or None): Only rebuild days in [from_day, to_day)
+        floor_day (date or None): Never touch days before this one. Pass the
+            oldest retained playback_history day so rollups for pruned
+            partitions (which no longer have source rows) are kept.
+
+    Returns:
+        int: Number of rollup rows written, or None on failure
+    """
+    filters = []
+    params = {"since_days": since_days, "user_id": user_id,
+              "from_day": from_day, "to_day": to_day, "floor_day": floor_day}
+    if since_days is not None:
+        filters.append("day > CURRENT_DATE - %(since_days)s")
+    if user_id is not None:
+        filters.append("user_id = %(user_id)s")
+    if from_day is not None:
+        filters.append("day >= %(from_day)s")
+    if to_day is not None:
+        filters.append("day < %(to_day)s")
+    if floor_day is not None:
+        filters.append("day >= %(floor_day)s")
+    where = ("WHERE " + " AND ".join(filters)) if filters else ""
+    # The LAG needs each single-book row's predecessor even if it falls before
+    # the window, so only the user filter is pushed into the scan.
+    source_filter = "WHERE ph.user_id = %(user_id)s" if user_id is not None else ""
+
+    rebuild = f"""
+        WITH src_all AS (
+            SELECT * FROM (
+                SELECT ph.user_id, ph.start_time::date AS day, ph.book_id, ph.playlist_item_id,
+                       ph.carried_seconds,
+                       CASE WHEN ph.playlist_item_id IS NULL THEN GREATEST(
+                                ph.played_seconds - COALESCE(LAG(ph.played_seconds) OVER (
+                                    PARTITION BY ph.user_id, ph.book_id, (ph.playlist_item_id IS NULL)
+                                    ORDER BY ph.id), ph.carried_seconds), 0)
+                            ELSE ph.played_seconds - ph.carried_seconds END AS secs
+                FROM playback_history ph
+                {source_filter}
+            ) s
+            {where}
+        ),
+        src AS (
+            -- Carried-forward rows with no new progress aren't activity on their new day
+            SELECT * FROM src_all WHERE NOT (carried_seconds > 0 AND secs = 0)
+        ),
+        totals AS (
+            SELECT user_id, day,
+                   SUM(secs)::int AS seconds_listened,
+                   array_agg(DISTINCT book_id) AS book_ids,
+                   COUNT(DISTINCT (book_id, COALESCE(playlist_item_id, 0)))::int AS tracks_touched
+            FROM src
+            GROUP BY user_id, day
+        ),
+        cats AS (
+            SELECT user_id, day, jsonb_object_agg(category, secs) AS category_seconds
+            FROM (
+                SELECT src.user_id, src.day, b.primary_category_id::text AS category, SUM(src.secs)::int AS secs
+                FROM src
+                JOIN books b ON b.id = src.book_id
+                WHERE b.primary_category_id IS NOT NULL
+                GROUP BY src.user_id, src.day, b.primary_category_id
+            ) c
+            GROUP BY user_id, day
+        )
+        INSERT INTO user_daily_listening
+            (user_id, day, seconds_listened, category_seconds, book_ids, tracks_touched, updated_at)
+        SELECT t.user_id, t.day, t.seconds_listened, COALESCE(c.category_seconds, '{{}}'::jsonb),
+               t.book_ids, t.tracks_touched, CURRENT_TIMESTAMP
+        FROM totals t
+        LEFT JOIN cats c ON c.user_id = t.user_id AND c.day = t.day
+    """
+
+    cursor = db.connection.cursor()
+    try:
+        cursor.execute(f"DELETE FROM user_daily_listening {where}", params)
+        cursor.execute(rebuild, params)
+        written = cursor.rowcount
+        db.connection.commit()
+        return written
+    except Exception as e:
+        print(f"Error reconciling listening rollups: {e}")
+        db.connection.rollback()
+        return None
+    finally:
+        cursor.close()
@@ -0,0 +1,229 @@
+"""
+In-process metrics with Prometheus text exposition (no client library needed).
+
+Counters, gauges and fixed-bucket histograms live in module-level registries
+and are rendered by render_prometheus() for the /metrics endpoint. Every
+gunicorn worker keeps its own numbers, so each sample carries a `pid` label.
+
+Request context: begin_request() stores the current route and a per-request
+stats dict in a thread-local (greenlet-local under gevent).
+composite.run_sections copies it into its child greenlets, so connections
+borrowed there are attributed to the parent request too.
+
+Per-request timing: Database.execute_query adds to db_queries/db_seconds,
+SimpleCache.get counts hits and misses, the JSON provider times serialization
+inside span("serialize"), and views may wrap their own phases in span().
+finish_request() turns all of that into per-route histograms and, when
+asked, a Server-Timing header value.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; tuned for pool waits (sub-ms when free) up to hold times of slow requests
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_local = threading.local()
+
+_counters = {}    # name -> {labels_tuple: value}
+_histograms = {}  # name -> {labels_tuple: [bucket_counts..., sum, count]}
+_gauge_callbacks = []  # callables returning [(name, labels_dict, value)]
+_help = {}
+
+
+def _key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+def inc(name, labels=None, value=1):
+    key = _key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def observe(name, seconds, labels=None):
+    key = _key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        state = series.get(key)
+        if state is None:
+            state = series[key] = [0] * (len(DEFAULT_BUCKETS) + 2)
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if seconds <= bound:
+                state[i] += 1
+        state[-2] += seconds
+        state[-1] += 1
+
+
+def register_gauges(callback):
+    """callback() -> iterable of (name, labels_dict, value), evaluated at scrape time."""
+    _gauge_callbacks.append(callback)
+
+
+# ---------------------------------------------------------------- request context
+
+class RequestContext:
+    __slots__ = ("route", "stats", "spans", "started", "profile")
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stats = {}
+        self.spans = {}  # phase name -> seconds, in first-seen order
+        self.profile = None  # sql_profiler.RequestProfile when profiling is on
+
+    def add(self, key, value=1):
+        self.stats[key] = self.stats.get(key, 0) + value
+
+    def add_span(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def begin_request(route):
+    _local.ctx = RequestContext(route or "unmatched")
+    return _local.ctx
+
+
+def current_context():
+    return getattr(_local, "ctx", None)
+
+
+def attach_context(ctx):
+    """Adopt a parent's request context (used by greenlets spawned for a request)."""
+    _local.ctx = ctx
+
+
+def end_request():
+    ctx = getattr(_local, "ctx", None)
+    _local.ctx = None
+    return ctx
+
+
+def current_route():
+    ctx = getattr(_local, "ctx", None)
+    return ctx.route if ctx else "background"
+
+
+@contextmanager
+def span(name):
+    """Time a named phase of the current request (no-op outside a request)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ctx = getattr(_local, "ctx", None)
+        if ctx is not None:
+            ctx.add_span(name, time.perf_counter() - started)
+
+
+def record_query(seconds):
+    ctx = getattr(_local, "ctx", None)
+    if ctx is not None:
+        ctx.stats["db_queries"] = ctx.stats.get("db_queries", 0) + 1
+        ctx.stats["db_seconds"] = ctx.stats.get("db_seconds", 0) + seconds
+
+
+def record_cache(cache_name, hit):
+    inc("cache_requests_total", {"cache": cache_name, "result": "hit" if hit else "miss"})
+    ctx = getattr(_local, "ctx", None)
+    if ctx is not None:
+        key = "cache_hits" if hit else "cache_misses"
+        ctx.stats[key] = ctx.stats.get(key, 0) + 1
+
+
+def finish_request(ctx, method, status_code):
+    """Record the request's duration, DB time and serialization time per route."""
+    total = ctx.elapsed()
+    labels = {"route": ctx.route, "method": method, "status": f"{status_code // 100}xx"}
+    observe("http_request_duration_seconds", total, labels)
+    route_labels = {"route": ctx.route}
+    observe("http_request_db_seconds", ctx.stats.get("db_seconds", 0), route_labels)
+    if "serialize" in ctx.spans:
+        observe("http_request_serialize_seconds", ctx.spans["serialize"], route_labels)
+    return total
+
+
+def server_timing(ctx, total=None):
+    """Server-Timing header value: total, db, cache, pool wait and any spans."""
+    if total is None:
+        total = ctx.elapsed()
+    stats = ctx.stats
+    parts = [f"total;dur={total * 1000:.1f}"]
+    if stats.get("db_queries"):
+        parts.append(f'db;dur={stats["db_seconds"] * 1000:.1f};desc="{stats["db_queries"]} queries"')
+    if stats.get("wait_ms"):
+        parts.append(f"pool;dur={stats['wait_ms']:.1f}")
+    if stats.get("cache_hits") or stats.get("cache_misses"):
+        parts.append(f'cache;desc="hit={stats.get("cache_hits", 0)} miss={stats.get("cache_misses", 0)}"')
+    for name, seconds in ctx.spans.items():
+        parts.append(f"{name};dur={seconds * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# ---------------------------------------------------------------- exposition
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _fmt_labels(key, extra=()):
+    pairs = list(key) + list(extra) + [("pid", os.getpid())]  # workers fork after import
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        counters = {name: dict(series) for name, series in _counters.items()}
+        histograms = {name: {k: list(v) for k, v in series.items()} for name, series in _histograms.items()}
+
+    for name, series in sorted(counters.items()):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in series.items():
+            lines.append(f"{name}{_fmt_labels(key)} {value}")
+
+    gauges = {}
+    for callback in _gauge_callbacks:
+        try:
+            for name, labels, value in callback():
+                gauges.setdefault(name, []).append((_key(labels), value))
+        except Exception as e:
+            print(f"[METRICS] gauge callback failed: {e}")
+    for name, series in sorted(gauges.items()):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} gauge")
+        for key, value in series:
+            lines.append(f"{name}{_fmt_labels(key)} {value}")
+
+    for name, series in sorted(histograms.items()):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, state in series.items():
+            for i, bound in enumerate(DEFAULT_BUCKETS):
+                lines.append(f"{name}_bucket{_fmt_labels(key, [('le', bound)])} {state[i]}")
+            lines.append(f"{name}_bucket{_fmt_labels(key, [('le', '+Inf')])} {state[-1]}")
+            lines.append(f"{name}_sum{_fmt_labels(key)} {state[-2]:.6f}")
+            lines.append(f"{name}_count{_fmt_labels(key)} {state[-1]}")
+
+    return "\n".join(lines) + "\n"
+
+
+describe("http_request_duration_seconds", "Request latency per route, method and status class")
+describe("http_request_db_seconds", "Time spent in execute_query per request")
+describe("http_request_serialize_seconds", "Time spent serializing JSON responses per request")
+describe("cache_requests_total", "In-process cache lookups by key prefix and result")
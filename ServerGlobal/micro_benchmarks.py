@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the pure-Python helpers that run for every row of every listing.
+
+Each benchmark is calibrated to roughly --min-time seconds per round and run for
+--rounds rounds. It reports the median ops/sec (with min/max over rounds) and,
+from one traced call, the number of memory blocks allocated and the peak
+traced memory (tracemalloc).
+
+Fixtures are built deterministically at realistic sizes: 10k categories,
+5k books, playlists of 200 tracks. URL helpers use r2:// refs with a public
+domain (the production path), so nothing touches the network or the disk.
+
+History: --save appends the run (with the git commit) to
+micro_benchmarks_history.jsonl. --compare checks this run against the last
+saved one and exits 1 when ops/sec dropped more than --tolerance.
+
+Usage:
+    python micro_benchmarks.py                     # all benchmarks
+    python micro_benchmarks.py -k library -k tree  # name filter
+    python micro_benchmarks.py --save --compare
+"""
+
+import os
+
+# Before importing api: public-domain R2 URLs, no presigning and no R2 client
+os.environ.setdefault("R2_PUBLIC_DOMAIN", "https://cdn.bench.local")
+
+import argparse
+import datetime
+import json
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import api
+
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_benchmarks_history.jsonl")
+DEFAULT_TOLERANCE = 0.10
+
+CATEGORY_COUNT = 10_000
+BOOK_COUNT = 5_000
+TRACKS_PER_PLAYLIST = 200
+
+
+# ---------------------------------------------------------------- fixtures
+
+def make_categories(rng, count=CATEGORY_COUNT):
+    roots = max(1, count // 100)
+    categories = []
+    for i in range(1, count + 1):
+        parent = None if i <= roots else rng.randint(1, i - 1)
+        categories.append({"id": i, "name": f"Category {i}", "slug": f"cat-{i}", "parent_id": parent})
+    rng.shuffle(categories)  # DB order is not tree order
+    return categories
+
+
+def make_books(rng, count=BOOK_COUNT):
+    books = []
+    for i in range(1, count + 1):
+        playlist = rng.random() < 0.4
+        books.append({
+            "id": i,
+            "title": f"Book {i}",
+            "author": f"Author {i % 700}",
+            "audio_path": f"r2://AudioBooks/book_{i}/audio.mp3",
+            "cover_image_path": f"r2://BookCovers/cover_{i}.jpg",
+            "category_slug": f"cat-{rng.randint(1, 200)}",
+            "duration_seconds": rng.randint(600, 40_000),
+            "premium": rng.random() < 0.3,
+            "average_rating": round(rng.uniform(1, 5), 2) if rng.random() < 0.7 else None,
+            "rating_count": rng.randint(0, 500),
+            "playlist_count": rng.randint(2, 40) if playlist else 0,
+            "background_music_id": rng.choice([None, None, 1, 2]),
+        })
+    return books
+
+
+def make_playlist_progress(rng, tracks=TRACKS_PER_PLAYLIST):
+    current = rng.randint(0, tracks - 1)
+    items = []
+    for t in range(tracks):
+        duration = rng.randint(300, 2400)
+        items.append({
+            "duration": duration,
+            "last_position": duration if t < current else (rng.randint(0, duration) if t == current else 0),
+            "is_completed": t < current,
+        })
+    return {"tracks": items}, sum(track["duration"] for track in items)
+
+
+# ---------------------------------------------------------------- benchmarks
+
+def build_benchmarks():
+    rng = random.Random(1234)
+    categories = make_categories(rng)
+    small_categories = make_categories(rng, 1_000)
+    books = make_books(rng)
+    fav_ids = {b["id"] for b in rng.sample(books, 300)}
+    progress, playlist_duration = make_playlist_progress(rng)
+    single_progress = {"single_progress": 12_345}
+    stored_paths = [b["audio_path"] for b in books]
+    relative_paths = [f"book_{i}/chapter_{i % 20}.mp3" for i in range(len(books))]
+    covers = [b["cover_image_path"] for b in books]
+
+    return {
+        # Whole /categories tree; quadratic in the category count
+        "build_category_tree[1k]": lambda: api.build_category_tree(small_categories),
+        "build_category_tree[10k]": lambda: api.build_category_tree(categories),
+        "resolve_cover_urls[5k r2]": lambda: [api.resolve_cover_urls(c) for c in covers],
+        "resolve_stored_url[5k r2]": lambda: [api.resolve_stored_url(p) for p in stored_paths],
+        "resolve_stored_url[5k relative]": lambda: [api.resolve_stored_url(p) for p in relative_paths],
+        "listened_percentage[200 tracks]": lambda: api.listened_percentage(playlist_duration, True, progress),
+        "listened_percentage[single]": lambda: api.listened_percentage(40_000, False, single_progress),
+        "library_book_json[5k]": lambda: [api.library_book_json(b, fav_ids) for b in books],
+    }
+
+
+# ---------------------------------------------------------------- runner
+
+def _calibrate(fn, min_time):
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or loops >= 1_000_000:
+            return loops, elapsed
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)))
+
+
+def _allocations(fn):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        fn()
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return blocks, peak
+
+
+def run_benchmark(fn, rounds, min_time):
+    fn()  # warm caches (thumbnail lookups, lazy imports)
+    loops, _ = _calibrate(fn, min_time)
+    rates = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        rates.append(loops / (time.perf_counter() - started))
+    blocks, peak = _allocations(fn)
+    return {
+        "ops_per_sec": round(statistics.median(rates), 3),
+        "min_ops_per_sec": round(min(rates), 3),
+        "max_ops_per_sec": round(max(rates), 3),
+        "loops": loops,
+        "alloc_blocks": blocks,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _last_saved():
+    if not os.path.exists(HISTORY_FILE):
+        return None
+    last = None
+    with open(HISTORY_FILE) as f:
+        for line in f:
+            if line.strip():
+                last = json.loads(line)
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for hot pure-Python helpers")
+    parser.add_argument("-k", action="append", default=[], help="Only run benchmarks whose name contains this")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Target seconds per round")
+    parser.add_argument("--save", action="store_true", help=f"Append results to {os.path.basename(HISTORY_FILE)}")
+    parser.add_argument("--compare", action="store_true", help="Compare with the last saved run")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    benchmarks = {name: fn for name, fn in build_benchmarks().items()
+                  if not args.k or any(k in name for k in args.k)}
+    previous = _last_saved() if args.compare else None
+
+    print(f"{'BENCHMARK':<36} {'OPS/SEC':>14} {'MIN':>12} {'MAX':>12} {'BLOCKS':>9} {'PEAK KiB':>10}")
+    print("-" * 98)
+    results = {}
+    for name, fn in benchmarks.items():
+        r = results[name] = run_benchmark(fn, args.rounds, args.min_time)
+        print(f"{name:<36} {r['ops_per_sec']:>14,.2f} {r['min_ops_per_sec']:>12,.2f} {r['max_ops_per_sec']:>12,.2f} "
+              f"{r['alloc_blocks']:>9,} {r['peak_kib']:>10,.1f}")
+
+    if args.save:
+        record = {"created_at": datetime.datetime.now().isoformat(timespec="seconds"), "commit": _git_commit(),
+                  "python": sys.version.split()[0], "results": results}
+        with open(HISTORY_FILE, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"\nSaved to {HISTORY_FILE}")
+
+    if previous:
+        slower = []
+        for name, r in results.items():
+            before = previous["results"].get(name)
+            if before and r["ops_per_sec"] < before["ops_per_sec"] * (1 - args.tolerance):
+                slower.append(f"{name}: {before['ops_per_sec']:,.2f} -> {r['ops_per_sec']:,.2f} ops/sec")
+        if slower:
+            print(f"\nSlower than {previous.get('commit') or 'last run'}:")
+            for line in slower:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {previous.get('commit') or 'last run'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Convert playback_history into a monthly range-partitioned table, online.
+
+Steps (each one is safe to re-run; the copy resumes where it stopped):
+1. Create playback_history_new PARTITION BY RANGE (start_time) with monthly
+   partitions covering existing data (+ MONTHS_AHEAD) and a default partition.
+2. Install a trigger on playback_history that logs every inserted/updated/
+   deleted id into playback_history_migration_log.
+3. Copy rows up to the current max id in batches, one short transaction each.
+4. Replay the change log (delete + re-copy the touched ids) until it is small.
+5. Briefly block writers, replay the remainder and swap the table names.
+   The old table is kept as playback_history_unpartitioned until --drop-old.
+
+Usage:
+    python partition_playback_history.py                     # full migration
+    python partition_playback_history.py --batch-size 20000 --sleep 0.05
+    python partition_playback_history.py --drop-old          # after verifying
+"""
+
+import argparse
+import datetime
+import time
+
+from database import Database
+from listening_rollup import create_rollup_table
+from playback_partitions import (
+    DEFAULT_PARTITION, MONTHS_AHEAD, add_months, month_start, partition_name, is_partitioned,
+)
+
+NEW_TABLE = "playback_history_new"
+OLD_TABLE = "playback_history_unpartitioned"
+LOG_TABLE = "playback_history_migration_log"
+DEFAULT_BATCH_SIZE = 10000
+REPLAY_BATCH_SIZE = 5000
+SWAP_THRESHOLD = 2000  # replay under lock once fewer than this many ids are pending
+
+COLUMNS = "id, user_id, book_id, playlist_item_id, start_time, end_time, played_seconds, carried_seconds"
+SELECT_COLUMNS = ("id, user_id, book_id, playlist_item_id, "
+                  "COALESCE(start_time, end_time, CURRENT_TIMESTAMP), end_time, played_seconds, carried_seconds")
+
+
+def run(db, query, params=None):
+    """Execute in its own transaction; raise on failure (migration must stop)."""
+    cursor = db.connection.cursor()
+    try:
+        cursor.execute(query, params)
+        db.connection.commit()
+        return cursor.rowcount
+    except Exception:
+        db.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def create_partitioned_table(db):
+    seq = db.execute_query("SELECT pg_get_serial_sequence('playback_history', 'id') AS seq")[0]['seq']
+    print(f"Creating {NEW_TABLE} (ids from {seq})...")
+    run(db, f"""
+        CREATE TABLE IF NOT EXISTS {NEW_TABLE} (
+            id INT NOT NULL DEFAULT nextval('{seq}'),
+            user_id INT NOT NULL,
+            book_id INT NOT NULL,
+            playlist_item_id INT DEFAULT NULL,
+            start_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            end_time TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+            played_seconds INT DEFAULT 0,
+            carried_seconds INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (id, start_time),
+            CONSTRAINT fk_playback_part_user FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            CONSTRAINT fk_playback_part_book FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
+            CONSTRAINT fk_playback_part_item FOREIGN KEY (playlist_item_id) REFERENCES playlist_items(id) ON DELETE CASCADE
+        ) PARTITION BY RANGE (start_time)
+    """)
+    # A table left by an earlier run of this script was created without the book FK
+    run(db, f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'fk_playback_part_book') THEN
+                ALTER TABLE {NEW_TABLE} ADD CONSTRAINT fk_playback_part_book
+                    FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE;
+            END IF;
+        END
+        $$
+    """)
+
+    # Indexes are created on the parent and cascade to every partition
+    for ddl in (
+        f"CREATE INDEX IF NOT EXISTS idx_playback_part_user_book_track ON {NEW_TABLE} (user_id, book_id, playlist_item_id)",
+        f"CREATE INDEX IF NOT EXISTS idx_playback_part_user_book ON {NEW_TABLE} (user_id, book_id, played_seconds)",
+        f"CREATE INDEX IF NOT EXISTS idx_playback_part_user_start ON {NEW_TABLE} (user_id, start_time)",
+        f"CREATE INDEX IF NOT EXISTS idx_playback_part_item ON {NEW_TABLE} (playlist_item_id)",
+        f"CREATE INDEX IF NOT EXISTS idx_playback_part_book ON {NEW_TABLE} (book_id)",
+        f"CREATE INDEX IF NOT EXISTS idx_playback_part_single_latest ON {NEW_TABLE} (user_id, book_id, id DESC) "
+        f"WHERE playlist_item_id IS NULL",
+    ):
+        run(db, ddl)
+
+    bounds = db.execute_query("SELECT MIN(COALESCE(start_time, end_time))::date AS first FROM playback_history")
+    first = bounds[0]['first'] if bounds and bounds[0]['first'] else datetime.date.today()
+    month = month_start(first)
+    last = add_months(month_start(datetime.date.today()), MONTHS_AHEAD)
+    created = 0
+    while month <= last:
+        run(db, f"""
+            CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {NEW_TABLE}
+            FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')
+        """)
+        created += 1
+        month = add_months(month, 1)
+    run(db, f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {NEW_TABLE} DEFAULT")
+    print(f"  {created} monthly partition(s) + default")
+
+
+def install_change_log(db):
+    print("Installing change-capture trigger...")
+    run(db, f"CREATE TABLE IF NOT EXISTS {LOG_TABLE} (seq BIGSERIAL PRIMARY KEY, id INT NOT NULL)")
+    run(db, f"""
+        CREATE OR REPLACE FUNCTION playback_history_migration_capture()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO {LOG_TABLE} (id) VALUES (OLD.id);
+            ELSE
+                INSERT INTO {LOG_TABLE} (id) VALUES (NEW.id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    # One run() so there's no committed moment without the trigger (writes there would be lost)
+    run(db, """
+        DROP TRIGGER IF EXISTS trg_playback_history_migration ON playback_history;
+        CREATE TRIGGER trg_playback_history_migration
+        AFTER INSERT OR UPDATE OR DELETE ON playback_history
+        FOR EACH ROW EXECUTE FUNCTION playback_history_migration_capture()
+    """)
+
+
+def copy_rows(db, batch_size, pause):
+    # Everything above the high-water mark arrives through the change log
+    hwm = db.execute_query("SELECT COALESCE(MAX(id), 0) AS hwm FROM playback_history")[0]['hwm']
+    done = db.execute_query(f"SELECT COALESCE(MAX(id), 0) AS done FROM {NEW_TABLE} WHERE id <= %s", (hwm,))[0]['done']
+    print(f"Copying ids {done + 1}..{hwm} in batches of {batch_size}...")
+
+    copied = 0
+    started = time.time()
+    while done < hwm:
+        upper = min(done + batch_size, hwm)
+        copied += run(db, f"""
+            INSERT INTO {NEW_TABLE} ({COLUMNS})
+            SELECT {SELECT_COLUMNS} FROM playback_history
+            WHERE id > %s AND id <= %s
+        """, (done, upper))
+        done = upper
+        if pause:
+            time.sleep(pause)
+        if copied and copied % (batch_size * 10) < batch_size:
+            rate = copied / max(time.time() - started, 0.001)
+            print(f"  copied {copied} rows (id {done}/{hwm}, {rate:.0f} rows/s)")
+    print(f"  copied {copied} rows in {time.time() - started:.1f}s")
+
+
+def replay_changes(cursor, limit=None):
+    """Re-sync ids from the change log. Returns the number of ids replayed."""
+    limit_sql = f"LIMIT {int(limit)}" if limit else ""
+    cursor.execute(f"""
+        WITH taken AS (
+            DELETE FROM {LOG_TABLE}
+            WHERE seq IN (SELECT seq FROM {LOG_TABLE} ORDER BY seq {limit_sql})
+            RETURNING id
+        )
+        SELECT DISTINCT id FROM taken
+    """)
+    ids = [row[0] for row in cursor.fetchall()]
+    if not ids:
+        return 0
+    cursor.execute(f"DELETE FROM {NEW_TABLE} WHERE id = ANY(%s)", (ids,))
+    cursor.execute(f"""
+        INSERT INTO {NEW_TABLE} ({COLUMNS})
+        SELECT {SELECT_COLUMNS} FROM playback_history WHERE id = ANY(%s)
+    """, (ids,))
+    return len(ids)
+
+
+def catch_up(db):
+    print("Replaying changes captured during the copy...")
+    while True:
+        pending = db.execute_query(f"SELECT COUNT(*) AS c FROM {LOG_TABLE}")[0]['c']
+        if pending < SWAP_THRESHOLD:
+            return
+        cursor = db.connection.cursor()
+        try:
+            replayed = replay_changes(cursor, REPLAY_BATCH_SIZE)
+            db.connection.commit()
+            print(f"  replayed {replayed} ids ({pending} log entries pending)")
+        except Exception:
+            db.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def swap(db):
+    print("Swapping tables (writers blocked briefly)...")
+    cursor = db.connection.cursor()
+    try:
+        cursor.execute("SET LOCAL lock_timeout = '5s'")
+        # Blocks INSERT/UPDATE/DELETE, still allows reads
+        cursor.execute("LOCK TABLE playback_history IN SHARE ROW EXCLUSIVE MODE")
+        replayed = replay_changes(cursor)
+        cursor.execute("DROP TRIGGER IF EXISTS trg_playback_history_migration ON playback_history")
+        cursor.execute(f"ALTER TABLE playback_history RENAME TO {OLD_TABLE}")
+        cursor.execute(f"ALTER TABLE {NEW_TABLE} RENAME TO playback_history")
+        seq = None
+        cursor.execute(f"SELECT pg_get_serial_sequence('{OLD_TABLE}', 'id')")
+        row = cursor.fetchone()
+        if row:
+            seq = row[0]
+        if seq:
+            cursor.execute(f"ALTER TABLE {OLD_TABLE} ALTER COLUMN id DROP DEFAULT")
+            cursor.execute(f"ALTER SEQUENCE {seq} OWNED BY playback_history.id")
+        db.connection.commit()
+        print(f"  swapped ({replayed} final ids replayed); old table kept as {OLD_TABLE}")
+    except Exception:
+        db.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    run(db, f"DROP TABLE IF EXISTS {LOG_TABLE}")
+    run(db, "DROP FUNCTION IF EXISTS playback_history_migration_capture()")
+
+
+def verify(db):
+    old = db.execute_query(f"SELECT COUNT(*) AS c, COALESCE(SUM(played_seconds), 0) AS s FROM {OLD_TABLE}")[0]
+    new = db.execute_query("SELECT COUNT(*) AS c, COALESCE(SUM(played_seconds), 0) AS s FROM playback_history")[0]
+    print(f"Verify: old={old['c']} rows / {old['s']}s, new={new['c']} rows / {new['s']}s")
+
+
+def migrate(batch_size=DEFAULT_BATCH_SIZE, pause=0.0):
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database.")
+        return False
+
+    try:
+        if is_partitioned(db):
+            print("playback_history is already partitioned.")
+            return True
+
+        # carried_seconds must exist on the source before copying
+        create_rollup_table(db)
+        create_partitioned_table(db)
+        install_change_log(db)
+        copy_rows(db, batch_size, pause)
+        catch_up(db)
+        swap(db)
+        verify(db)
+        print("Migration successful.")
+        return True
+    except Exception as e:
+        print(f"Error during migration: {e}")
+        print("The source table is untouched; fix the problem and re-run to resume.")
+        return False
+    finally:
+        db.disconnect()
+
+
+def drop_old():
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database.")
+        return
+    try:
+        run(db, f"DROP TABLE IF EXISTS {OLD_TABLE}")
+        print(f"Dropped {OLD_TABLE}.")
+    except Exception as e:
+        print(f"Error dropping {OLD_TABLE}: {e}")
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partition playback_history by month (online)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--sleep", type=float, default=0.0, help="Pause between copy batches (seconds)")
+    parser.add_argument("--drop-old", action="store_true", help=f"Drop {OLD_TABLE} after a successful migration")
+    args = parser.parse_args()
+    if args.drop_old:
+        drop_old()
+    else:
+        migrate(args.batch_size, args.sleep)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Monthly range partitions for playback_history, plus the retention policy.
+
+After partition_playback_history.py has converted the table, playback_history
+is partitioned by RANGE (start_time) into playback_history_yYYYYmMM tables
+(plus playback_history_default as a safety net). This module keeps future
+partitions created and prunes old ones:
+
+1. The rollup rows for the partition's month are rebuilt from its rows, so
+   heatmaps and totals survive the raw data (listening_rollup.reconcile_rollups).
+2. Rows that progress percentages still need are carried forward into the
+   current month: unfinished tracks and the latest row of each single-file
+   book. carried_seconds records what was already credited to the rollup.
+3. The partition is detached (kept as a standalone table) or dropped.
+
+Retention is opt-in: set PLAYBACK_HISTORY_RETENTION_MONTHS (and optionally
+PLAYBACK_HISTORY_RETENTION_MODE=drop) or pass --months. Run daily from cron:
+
+    30 3 * * * cd /var/www/server_global && ./venv/bin/python playback_partitions.py >> /var/log/echo_cron.log 2>&1
+"""
+
+import argparse
+import datetime
+import os
+import re
+
+from database import Database
+from listening_rollup import reconcile_rollups
+
+PARTITION_PREFIX = "playback_history_y"
+DEFAULT_PARTITION = "playback_history_default"
+MONTHS_AHEAD = 2
+
+RETENTION_MONTHS = int(os.getenv('PLAYBACK_HISTORY_RETENTION_MONTHS', '0'))  # 0 = keep everything
+RETENTION_MODE = os.getenv('PLAYBACK_HISTORY_RETENTION_MODE', 'detach')     # 'detach' or 'drop'
+
+_PARTITION_RE = re.compile(r"^playback_history_y(\d{4})m(\d{2})$")
+
+
+def month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    index = day.year * 12 + (day.month - 1) + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARTITION_PREFIX}{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned(db):
+    result = db.execute_query("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = 'playback_history'
+        ) AS partitioned
+    """)
+    return bool(result and result[0]['partitioned'])
+
+
+def list_partitions(db):
+    """
+    Attached monthly partitions, oldest first.
+
+    Returns:
+        list: [(month_start_date, table_name)]
+    """
+    rows = db.execute_query("""
+        SELECT c.relname AS name
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'playback_history'
+    """) or []
+    partitions = []
+    for row in rows:
+        match = _PARTITION_RE.match(row['name'])
+        if match:
+            partitions.append((datetime.date(int(match.group(1)), int(match.group(2)), 1), row['name']))
+    return sorted(partitions)
+
+
+def retained_since(db):
+    """
+    First day still backed by playback_history rows, for reconcile_rollups(floor_day=...).
+
+    Returns:
+        date, or None when the table is not partitioned (nothing is ever pruned)
+    """
+    if not is_partitioned(db):
+        return None
+    partitions = list_partitions(db)
+    return partitions[0][0] if partitions else None
+
+
+def create_partition(db, month):
+    """Create the partition for `month` if it doesn't exist. Returns True on success."""
+    name = partition_name(month)
+    result = db.execute_query(f"""
+        CREATE TABLE IF NOT EXISTS {name} PARTITION OF playback_history
+        FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')
+    """)
+    if result is None:
+        # Typically rows for this month already landed in the default partition
+        print(f"[PARTITIONS] Could not create {name}; check {DEFAULT_PARTITION} for rows in that range")
+        return False
+    return True
+
+
+def ensure_partitions(db, months_ahead=MONTHS_AHEAD):
+    """Make sure partitions exist from the current month through `months_ahead` months."""
+    current = month_start(datetime.date.today())
+    created = 0
+    existing = {name for _, name in list_partitions(db)}
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if partition_name(month) not in existing and create_partition(db, month):
+            print(f"[PARTITIONS] Created {partition_name(month)}")
+            created += 1
+    return created
+
+
+def prune_partition(db, month, name, mode=RETENTION_MODE):
+    """
+    Summarize, carry forward and detach/drop one monthly partition.
+
+    Returns:
+        bool: True if the partition was removed from playback_history
+    """
+    next_month = add_months(month, 1)
+
+    # 1. Rollups for this month become the only record of its listening
+    written = reconcile_rollups(db, from_day=month, to_day=next_month)
+    if written is None:
+        print(f"[PARTITIONS] Rollup reconcile failed for {name}; keeping partition")
+        return False
+
+    cursor = db.connection.cursor()
+    try:
+        # 2a. Unfinished tracks: their row is still the track's progress.
+        # Updating start_time moves the row into the current partition.
+        cursor.execute("""
+            UPDATE playback_history ph
+            SET start_time = CURRENT_TIMESTAMP, carried_seconds = ph.played_seconds
+            WHERE ph.start_time >= %s AND ph.start_time < %s
+              AND ph.playlist_item_id IS NOT NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM user_completed_tracks uct
+                  WHERE uct.user_id = ph.user_id AND uct.track_id = ph.playlist_item_id
+              )
+        """, (month, next_month))
+        carried_tracks = cursor.rowcount
+
+        # 2b. Single-file books: keep the newest row per user/book if it lives here
+        cursor.execute("""
+            UPDATE playback_history ph
+            SET start_time = CURRENT_TIMESTAMP, carried_seconds = ph.played_seconds
+            FROM (
+                SELECT DISTINCT ON (user_id, book_id) id, start_time
+                FROM playback_history
+                WHERE playlist_item_id IS NULL
+                ORDER BY user_id, book_id, id DESC
+            ) latest
+            WHERE ph.id = latest.id
+              AND latest.start_time >= %s AND latest.start_time < %s
+              AND ph.start_time >= %s AND ph.start_time < %s
+        """, (month, next_month, month, next_month))
+        carried_singles = cursor.rowcount
+
+        # 3. Detach (and optionally drop) in the same transaction, so nobody sees
+        # the carried rows next to their originals
+        cursor.execute(f"ALTER TABLE playback_history DETACH PARTITION {name}")
+        if mode == 'drop':
+            cursor.execute(f"DROP TABLE {name}")
+
+        db.connection.commit()
+        action = "Dropped" if mode == 'drop' else "Detached"
+        print(f"[PARTITIONS] {action} {name} ({written} rollup rows, "
+              f"carried {carried_tracks} track rows and {carried_singles} single-file rows)")
+        return True
+    except Exception as e:
+        db.connection.rollback()
+        print(f"[PARTITIONS] Failed to prune {name}: {e}")
+        return False
+    finally:
+        cursor.close()
+
+
+def apply_retention(db, retention_months=RETENTION_MONTHS, mode=RETENTION_MODE):
+    """
+    Prune partitions entirely older than `retention_months` full months.
+
+    Returns:
+        int: Number of partitions pruned
+    """
+    if retention_months <= 0:
+        return 0
+    cutoff = add_months(month_start(datetime.date.today()), -retention_months)
+    pruned = 0
+    for month, name in list_partitions(db):
+        if month < cutoff and prune_partition(db, month, name, mode):
+            pruned += 1
+    return pruned
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain playback_history partitions")
+    parser.add_argument("--months", type=int, default=RETENTION_MONTHS,
+                        help="Keep this many full months before the current one (0 = keep all)")
+    parser.add_argument("--mode", choices=["detach", "drop"], default=RETENTION_MODE)
+    parser.add_argument("--ahead", type=int, default=MONTHS_AHEAD, help="Future months to pre-create")
+    args = parser.parse_args()
+
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database")
+        return
+
+    try:
+        if not is_partitioned(db):
+            print("[PARTITIONS] playback_history is not partitioned; run partition_playback_history.py first")
+            return
+        created = ensure_partitions(db, args.ahead)
+        pruned = apply_retention(db, args.months, args.mode)
+        print(f"[PARTITIONS] Created {created} partition(s), pruned {pruned} partition(s)")
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Offline item-item recommendations from co-listening.
+
+Builds a sparse user x book interaction matrix from user_books, favorites and
+recent playback_history, computes item-item cosine similarity with SciPy sparse
+products, and writes two precomputed tables:
+
+    book_neighbors(book_id, neighbor_id, score, rank)      top --k per book
+    user_recommendations(user_id, book_id, score, rank)    top --top-n per user
+
+Both are keyed by (id, rank), so the API serves "because you listened to X"
+(/recommendations, /books/<id>/similar) and the per-user shelf with a primary
+key range scan instead of computing anything per request.
+
+Interaction weights (summed per user/book):
+- started a book (user_books row with progress): STARTED_WEIGHT
+- finished it (is_read):                         COMPLETED_WEIGHT
+- favorited it:                                  FAVORITE_WEIGHT
+- listened to it in the last --window-days:      ln(1 + hours), capped at LISTEN_CAP
+
+Each user's row is divided by ln(2 + books touched), so heavy listeners don't
+dominate every pair. Similarity is cosine with an additive shrinkage term in
+the denominator, which pushes down pairs backed by only a few listeners.
+
+Tables are built under a _next name, indexed after the load, and swapped in
+with a rename, so readers never see a half-written table.
+
+Usage:
+    python recommendations.py                     # nightly job
+    python recommendations.py --k 30 --top-n 50
+    python recommendations.py --dry-run           # compute and report only
+"""
+
+import argparse
+import io
+import time
+
+import numpy as np
+from scipy import sparse
+
+from database import Database
+
+DEFAULT_K = 20
+DEFAULT_TOP_N = 30
+DEFAULT_WINDOW_DAYS = 180
+DEFAULT_SHRINKAGE = 5.0
+BOOK_BLOCK = 1_000    # books per similarity block; bounds the block's co-occurrence matrix
+USER_BLOCK = 20_000   # users per scoring block
+FETCH_SIZE = 100_000
+COPY_ROWS = 200_000
+
+STARTED_WEIGHT = 1.0
+COMPLETED_WEIGHT = 3.0
+FAVORITE_WEIGHT = 2.0
+LISTEN_CAP = 3.0
+
+INTERACTIONS_SQL = """
+    SELECT user_id, book_id, SUM(weight)::float8 AS weight
+    FROM (
+        SELECT ub.user_id, ub.book_id,
+               CASE WHEN COALESCE(ub.is_read::int, 0) = 1 THEN %(completed)s ELSE %(started)s END AS weight
+        FROM user_books ub
+        WHERE ub.last_played_position_seconds > 0 OR COALESCE(ub.is_read::int, 0) = 1
+        UNION ALL
+        SELECT user_id, book_id, %(favorite)s FROM favorites
+        UNION ALL
+        SELECT user_id, book_id, LEAST(%(listen_cap)s, LN(1 + SUM(played_seconds) / 3600.0))
+        FROM playback_history
+        WHERE start_time >= NOW() - make_interval(days => %(window_days)s)
+          AND book_id IS NOT NULL
+        GROUP BY user_id, book_id
+    ) interactions
+    GROUP BY user_id, book_id
+"""
+
+TABLES = {
+    "book_neighbors": ("book_id INT NOT NULL, neighbor_id INT NOT NULL, score REAL NOT NULL, rank SMALLINT NOT NULL",
+                       ["book_id", "neighbor_id", "score", "rank"], "book_id, rank"),
+    "user_recommendations": ("user_id INT NOT NULL, book_id INT NOT NULL, score REAL NOT NULL, rank SMALLINT NOT NULL",
+                             ["user_id", "book_id", "score", "rank"], "user_id, rank"),
+}
+
+
+# ---------------------------------------------------------------- load
+
+def load_interactions(db, window_days):
+    """(user_ids, book_ids, matrix): CSR users x books with summed weights."""
+    params = {
+        "started": STARTED_WEIGHT, "completed": COMPLETED_WEIGHT, "favorite": FAVORITE_WEIGHT,
+        "listen_cap": LISTEN_CAP, "window_days": window_days,
+    }
+    chunks = []
+    # Server-side cursor: rows are streamed, not materialized client-side at once
+    cursor = db.connection.cursor(name="recommendation_interactions")
+    try:
+        cursor.itersize = FETCH_SIZE
+        cursor.execute(INTERACTIONS_SQL, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+    finally:
+        cursor.close()
+        db.connection.commit()
+
+    if not chunks:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), sparse.csr_matrix((0, 0), dtype=np.float32)
+
+    data = np.concatenate(chunks)
+    user_ids, rows = np.unique(data[:, 0].astype(np.int64), return_inverse=True)
+    book_ids, cols = np.unique(data[:, 1].astype(np.int64), return_inverse=True)
+    matrix = sparse.csr_matrix((data[:, 2].astype(np.float32), (rows, cols)),
+                               shape=(len(user_ids), len(book_ids)))
+    matrix.sum_duplicates()
+    return user_ids, book_ids, matrix
+
+
+def normalize_users(matrix):
+    """Scale each user row by 1 / ln(2 + books touched)."""
+    counts = np.diff(matrix.indptr)
+    scale = (1.0 / np.log(2.0 + counts)).astype(np.float32)
+    scaled = matrix.copy()
+    scaled.data *= np.repeat(scale, counts)
+    return scaled
+
+
+# ---------------------------------------------------------------- top-k
+
+def top_k_rows(block, k, row_offset=0):
+    """Top k entries of every row of a CSR block: (rows, cols, scores, ranks), best first."""
+    counts = np.diff(block.indptr)
+    rows = np.repeat(np.arange(block.shape[0]), counts)
+    if not len(rows):
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([], dtype=np.float32), empty
+    order = np.lexsort((-block.data, rows))
+    rows, cols, scores = rows[order], block.indices[order], block.data[order]
+    starts = np.repeat(block.indptr[:-1], counts)
+    ranks = np.arange(len(rows)) - starts
+    keep = ranks < k
+    return rows[keep] + row_offset, cols[keep], scores[keep], ranks[keep] + 1
+
+
+def item_neighbors(matrix, k, shrinkage, block_size=BOOK_BLOCK):
+    """Top-k cosine neighbours per book as a CSR books x books matrix (self excluded)."""
+    n_books = matrix.shape[1]
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel()).astype(np.float32)
+    by_book = matrix.T.tocsr()
+    parts = []
+    for lo in range(0, n_books, block_size):
+        hi = min(lo + block_size, n_books)
+        co = (by_book[lo:hi] @ matrix).tocsr()  # (hi - lo) x n_books dot products
+        row_books = np.repeat(np.arange(lo, hi), np.diff(co.indptr))
+        co.data /= norms[row_books] * norms[co.indices] + shrinkage
+        co.data[co.indices == row_books] = 0.0
+        co.eliminate_zeros()
+        parts.append(top_k_rows(co, k, row_offset=lo))
+
+    rows, cols, scores, _ = (np.concatenate(p) for p in zip(*parts))
+    return sparse.csr_matrix((scores, (rows, cols)), shape=(n_books, n_books), dtype=np.float32)
+
+
+def user_scores(matrix, neighbors, top_n, block_size=USER_BLOCK):
+    """Yield (rows, cols, scores, ranks) per user block, excluding books the user already has."""
+    for lo in range(0, matrix.shape[0], block_size):
+        hi = min(lo + block_size, matrix.shape[0])
+        own = matrix[lo:hi]
+        scores = (own @ neighbors).tocsr()
+        seen = own.copy()
+        seen.data[:] = 1.0
+        scores = scores - scores.multiply(seen)
+        scores.eliminate_zeros()
+        yield top_k_rows(scores.tocsr(), top_n, row_offset=lo)
+
+
+# ---------------------------------------------------------------- write
+
+def _copy_chunks(*columns):
+    total = len(columns[0])
+    for lo in range(0, total, COPY_ROWS):
+        rows = zip(*(c[lo:lo + COPY_ROWS].tolist() for c in columns))
+        yield "".join(f"{a}\t{b}\t{s:.6g}\t{r}\n" for a, b, s, r in rows)
+
+
+def write_table(db, table, chunks):
+    """Load chunks into <table>_next, index it, then swap it in. Returns the row count."""
+    ddl, columns, key = TABLES[table]
+    staging = f"{table}_next"
+    cursor = db.connection.cursor()
+    try:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        cursor.execute(f"CREATE TABLE {staging} ({ddl})")
+        for chunk in chunks:
+            cursor.copy_from(io.StringIO(chunk), staging, columns=columns)
+        cursor.execute(f"ALTER TABLE {staging} ADD CONSTRAINT {staging}_pkey PRIMARY KEY ({key})")
+        cursor.execute(f"SELECT COUNT(*) FROM {staging}")
+        count = cursor.fetchone()[0]
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(f"ALTER TABLE {staging} RENAME TO {table}")
+        cursor.execute(f"ALTER INDEX {staging}_pkey RENAME TO {table}_pkey")
+        db.connection.commit()
+        cursor.execute(f"ANALYZE {table}")
+        db.connection.commit()
+        return count
+    except Exception:
+        db.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+# ---------------------------------------------------------------- orchestration
+
+def run(db, k=DEFAULT_K, top_n=DEFAULT_TOP_N, window_days=DEFAULT_WINDOW_DAYS,
+        shrinkage=DEFAULT_SHRINKAGE, dry_run=False):
+    started = time.perf_counter()
+    user_ids, book_ids, matrix = load_interactions(db, window_days)
+    print(f"[RECS] Loaded {matrix.nnz:,} interactions: {len(user_ids):,} users x {len(book_ids):,} books "
+          f"({time.perf_counter() - started:.1f}s)")
+    if not matrix.nnz:
+        print("[RECS] No interactions, nothing to do")
+        return
+
+    matrix = normalize_users(matrix)
+    neighbors = item_neighbors(matrix, k, shrinkage)
+    print(f"[RECS] Item neighbours: {neighbors.nnz:,} pairs ({time.perf_counter() - started:.1f}s)")
+
+    n_rows, n_cols, n_scores, n_ranks = top_k_rows(neighbors, k)
+    blocks = list(user_scores(matrix, neighbors, top_n))
+    print(f"[RECS] User shelves: {sum(len(b[0]) for b in blocks):,} rows ({time.perf_counter() - started:.1f}s)")
+    if dry_run:
+        return
+
+    count = write_table(db, "book_neighbors", _copy_chunks(
+        book_ids[n_rows], book_ids[n_cols], n_scores, n_ranks))
+    print(f"[RECS] book_neighbors: {count:,} rows")
+
+    def user_chunks():
+        for rows, cols, scores, ranks in blocks:
+            yield from _copy_chunks(user_ids[rows], book_ids[cols], scores, ranks)
+    count = write_table(db, "user_recommendations", user_chunks())
+    print(f"[RECS] user_recommendations: {count:,} rows ({time.perf_counter() - started:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild book_neighbors and user_recommendations")
+    parser.add_argument("--k", type=int, default=DEFAULT_K, help="Neighbours kept per book")
+    parser.add_argument("--top-n", type=int, default=DEFAULT_TOP_N, help="Recommendations kept per user")
+    parser.add_argument("--window-days", type=int, default=DEFAULT_WINDOW_DAYS,
+                        help="playback_history window used for listening weight")
+    parser.add_argument("--shrinkage", type=float, default=DEFAULT_SHRINKAGE)
+    parser.add_argument("--dry-run", action="store_true", help="Compute and report, don't write")
+    args = parser.parse_args()
+
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database")
+        return
+
+    try:
+        run(db, k=args.k, top_n=args.top_n, window_days=args.window_days,
+            shrinkage=args.shrinkage, dry_run=args.dry_run)
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+In-memory reels feed: the ordered ring of playable books and their payloads.
+
+/reels used to rank every book, count them, and JSON-aggregate the tracks of
+each selected book on every swipe. The feed is the same for every user except
+the starting offset and background music, so each worker process keeps one
+FeedSnapshot instead:
+
+- book_ids: playable books (with tracks or an audio file), newest first
+- payloads: book_id -> prebuilt response dict (URLs resolved, tracks built)
+- book_bg / default_bg_id: the book's own background music and the default,
+  so a request only overlays the user's choice
+- pools: global candidate orders for personalized reels (reels_state.py):
+  "fresh" (the ring itself) and "trending" (book_trending rank)
+
+Invalidation is version based. Statement triggers on books, playlist_items and
+background_music bump catalog_versions['books'] (and the other entries in
+VERSIONED_TABLES, used for ETags); statements that change no rows leave them
+alone. A worker checks that row (a
+primary-key lookup) at most every VERSION_CHECK_SECONDS and rebuilds when it
+moved. invalidate() forces a check on the next request after a write in this
+process. Snapshots are also rebuilt after MAX_AGE_SECONDS, and sooner when
+URLs are pre-signed, so no cached URL outlives its signature.
+
+Run once to create the version table and triggers (idempotent; run it again
+after trending.py has created book_trending):
+
+    python reels_feed.py
+"""
+
+import os
+import threading
+import time
+import zlib
+from array import array
+
+from database import Database
+from r2_storage import R2_PUBLIC_DOMAIN, R2_URL_EXPIRY
+
+VERSION_KEY = "books"
+
+# catalog_versions entries bumped by statement triggers on each table.
+# "books" drives this feed; "catalog" and "categories" drive the ETags of the
+# catalog endpoints (cache_utils.catalog_version).
+# book_ratings is left out on purpose: every rating would lock the shared row
+# and invalidate every ETag. Rating averages catch up with the next trending
+# refresh (book_trending) or ETag expiry; /library deltas get them from change_log.
+VERSIONED_TABLES = {
+    "books": ("books", "catalog"),
+    "playlist_items": ("books", "catalog"),
+    "background_music": ("books", "catalog", "categories"),
+    "categories": ("catalog", "categories"),
+    "book_categories": ("catalog",),
+    "book_trending": ("catalog",),
+    "quizzes": ("catalog",),
+    "quiz_questions": ("catalog",),
+}
+# Tables that used to bump catalog_versions; setup() drops their triggers
+UNVERSIONED_TABLES = ("book_ratings",)
+# One statement trigger per event: a transition table needs a single-event trigger
+TRIGGER_EVENTS = {
+    "ins": "INSERT REFERENCING NEW TABLE AS changed",
+    "upd": "UPDATE REFERENCING NEW TABLE AS changed",
+    "del": "DELETE REFERENCING OLD TABLE AS changed",
+    "trunc": "TRUNCATE",
+}
+VERSION_CHECK_SECONDS = float(os.getenv('REELS_VERSION_CHECK_SECONDS', '5'))
+MAX_AGE_SECONDS = int(os.getenv('REELS_FEED_MAX_AGE', '900'))
+if not R2_PUBLIC_DOMAIN:
+    MAX_AGE_SECONDS = min(MAX_AGE_SECONDS, R2_URL_EXPIRY // 2)
+
+BOOKS_SQL = """
+    SELECT b.id, b.title, b.author, b.audio_path, b.cover_image_path, b.duration_seconds,
+           b.description, b.posted_by_user_id, b.background_music_id, b.loudness_lufs,
+           translate(encode(b.waveform_peaks, 'base64'), E'\\n', '') AS waveform
+    FROM books b
+    ORDER BY b.id DESC
+"""
+
+TRACKS_SQL = """
+    SELECT pi.id, pi.book_id, pi.title, pi.file_path, pi.duration_seconds, pi.track_order, pi.loudness_lufs,
+           translate(encode(pi.waveform_peaks, 'base64'), E'\\n', '') AS waveform
+    FROM playlist_items pi
+    ORDER BY pi.book_id, pi.track_order
+"""
+
+DEFAULT_BG_SQL = "SELECT id FROM background_music ORDER BY is_default DESC, id ASC LIMIT 1"
+
+TRENDING_SQL = "SELECT book_id FROM book_trending WHERE score > 0 ORDER BY rank"
+
+
+def pool_checksum(book_ids):
+    """Order-sensitive checksum of a pool, identical in every worker for the same ids."""
+    return zlib.crc32(array("i", book_ids).tobytes())
+
+
+class FeedSnapshot:
+    """One immutable build of the feed. Requests only read it."""
+
+    __slots__ = ("version", "book_ids", "payloads", "book_bg", "default_bg_id", "pools", "pool_checksums", "built_at")
+
+    def __init__(self, version, book_ids, payloads, book_bg, default_bg_id, pools=None):
+        self.version = version
+        self.book_ids = book_ids
+        self.payloads = payloads
+        self.book_bg = book_bg
+        self.default_bg_id = default_bg_id
+        self.pools = pools or {}
+        self.pool_checksums = {name: pool_checksum(ids) for name, ids in self.pools.items()}
+        self.built_at = time.monotonic()
+
+    @property
+    def total(self):
+        return len(self.book_ids)
+
+    def window(self, offset, limit, user_bg=None):
+        """Up to limit payloads starting at offset (wrapping), with backgroundMusicId resolved."""
+        total = len(self.book_ids)
+        if not total:
+            return []
+        start = offset % total
+        return self.books([self.book_ids[(start + i) % total] for i in range(min(limit, total))], user_bg)
+
+    def books(self, book_ids, user_bg=None):
+        """Payloads for book_ids (skipping any no longer in the feed), with backgroundMusicId resolved."""
+        user_bg = user_bg or {}
+        books = []
+        for book_id in book_ids:
+            payload = self.payloads.get(book_id)
+            if payload is None:
+                continue
+            bg = user_bg.get(book_id) or self.book_bg.get(book_id) or self.default_bg_id
+            books.append(dict(payload, backgroundMusicId=bg))
+        return books
+
+
+class ReelsFeed:
+    """Per-process holder of the current FeedSnapshot.
+
+    Args:
+        build_book: fn(book_row, track_rows) -> payload dict, or None to leave
+                    the book out of the feed (nothing playable)
+    """
+
+    def __init__(self, build_book, max_age=MAX_AGE_SECONDS):
+        self._build_book = build_book
+        self._max_age = max_age
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Check the catalog version on the next request."""
+        self._checked_at = 0.0
+
+    def snapshot(self, db):
+        """Current snapshot, refreshed if the catalog version moved. None if the first build failed."""
+        snap = self._snapshot
+        if snap is not None and self._fresh(snap):
+            return snap
+        if snap is not None:
+            # Someone else is refreshing: keep serving the previous build meanwhile
+            if not self._lock.acquire(blocking=False):
+                return snap
+        else:
+            self._lock.acquire()
+        try:
+            snap = self._snapshot
+            if snap is not None and self._fresh(snap):
+                return snap
+            version = read_version(db)
+            if snap is not None and version is not None and version == snap.version \
+                    and time.monotonic() - snap.built_at < self._max_age:
+                self._checked_at = time.monotonic()
+                return snap
+            rebuilt = self.build(db, version)
+            if rebuilt is not None:
+                self._snapshot = rebuilt
+                self._checked_at = time.monotonic()
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+    def _fresh(self, snap):
+        now = time.monotonic()
+        return now - self._checked_at < VERSION_CHECK_SECONDS and now - snap.built_at < self._max_age
+
+    def build(self, db, version):
+        started = time.perf_counter()
+        books = db.execute_query(BOOKS_SQL)
+        tracks = db.execute_query(TRACKS_SQL)
+        default_bg = db.execute_query(DEFAULT_BG_SQL)
+        trending = db.execute_query(TRENDING_SQL) or []
+        if books is None or tracks is None:
+            print("[REELS] Feed build failed")
+            return None
+
+        tracks_by_book = {}
+        for track in tracks:
+            tracks_by_book.setdefault(track['book_id'], []).append(track)
+
+        book_ids, payloads, book_bg = [], {}, {}
+        for book in books:
+            payload = self._build_book(book, tracks_by_book.get(book['id'], []))
+            if payload is None:
+                continue
+            book_ids.append(book['id'])
+            payloads[book['id']] = payload
+            book_bg[book['id']] = book.get('background_music_id')
+
+        default_bg_id = default_bg[0]['id'] if default_bg else None
+        pools = {
+            "fresh": book_ids,
+            "trending": [row['book_id'] for row in trending if row['book_id'] in payloads],
+        }
+        print(f"[REELS] Feed built: {len(book_ids)} books, version {version}, "
+              f"{(time.perf_counter() - started) * 1000:.0f}ms")
+        return FeedSnapshot(version, book_ids, payloads, book_bg, default_bg_id, pools)
+
+
+def read_version(db):
+    """Current catalog version, or None if catalog_versions isn't set up."""
+    rows = db.execute_query("SELECT version FROM catalog_versions WHERE name = %s", (VERSION_KEY,))
+    return rows[0]['version'] if rows else None
+
+
+def drop_version_triggers(db, table):
+    """Drop table's catalog version triggers, including the older single-trigger form."""
+    for name in [f"trg_{table}_catalog_version"] + [f"trg_{table}_catalog_version_{s}" for s in TRIGGER_EVENTS]:
+        db.execute_query(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+
+
+def setup(db):
+    """Create catalog_versions and the triggers that bump it. Returns True on success."""
+    try:
+        with db.transaction():
+            db.execute_query("""
+                CREATE TABLE IF NOT EXISTS catalog_versions (
+                    name TEXT PRIMARY KEY,
+                    version BIGINT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            db.execute_query("""
+                CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+                BEGIN
+                    -- Nested IF: "changed" doesn't exist for TRUNCATE and must not be planned there
+                    IF TG_OP <> 'TRUNCATE' THEN
+                        IF NOT EXISTS (SELECT 1 FROM changed) THEN
+                            RETURN NULL;  -- statement touched no rows
+                        END IF;
+                    END IF;
+                    FOR i IN 0 .. TG_NARGS - 1 LOOP
+                        INSERT INTO catalog_versions (name, version) VALUES (TG_ARGV[i], 1)
+                        ON CONFLICT (name) DO UPDATE
+                        SET version = catalog_versions.version + 1, updated_at = CURRENT_TIMESTAMP;
+                    END LOOP;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """)
+            for table in UNVERSIONED_TABLES:
+                if db.execute_query("SELECT to_regclass(%s) IS NOT NULL AS found", (table,))[0]['found']:
+                    drop_version_triggers(db, table)
+            for table, keys in VERSIONED_TABLES.items():
+                for key in keys:
+                    db.execute_query(
+                        "INSERT INTO catalog_versions (name, version) VALUES (%s, 1) ON CONFLICT (name) DO NOTHING",
+                        (key,))
+                exists = db.execute_query("SELECT to_regclass(%s) IS NOT NULL AS found", (table,))
+                if not exists[0]['found']:
+                    print(f"[REELS] {table} missing, no version trigger (rerun after creating it)")
+                    continue
+                args = ", ".join(f"'{key}'" for key in keys)
+                drop_version_triggers(db, table)
+                for suffix, event in TRIGGER_EVENTS.items():
+                    db.execute_query(f"""
+                        CREATE TRIGGER trg_{table}_catalog_version_{suffix}
+                        AFTER {event} ON {table}
+                        FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version({args})
+                    """)
+        return True
+    except Exception as e:
+        print(f"[REELS] Catalog version setup failed: {e}")
+        return False
+
+
+def main():
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database")
+        return
+
+    try:
+        if setup(db):
+            print(f"[REELS] catalog_versions ready, version {read_version(db)}")
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Personalized reels ordering from per-user seen/completed bitmaps.
+
+Instead of one global sequence walked with users.reels_offset, each user's
+reels interleave candidate pools in POOL_PATTERN order:
+
+- personal: the user's user_recommendations (recommendations.py), cached per user
+- trending: book_trending rank (trending.py), from the feed snapshot
+- fresh:    every playable book, newest first, from the feed snapshot
+
+user_reels_state keeps, per user:
+- seen:      RoaringBitmap of books already served in this pass
+- completed: RoaringBitmap of finished books (never served again)
+- cursors:   {pool: [checksum, position]}, so each pool is read forward from
+             where the last request stopped; a cursor is reset when its pool's
+             checksum changes (pool rebuilt)
+- turn:      position in POOL_PATTERN, so the interleave carries across requests
+- served:    books served in this pass (returned as savedOffset)
+
+A request takes the next N books that are in neither bitmap. Cursors only move
+forward, so the work per request is N plus the entries skipped since the last
+request, with no scan of user_books. completed is bootstrapped from user_books
+once, when the row is created, and after that kept current by mark_completed()
+from the completion paths. When every pool is exhausted, seen is cleared and a
+new pass starts.
+
+Run once to create the table (idempotent):
+
+    python reels_state.py
+"""
+
+import json
+import os
+
+from cache_utils import cache
+from database import Database
+from reels_feed import pool_checksum
+from roaring import RoaringBitmap
+
+ENABLED = os.getenv('REELS_PERSONALIZED', 'true').lower() in ('1', 'true', 'yes')
+POOL_PATTERN = ("personal", "trending", "personal", "fresh")
+PERSONAL_POOL_SIZE = 200
+PERSONAL_POOL_TTL = 3600
+
+
+class ReelsState:
+    __slots__ = ("seen", "completed", "cursors", "turn", "served")
+
+    def __init__(self, seen=None, completed=None, cursors=None, turn=0, served=0):
+        self.seen = seen if seen is not None else RoaringBitmap()
+        self.completed = completed if completed is not None else RoaringBitmap()
+        self.cursors = cursors or {}
+        self.turn = turn
+        self.served = served
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(RoaringBitmap.from_bytes(row['seen']), RoaringBitmap.from_bytes(row['completed']),
+                   row['cursors'] or {}, row['turn'] or 0, row['served'] or 0)
+
+
+def next_books(state, pools, checksums, n, playable):
+    """Advance state and return up to n unseen, uncompleted, playable book ids.
+
+    Args:
+        pools: {name: [book_id, ...]} in preference order; names from POOL_PATTERN
+        checksums: {name: pool_checksum(pool)}, computed when the pool was built
+        playable: container of book ids currently in the feed
+    """
+    for name in pools:
+        cursor = state.cursors.get(name)
+        if not cursor or cursor[0] != checksums[name]:
+            state.cursors[name] = [checksums[name], 0]
+
+    picked = []
+    for new_pass in (False, True):
+        if new_pass:
+            if picked or not pools:
+                break
+            # Everything has been seen: start over, still skipping completed books
+            state.seen.clear()
+            state.served = 0
+            for name in pools:
+                state.cursors[name] = [checksums[name], 0]
+        idle = 0
+        while len(picked) < n and idle < len(POOL_PATTERN):
+            name = POOL_PATTERN[state.turn % len(POOL_PATTERN)]
+            state.turn = (state.turn + 1) % len(POOL_PATTERN)
+            pool = pools.get(name)
+            if not pool:
+                idle += 1
+                continue
+            cursor = state.cursors[name]
+            found = None
+            while cursor[1] < len(pool):
+                book_id = pool[cursor[1]]
+                cursor[1] += 1
+                if book_id in playable and book_id not in state.seen and book_id not in state.completed:
+                    found = book_id
+                    break
+            if found is None:
+                idle += 1
+                continue
+            idle = 0
+            state.seen.add(found)
+            picked.append(found)
+        if len(picked) >= n:
+            break
+
+    state.served += len(picked)
+    return picked
+
+
+def personal_pool(db, user_id):
+    """The user's precomputed recommendations, best first (cached)."""
+    cache_key = f"reels_pool:{user_id}"
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+    rows = db.execute_query(
+        "SELECT book_id FROM user_recommendations WHERE user_id = %s ORDER BY rank LIMIT %s",
+        (user_id, PERSONAL_POOL_SIZE),
+    )
+    pool = [row['book_id'] for row in rows or []]
+    cache.set(cache_key, pool, PERSONAL_POOL_TTL)
+    return pool
+
+
+def _bootstrap(db, user_id):
+    rows = db.execute_query(
+        "SELECT book_id FROM user_books WHERE user_id = %s AND COALESCE(is_read::int, 0) = 1", (user_id,))
+    return ReelsState(completed=RoaringBitmap(row['book_id'] for row in rows or []))
+
+
+def _save(db, user_id, state):
+    db.execute_query("""
+        INSERT INTO user_reels_state (user_id, seen, completed, cursors, turn, served, updated_at)
+        VALUES (%s, %s, %s, %s::jsonb, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id) DO UPDATE SET
+            seen = EXCLUDED.seen, completed = EXCLUDED.completed, cursors = EXCLUDED.cursors,
+            turn = EXCLUDED.turn, served = EXCLUDED.served, updated_at = EXCLUDED.updated_at
+    """, (user_id, state.seen.to_bytes(), state.completed.to_bytes(), json.dumps(state.cursors),
+          state.turn, state.served))
+
+
+def serve(db, user_id, feed, n, personal):
+    """
+    Pick the user's next n reels and persist the advanced state.
+
+    Args:
+        db: Database on the primary
+        feed: reels_feed.FeedSnapshot
+        personal: personal_pool() result
+
+    Returns:
+        tuple: (book_ids, served) or None if the state couldn't be read or written
+    """
+    pools = dict(feed.pools)
+    pools["personal"] = personal
+    checksums = dict(feed.pool_checksums)
+    checksums["personal"] = pool_checksum(personal)
+    try:
+        with db.transaction():
+            rows = db.execute_query(
+                "SELECT seen, completed, cursors, turn, served FROM user_reels_state WHERE user_id = %s FOR UPDATE",
+                (user_id,))
+            state = ReelsState.from_row(rows[0]) if rows else _bootstrap(db, user_id)
+            picked = next_books(state, pools, checksums, n, feed.payloads)
+            _save(db, user_id, state)
+        return picked, state.served
+    except Exception as e:
+        print(f"[REELS] State update failed for user {user_id}: {e}")
+        return None
+
+
+def mark_completed(db, user_id, book_id):
+    """
+    Record a finished book so reels never serve it again. No-op until the user has reels state.
+
+    Errors are swallowed, so call it outside the caller's transaction: a nested
+    db.transaction() joins the outer one and a failure here would abort it.
+    """
+    try:
+        with db.transaction():
+            rows = db.execute_query(
+                "SELECT completed FROM user_reels_state WHERE user_id = %s FOR UPDATE", (user_id,))
+            if not rows:
+                return
+            completed = RoaringBitmap.from_bytes(rows[0]['completed'])
+            if completed.add(int(book_id)):
+                db.execute_query(
+                    "UPDATE user_reels_state SET completed = %s, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s",
+                    (completed.to_bytes(), user_id))
+    except Exception as e:
+        print(f"[REELS] Failed to mark book {book_id} completed for user {user_id}: {e}")
+
+
+def setup(db):
+    """Create user_reels_state (idempotent). Returns True on success."""
+    try:
+        with db.transaction():
+            db.execute_query("""
+                CREATE TABLE IF NOT EXISTS user_reels_state (
+                    user_id INT PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                    seen BYTEA NOT NULL,
+                    completed BYTEA NOT NULL,
+                    cursors JSONB NOT NULL DEFAULT '{}'::jsonb,
+                    turn SMALLINT NOT NULL DEFAULT 0,
+                    served INT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+        return True
+    except Exception as e:
+        print(f"[REELS] State table setup failed: {e}")
+        return False
+
+
+def main():
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database")
+        return
+
+    try:
+        if setup(db):
+            print("[REELS] user_reels_state ready")
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
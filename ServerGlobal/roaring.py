@@ -0,0 +1,155 @@
+"""
+Roaring-style compressed bitmap for sets of non-negative 32-bit ints (book ids).
+
+Values are split by their high 16 bits into containers. A container holds the
+low 16 bits either as a sorted array of uint16 (2 bytes per value) or, once it
+has more than ARRAY_MAX values, as a fixed 65536-bit bitmap (8 KiB). So a
+user who has seen 300 books costs ~600 bytes, and a membership test is a
+bisect in one small container.
+
+Serialized layout (little endian), stored as BYTEA:
+
+    b"RB" | container count: u16
+    per container: key: u16 | kind: u8 (0 array, 1 bitmap) | cardinality - 1: u16
+    then the payloads in the same order: cardinality * u16, or 8192 bytes
+
+Only what the reels state needs is implemented: add, membership, iteration,
+len, clear and (de)serialization. No removal, so containers never shrink
+back to arrays.
+"""
+
+import bisect
+import struct
+import sys
+from array import array
+
+ARRAY_MAX = 4096
+BITMAP_BYTES = 8192
+MAGIC = b"RB"
+ARRAY, BITMAP = 0, 1
+
+_HEADER = struct.Struct("<2sH")
+_CONTAINER = struct.Struct("<HBH")
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+def _to_bitmap(values):
+    bits = bytearray(BITMAP_BYTES)
+    for low in values:
+        bits[low >> 3] |= 1 << (low & 7)
+    return bits
+
+
+def _bitmap_values(bits):
+    for byte_index, byte in enumerate(bits):
+        while byte:
+            lowest = byte & -byte
+            yield (byte_index << 3) | (lowest.bit_length() - 1)
+            byte ^= lowest
+
+
+def _cardinality(container):
+    if isinstance(container, bytearray):
+        return bin(int.from_bytes(container, "little")).count("1")
+    return len(container)
+
+
+class RoaringBitmap:
+    __slots__ = ("_keys", "_containers")
+
+    def __init__(self, values=()):
+        self._keys = []        # sorted high 16 bits
+        self._containers = []  # array('H') (sorted) or bytearray(BITMAP_BYTES), parallel to _keys
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        """Add value. Returns True if it was not already present."""
+        key, low = value >> 16, value & 0xFFFF
+        i = bisect.bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            self._keys.insert(i, key)
+            self._containers.insert(i, array("H", [low]))
+            return True
+        container = self._containers[i]
+        if isinstance(container, bytearray):
+            bit = 1 << (low & 7)
+            if container[low >> 3] & bit:
+                return False
+            container[low >> 3] |= bit
+            return True
+        j = bisect.bisect_left(container, low)
+        if j < len(container) and container[j] == low:
+            return False
+        container.insert(j, low)
+        if len(container) > ARRAY_MAX:
+            self._containers[i] = _to_bitmap(container)
+        return True
+
+    def __contains__(self, value):
+        key, low = value >> 16, value & 0xFFFF
+        i = bisect.bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return False
+        container = self._containers[i]
+        if isinstance(container, bytearray):
+            return bool(container[low >> 3] & (1 << (low & 7)))
+        j = bisect.bisect_left(container, low)
+        return j < len(container) and container[j] == low
+
+    def __len__(self):
+        return sum(_cardinality(c) for c in self._containers)
+
+    def __iter__(self):
+        for key, container in zip(self._keys, self._containers):
+            lows = _bitmap_values(container) if isinstance(container, bytearray) else container
+            for low in lows:
+                yield (key << 16) | low
+
+    def clear(self):
+        self._keys.clear()
+        self._containers.clear()
+
+    def to_bytes(self):
+        headers = [_HEADER.pack(MAGIC, len(self._keys))]
+        payloads = []
+        for key, container in zip(self._keys, self._containers):
+            if isinstance(container, bytearray):
+                headers.append(_CONTAINER.pack(key, BITMAP, _cardinality(container) - 1))
+                payloads.append(bytes(container))
+            else:
+                headers.append(_CONTAINER.pack(key, ARRAY, len(container) - 1))
+                if _BIG_ENDIAN:
+                    container = array("H", container)
+                    container.byteswap()
+                payloads.append(container.tobytes())
+        return b"".join(headers + payloads)
+
+    @classmethod
+    def from_bytes(cls, data):
+        bitmap = cls()
+        if not data:
+            return bitmap
+        data = bytes(data)
+        magic, count = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a serialized RoaringBitmap")
+        offset = _HEADER.size
+        headers = []
+        for _ in range(count):
+            headers.append(_CONTAINER.unpack_from(data, offset))
+            offset += _CONTAINER.size
+        for key, kind, cardinality in headers:
+            if kind == BITMAP:
+                container = bytearray(data[offset:offset + BITMAP_BYTES])
+                offset += BITMAP_BYTES
+            else:
+                size = (cardinality + 1) * 2
+                container = array("H")
+                container.frombytes(data[offset:offset + size])
+                if _BIG_ENDIAN:
+                    container.byteswap()
+                offset += size
+            bitmap._keys.append(key)
+            bitmap._containers.append(container)
+        return bitmap
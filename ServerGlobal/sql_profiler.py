@@ -0,0 +1,119 @@
+"""
+Opt-in per-request SQL profiler with N+1 detection.
+
+When SQL_PROFILER_ENABLED is set, Database.execute_query reports every
+statement here. Statements are reduced to a fingerprint (literals and
+placeholder lists collapsed, whitespace normalized), so the same query issued
+once per row of a loop shows up as one fingerprint with a high count.
+
+At the end of each request, report() flags requests that exceed any threshold:
+- more than SQL_PROFILER_MAX_QUERIES statements
+- any fingerprint repeated more than SQL_PROFILER_MAX_REPEATS times (N+1)
+- more than SQL_PROFILER_MAX_DB_MS of total DB time
+
+Flagged requests are written to the structured log as "sql_profile" warnings
+and counted in sql_profiler_flagged_total{route,reason}. Clients can send
+X-Debug-SQL: 1 to get an X-SQL-Profile summary header. Meant for staging and
+for short periods in production. It costs a regex pass per distinct statement
+(fingerprints are memoized) and a dict update per query.
+"""
+
+import functools
+import os
+import re
+
+import metrics
+import structured_log
+
+ENABLED = os.getenv('SQL_PROFILER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+MAX_QUERIES = int(os.getenv('SQL_PROFILER_MAX_QUERIES', '25'))
+MAX_REPEATS = int(os.getenv('SQL_PROFILER_MAX_REPEATS', '5'))
+MAX_DB_MS = float(os.getenv('SQL_PROFILER_MAX_DB_MS', '500'))
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(query):
+    """Normalize a statement so per-row variants of the same query compare equal."""
+    text = _COMMENT_RE.sub(" ", query)
+    text = _STRING_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    text = _IN_LIST_RE.sub("(?+)", text)
+    return _SPACE_RE.sub(" ", text).strip().lower()
+
+
+class RequestProfile:
+    __slots__ = ("count", "seconds", "by_fingerprint")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.by_fingerprint = {}  # fingerprint -> [count, seconds]
+
+    def repeated(self, min_count=2):
+        """[(fingerprint, count, seconds)] for fingerprints seen at least min_count times, worst first."""
+        rows = [(fp, c, s) for fp, (c, s) in self.by_fingerprint.items() if c >= min_count]
+        return sorted(rows, key=lambda r: r[1], reverse=True)
+
+
+def record(query, seconds):
+    ctx = metrics.current_context()
+    if ctx is None:
+        return
+    profile = ctx.profile
+    if profile is None:
+        profile = ctx.profile = RequestProfile()
+    profile.count += 1
+    profile.seconds += seconds
+    fp = fingerprint(query)
+    entry = profile.by_fingerprint.get(fp)
+    if entry is None:
+        profile.by_fingerprint[fp] = [1, seconds]
+    else:
+        entry[0] += 1
+        entry[1] += seconds
+
+
+def violations(profile):
+    reasons = []
+    if profile.count > MAX_QUERIES:
+        reasons.append("query_count")
+    if any(count > MAX_REPEATS for _, count, _ in profile.repeated(MAX_REPEATS + 1)):
+        reasons.append("n_plus_one")
+    if profile.seconds * 1000 > MAX_DB_MS:
+        reasons.append("db_time")
+    return reasons
+
+
+def summary_header(profile):
+    worst = profile.repeated()
+    top = worst[0][1] if worst else 1
+    return f"queries={profile.count};db_ms={profile.seconds * 1000:.1f};distinct={len(profile.by_fingerprint)};max_repeat={top}"
+
+
+def report(ctx, method, path):
+    """Log and count the request if it crossed a threshold. Returns the reasons."""
+    profile = ctx.profile if ctx is not None else None
+    if profile is None:
+        return []
+    reasons = violations(profile)
+    if not reasons:
+        return reasons
+    for reason in reasons:
+        metrics.inc("sql_profiler_flagged_total", {"route": ctx.route, "reason": reason})
+    structured_log.log(
+        "warning", "sql_profile", route=ctx.route,
+        method=method, path=path, reasons=reasons,
+        queries=profile.count, db_ms=round(profile.seconds * 1000, 1),
+        repeated=[{"sql": fp[:300], "count": count, "ms": round(seconds * 1000, 1)}
+                  for fp, count, seconds in profile.repeated()[:5]],
+    )
+    return reasons
+
+
+metrics.describe("sql_profiler_flagged_total", "Requests over a SQL profiler threshold, by route and reason")
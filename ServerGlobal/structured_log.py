@@ -0,0 +1,158 @@
+"""
+Structured request logging off the hot path.
+
+log() builds a small dict and puts it on a bounded in-memory queue; a
+background writer drains the queue in batches and writes one JSON object per
+line to stdout (gunicorn/systemd collect it as before). A request pays for a
+dict and a queue put instead of several flushed prints. When the queue is full,
+records are dropped and counted (log_records_dropped_total on /metrics) rather
+than blocking the request.
+
+Under gevent's monkey patching the writer is a greenlet. It still writes
+synchronously, but once per batch instead of once per line.
+
+Sampling (LOG_SAMPLE_RATES) applies to debug/info records only; warnings and
+errors are always kept. Rates are per route with a default, e.g.:
+
+    LOG_SAMPLE_RATES="default=1.0,/reels=0.05,/user/progress=0.1"
+
+Sensitive keys (passwords, tokens, keys) are redacted wherever they appear in
+the logged fields.
+"""
+
+import atexit
+import datetime
+import json
+import os
+import queue
+import random
+import sys
+import threading
+
+import metrics
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+MIN_LEVEL = LEVELS.get(os.getenv('LOG_LEVEL', 'info').lower(), 20)
+QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+BATCH_SIZE = 500
+
+SENSITIVE_KEYS = {
+    "password", "confirm_password", "new_password", "old_password", "current_password",
+    "token", "access_token", "refresh_token", "id_token", "purchase_token",
+    "authorization", "aes_key", "secret", "api_key", "code", "otp",
+}
+REDACTED = "[REDACTED]"
+MAX_VALUE_LENGTH = 200
+
+
+def _parse_rates(spec):
+    rates = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        route, rate = part.rsplit("=", 1)
+        try:
+            rates[route.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            print(f"[LOG] Ignoring bad sample rate: {part}")
+    return rates
+
+
+_sample_rates = _parse_rates(os.getenv('LOG_SAMPLE_RATES', ''))
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def should_sample(route, level):
+    if LEVELS[level] >= LEVELS["warning"]:
+        return True
+    rate = _sample_rates.get(route, _sample_rates.get("default", 1.0))
+    return rate >= 1.0 or random.random() < rate
+
+
+def redact(value):
+    """Copy of value with sensitive keys masked and long strings truncated."""
+    if isinstance(value, dict):
+        return {k: REDACTED if str(k).lower() in SENSITIVE_KEYS else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value[:20]]
+    if isinstance(value, str) and len(value) > MAX_VALUE_LENGTH:
+        return value[:MAX_VALUE_LENGTH] + "..."
+    return value
+
+
+def log(level, event, route=None, **fields):
+    """
+    Queue a structured record. Never blocks; drops the record if the queue is full.
+
+    Args:
+        level (str): debug, info, warning or error
+        event (str): Short event name, e.g. "request"
+        route (str): URL rule, used for sampling
+        **fields: Extra JSON-serializable fields (redacted before writing)
+    """
+    if LEVELS[level] < MIN_LEVEL or not should_sample(route, level):
+        return
+    record = {"ts": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds"),
+              "level": level, "event": event, "pid": os.getpid()}
+    if route is not None:
+        record["route"] = route
+    record.update(fields)
+    _ensure_writer()
+    try:
+        _queue.put_nowait(record)
+    except queue.Full:
+        metrics.inc("log_records_dropped_total")
+
+
+def _ensure_writer():
+    global _writer
+    # Started lazily so each forked gunicorn worker gets its own writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_forever, name="structured-log-writer", daemon=True)
+            _writer.start()
+
+
+def _format(record):
+    try:
+        return json.dumps(redact(record), default=str)
+    except Exception as e:
+        return json.dumps({"level": "error", "event": "log_format_failed", "error": str(e)})
+
+
+def _drain(first=None):
+    lines = [] if first is None else [_format(first)]
+    while len(lines) < BATCH_SIZE:
+        try:
+            lines.append(_format(_queue.get_nowait()))
+        except queue.Empty:
+            break
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+
+
+def _write_forever():
+    while True:
+        record = _queue.get()
+        try:
+            _drain(record)
+        except Exception as e:
+            print(f"[LOG] writer error: {e}")
+
+
+def flush():
+    """Write whatever is queued (used at exit)."""
+    try:
+        while not _queue.empty():
+            _drain()
+    except Exception:
+        pass
+
+
+atexit.register(flush)
+metrics.describe("log_records_dropped_total", "Structured log records dropped because the queue was full")
@@ -0,0 +1,117 @@
+"""
+Test script for the RoaringBitmap serialization stored in user_reels_state.
+Runs without a database: python test_roaring.py (or pytest test_roaring.py).
+"""
+
+import random
+import struct
+
+from roaring import ARRAY, ARRAY_MAX, BITMAP, RoaringBitmap
+
+
+def check_same(bitmap, values):
+    expected = sorted(set(values))
+    assert list(bitmap) == expected, "iteration differs from the inserted set"
+    assert len(bitmap) == len(expected), f"len {len(bitmap)} != {len(expected)}"
+    restored = RoaringBitmap.from_bytes(bitmap.to_bytes())
+    assert list(restored) == expected, "round-trip changed the contents"
+    assert restored.to_bytes() == bitmap.to_bytes(), "round-trip isn't byte-stable"
+    return restored
+
+
+def test_empty():
+    """Empty bitmaps and NULL/empty columns read back as empty"""
+    print("Testing empty bitmaps...")
+    check_same(RoaringBitmap(), [])
+    assert len(RoaringBitmap.from_bytes(None)) == 0
+    assert len(RoaringBitmap.from_bytes(b"")) == 0
+    print("✓ empty")
+
+
+def test_add_and_contains():
+    """add() reports new values; membership matches a set"""
+    print("Testing add/contains...")
+    bitmap = RoaringBitmap()
+    assert bitmap.add(42) is True
+    assert bitmap.add(42) is False
+    assert 42 in bitmap and 41 not in bitmap and 42 + 65536 not in bitmap
+    print("✓ add/contains")
+
+
+def test_array_to_bitmap_switch():
+    """Round-trips on both sides of the ARRAY_MAX container switch"""
+    print("Testing array -> bitmap switch...")
+    for count in (ARRAY_MAX - 1, ARRAY_MAX, ARRAY_MAX + 1, ARRAY_MAX * 3):
+        values = random.Random(count).sample(range(65536), count)
+        bitmap = RoaringBitmap(values)
+        restored = check_same(bitmap, values)
+        data = bitmap.to_bytes()
+        # First container header follows the 4-byte file header: key u16, kind u8, cardinality - 1 u16
+        _, kind, cardinality = struct.unpack_from("<HBH", data, 4)
+        assert kind == (BITMAP if count > ARRAY_MAX else ARRAY), f"{count} values stored as kind {kind}"
+        assert cardinality == count - 1, f"stored cardinality {cardinality + 1} != {count}"
+        size = len(data)
+        # Adding after a round-trip still works on the restored container
+        missing = next(v for v in range(65536) if v not in restored)
+        assert restored.add(missing) and missing in restored
+        print(f"✓ {count} values ({size} bytes)")
+
+
+def test_multiple_containers():
+    """Values spread over several high-16-bit keys, including the largest ids"""
+    print("Testing multi-container keys...")
+    rng = random.Random(7)
+    values = [0, 65535, 65536, 131071, 2 ** 31 - 1, 2 ** 32 - 1]
+    values += [(key << 16) | rng.randrange(65536) for key in rng.sample(range(65536), 50) for _ in range(20)]
+    values += [(3 << 16) | low for low in range(ARRAY_MAX + 100)]  # one bitmap among arrays
+    bitmap = RoaringBitmap(values)
+    restored = check_same(bitmap, values)
+    for value in rng.sample(range(2 ** 32), 2000):
+        assert (value in restored) == (value in set(values))
+    print(f"✓ {len(set(values))} values across {len(set(v >> 16 for v in values))} containers")
+
+
+def test_fuzz_against_set():
+    """Random adds checked against a Python set after each round-trip"""
+    print("Fuzzing against set()...")
+    rng = random.Random(2024)
+    for _ in range(50):
+        expected = set()
+        bitmap = RoaringBitmap()
+        for _ in range(rng.randrange(1, 6)):
+            for _ in range(rng.randrange(0, 3000)):
+                value = rng.randrange(1 << rng.choice((8, 16, 20, 32)))
+                assert bitmap.add(value) == (value not in expected)
+                expected.add(value)
+            bitmap = check_same(bitmap, expected)
+        bitmap.clear()
+        assert len(bitmap) == 0 and list(bitmap) == []
+    print("✓ fuzz")
+
+
+def test_rejects_foreign_bytes():
+    """Bytes that aren't a serialized bitmap raise ValueError"""
+    print("Testing bad input...")
+    try:
+        RoaringBitmap.from_bytes(b"XX\x00\x00")
+    except ValueError:
+        print("✓ bad magic rejected")
+    else:
+        raise AssertionError("bad magic accepted")
+
+
+if __name__ == "__main__":
+    print("\n🔍 Testing RoaringBitmap\n")
+    tests = [test_empty, test_add_and_contains, test_array_to_bitmap_switch,
+             test_multiple_containers, test_fuzz_against_set, test_rejects_foreign_bytes]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    if failed:
+        print(f"\n❌ {failed} test(s) failed\n")
+    else:
+        print("\n✅ All RoaringBitmap tests passed!\n")
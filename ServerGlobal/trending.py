@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Time-decayed trending score per book.
+
+Every signal is weighted by exp(-ln 2 * age / half-life), so a listen today
+counts twice as much as one a half-life ago:
+
+    score = LISTEN_WEIGHT   * sum(decay * listened hours)   playback_history
+          + COMPLETE_WEIGHT * sum(decay)                    finished books (user_books.is_read)
+          + RATING_WEIGHT   * sum(decay * (stars - 3))      book_ratings (low stars pull down)
+          + FAVORITE_WEIGHT * ln(1 + favorites)             favorites (no timestamp, so undecayed)
+
+Only signals from the last WINDOW_HALF_LIVES half-lives are read; older ones
+are worth under 2% and would only cost a scan of old playback partitions.
+
+Results go to book_trending(book_id, score, rank, ...), one row per book,
+replaced in a single transaction so readers always see a complete ranking.
+rank is dense 1..n (ties broken by newest book) and indexed, so "top N" is an
+index range scan. Consumers: /books?sort=popular, /discover topPicks and the
+"Trending Today" block of the daily emails.
+
+Meant to run from cron every 15 minutes:
+
+    */15 * * * * cd /var/www/server_global && ./venv/bin/python trending.py >> /var/log/echo_cron.log 2>&1
+
+Usage:
+    python trending.py                  # 7 day half-life
+    python trending.py --half-life 3
+"""
+
+import argparse
+import time
+
+from database import Database
+
+DEFAULT_HALF_LIFE_DAYS = 7.0
+WINDOW_HALF_LIVES = 6
+
+LISTEN_WEIGHT = 1.0
+COMPLETE_WEIGHT = 3.0
+RATING_WEIGHT = 1.5
+FAVORITE_WEIGHT = 2.0
+
+SCORE_SQL = """
+    WITH params AS (
+        SELECT NOW() AT TIME ZONE 'UTC' AS now_ts,
+               LN(2) / (%(half_life)s * 86400.0) AS decay_rate,
+               NOW() AT TIME ZONE 'UTC' - make_interval(days => %(window_days)s) AS since
+    ),
+    listens AS (
+        SELECT ph.book_id,
+               SUM(COALESCE(ph.played_seconds, 0)) AS listen_seconds,
+               SUM(EXP(-p.decay_rate * EXTRACT(EPOCH FROM p.now_ts - ph.start_time))
+                   * COALESCE(ph.played_seconds, 0) / 3600.0) AS decayed
+        FROM playback_history ph, params p
+        WHERE ph.start_time >= p.since AND ph.book_id IS NOT NULL
+        GROUP BY ph.book_id
+    ),
+    completions AS (
+        SELECT ub.book_id,
+               COUNT(*) AS completions,
+               SUM(EXP(-p.decay_rate * EXTRACT(EPOCH FROM p.now_ts - ub.last_accessed_at))) AS decayed
+        FROM user_books ub, params p
+        WHERE COALESCE(ub.is_read::int, 0) = 1 AND ub.last_accessed_at >= p.since
+        GROUP BY ub.book_id
+    ),
+    ratings AS (
+        SELECT br.book_id,
+               COUNT(*) AS ratings,
+               SUM(EXP(-p.decay_rate * EXTRACT(EPOCH FROM p.now_ts - COALESCE(br.updated_at, br.created_at)))
+                   * (br.stars - 3)) AS decayed
+        FROM book_ratings br, params p
+        WHERE COALESCE(br.updated_at, br.created_at) >= p.since
+        GROUP BY br.book_id
+    ),
+    favs AS (
+        SELECT book_id, COUNT(*) AS favorites FROM favorites GROUP BY book_id
+    ),
+    scored AS (
+        SELECT b.id AS book_id,
+               %(listen_weight)s * COALESCE(l.decayed, 0)
+                 + %(complete_weight)s * COALESCE(c.decayed, 0)
+                 + %(rating_weight)s * COALESCE(r.decayed, 0)
+                 + %(favorite_weight)s * LN(1 + COALESCE(f.favorites, 0)) AS score,
+               COALESCE(l.listen_seconds, 0) AS listen_seconds,
+               COALESCE(c.completions, 0) AS completions,
+               COALESCE(r.ratings, 0) AS ratings,
+               COALESCE(f.favorites, 0) AS favorites
+        FROM books b
+        LEFT JOIN listens l ON l.book_id = b.id
+        LEFT JOIN completions c ON c.book_id = b.id
+        LEFT JOIN ratings r ON r.book_id = b.id
+        LEFT JOIN favs f ON f.book_id = b.id
+    )
+    INSERT INTO book_trending (book_id, score, rank, listen_seconds, completions, ratings, favorites, updated_at)
+    SELECT book_id, score, ROW_NUMBER() OVER (ORDER BY score DESC, book_id DESC),
+           listen_seconds, completions, ratings, favorites, NOW() AT TIME ZONE 'UTC'
+    FROM scored
+"""
+
+
+def setup(db):
+    """Create book_trending and its rank index (idempotent). Returns True on success."""
+    try:
+        with db.transaction():
+            db.execute_query("""
+                CREATE TABLE IF NOT EXISTS book_trending (
+                    book_id INT PRIMARY KEY,
+                    score DOUBLE PRECISION NOT NULL,
+                    rank INT NOT NULL,
+                    listen_seconds BIGINT NOT NULL DEFAULT 0,
+                    completions INT NOT NULL DEFAULT 0,
+                    ratings INT NOT NULL DEFAULT 0,
+                    favorites INT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP NOT NULL
+                )
+            """)
+            db.execute_query("CREATE INDEX IF NOT EXISTS idx_book_trending_rank ON book_trending (rank)")
+        return True
+    except Exception as e:
+        print(f"[TRENDING] Setup failed: {e}")
+        return False
+
+
+def rebuild(db, half_life_days=DEFAULT_HALF_LIFE_DAYS):
+    """Recompute every book's score and rank. Returns the row count, or None on failure."""
+    params = {
+        "half_life": half_life_days,
+        "window_days": int(half_life_days * WINDOW_HALF_LIVES) + 1,
+        "listen_weight": LISTEN_WEIGHT,
+        "complete_weight": COMPLETE_WEIGHT,
+        "rating_weight": RATING_WEIGHT,
+        "favorite_weight": FAVORITE_WEIGHT,
+    }
+    try:
+        with db.transaction():
+            db.execute_query("DELETE FROM book_trending")
+            return db.execute_query(SCORE_SQL, params)
+    except Exception as e:
+        print(f"[TRENDING] Rebuild failed: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild book_trending")
+    parser.add_argument("--half-life", type=float, default=DEFAULT_HALF_LIFE_DAYS, help="Decay half-life in days")
+    args = parser.parse_args()
+
+    db = Database()
+    if not db.connect():
+        print("Failed to connect to database")
+        return
+
+    try:
+        if not setup(db):
+            return
+        started = time.time()
+        count = rebuild(db, args.half_life)
+        if count is not None:
+            print(f"[TRENDING] Ranked {count} books in {time.time() - started:.1f}s")
+    finally:
+        db.disconnect()
+
+
+if __name__ == "__main__":
+    main()
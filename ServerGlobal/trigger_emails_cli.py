@@ -132,13 +132,14 @@ def get_new_releases_html(db):
 
 def get_trending_books_html(db):
     """
-    Fetch 3 random books to feature as 'Trending Today'.
+    Fetch the top 3 books of book_trending (see trending.py) to feature as 'Trending Today'.
     """
     try:
         query = """
-            SELECT title, author, cover_image_path
-            FROM books
-            ORDER BY RANDOM()
+            SELECT b.title, b.author, b.cover_image_path
+            FROM book_trending bt
+            JOIN books b ON b.id = bt.book_id
+            ORDER BY bt.rank
             LIMIT 3
         """
         books = db.execute_query(query)